@@ -0,0 +1,216 @@
+"""
+Контроль допуска на приём событий, общий для REST и gRPC
+
+Запрос получает слот из ограниченного числа одновременно выполняемых;
+при нехватке слотов ждёт в ограниченной очереди не дольше queue_timeout.
+Лимит слотов подстраивается под наблюдаемую задержку MongoDB
+(mongo_operation_duration_seconds): при росте задержки выше цели лимит
+снижается пропорционально, при норме - плавно возвращается к максимуму.
+Поверх слотов действуют token bucket'ы на арендатора (JWT sub).
+
+Запрос сверх бюджета сразу получает Overloaded с Retry-After, поэтому
+при перегрузке растёт доля отказов, а не задержка принятых запросов.
+"""
+
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Callable, Deque, Optional, Tuple
+
+from app.metrics.prometheus_metrics import (
+    mongo_latency_totals, record_admission_rejection, update_admission_state
+)
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+
+
+class Overloaded(Exception):
+    """Запрос отклонён контролем допуска; повторить через retry_after секунд"""
+
+    def __init__(self, reason: str, retry_after: float):
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__(f"Service overloaded ({reason}), retry after {self.retry_after_header}s")
+
+    @property
+    def retry_after_header(self) -> str:
+        """Значение Retry-After: целые секунды, не меньше 1"""
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class TokenBuckets:
+    """Token bucket на арендатора; хранится не больше max_tenants bucket'ов"""
+
+    def __init__(self, rate: float, burst: float, max_tenants: int = 10000,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_tenants = max_tenants
+        self.clock = clock
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    def take(self, tenant: str, cost: float = 1) -> float:
+        """Списывает cost токенов; возвращает 0 или время до пополнения"""
+        now = self.clock()
+        tokens, updated = self._buckets.pop(tenant, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+
+        # Пачка больше burst допускается при полном bucket'е и уходит в долг
+        wait = 0.0
+        if tokens >= min(cost, self.burst):
+            tokens -= cost
+        else:
+            wait = (min(cost, self.burst) - tokens) / self.rate
+
+        self._buckets[tenant] = (tokens, now)
+        if len(self._buckets) > self.max_tenants:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_in_flight: int = 512,
+        min_in_flight: int = 16,
+        max_queue: int = 1024,
+        queue_timeout: float = 0.1,
+        latency_target: float = 0.05,
+        adjust_interval: float = 1.0,
+        retry_after: float = 1.0,
+        tenant_buckets: Optional[TokenBuckets] = None,
+        latency_source: Callable[[], Tuple[float, float]] = mongo_latency_totals,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_in_flight = max_in_flight
+        self.min_in_flight = min(min_in_flight, max_in_flight)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.latency_target = latency_target
+        self.adjust_interval = adjust_interval
+        self.retry_after = retry_after
+        self.tenant_buckets = tenant_buckets
+        self.latency_source = latency_source
+        self.clock = clock
+
+        self.limit = max_in_flight
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._last_adjust = clock()
+        self._last_totals = latency_source()
+
+    def _adjust_limit(self):
+        """Пересчитывает лимит по средней задержке MongoDB за интервал"""
+        now = self.clock()
+        if now - self._last_adjust < self.adjust_interval:
+            return
+        self._last_adjust = now
+
+        totals = self.latency_source()
+        duration = totals[0] - self._last_totals[0]
+        count = totals[1] - self._last_totals[1]
+        self._last_totals = totals
+        if count <= 0:
+            return
+
+        latency = duration / count
+        if latency > self.latency_target:
+            limit = int(self.limit * self.latency_target / latency)
+        else:
+            limit = self.limit + max(1, self.limit // 10)
+        limit = max(self.min_in_flight, min(self.max_in_flight, limit))
+        if limit != self.limit:
+            logger.info(f"Admission limit {self.limit} -> {limit} (mongo latency {latency * 1000:.1f}ms)")
+            self.limit = limit
+            self._wake()
+
+    def _wake(self):
+        # Слот передаётся ожидающему сразу, без повторной конкуренции
+        while self._waiters and self.in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def _release(self):
+        self.in_flight -= 1
+        self._wake()
+        update_admission_state(self.in_flight, len(self._waiters), self.limit)
+
+    def _reject(self, reason: str, retry_after: float):
+        record_admission_rejection(reason)
+        raise Overloaded(reason, retry_after)
+
+    async def _acquire(self):
+        self._adjust_limit()
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            self._reject("queue_full", self.retry_after)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # Слот выдан одновременно с таймаутом - возвращаем его
+                self._release()
+            else:
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self._reject("queue_timeout", self.retry_after)
+
+    @asynccontextmanager
+    async def admit(self, tenant: Optional[str] = None, cost: int = 1):
+        """Слот на время обработки; cost - число событий для bucket'а арендатора"""
+        if self.tenant_buckets is not None and tenant:
+            wait = self.tenant_buckets.take(tenant, cost)
+            if wait > 0:
+                self._reject("tenant_rate", wait)
+
+        await self._acquire()
+        update_admission_state(self.in_flight, len(self._waiters), self.limit)
+        try:
+            yield
+        finally:
+            self._release()
+
+
+class NoAdmission:
+    """Заглушка при ADMISSION_ENABLED=false"""
+
+    @asynccontextmanager
+    async def admit(self, tenant: Optional[str] = None, cost: int = 1):
+        yield
+
+
+def _tenant_buckets_from_env() -> Optional[TokenBuckets]:
+    rate = float(os.getenv("TENANT_RATE_LIMIT", "1000"))
+    if rate <= 0:
+        return None
+    return TokenBuckets(rate=rate, burst=float(os.getenv("TENANT_BURST", str(rate * 2))))
+
+
+# Общий для процесса контроллер приёма событий
+ingest_admission = AdmissionController(
+    max_in_flight=int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "512")),
+    min_in_flight=int(os.getenv("ADMISSION_MIN_IN_FLIGHT", "16")),
+    max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "1024")),
+    queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS", "100")) / 1000,
+    latency_target=float(os.getenv("ADMISSION_LATENCY_TARGET_MS", "50")) / 1000,
+    retry_after=float(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "1")),
+    tenant_buckets=_tenant_buckets_from_env(),
+) if ADMISSION_ENABLED else NoAdmission()
@@ -1,57 +1,194 @@
-from fastapi import APIRouter, HTTPException
-from datetime import datetime
-from app.db.redis import r
-from app.db.mongo import save_event
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse
+from pydantic import ValidationError
+from app.db.redis import publish_events
+from app.db.mongo import save_event, OUTBOX_ENABLED
+from app.db.connections import check_health
+from app.db.dedup import DuplicateEvent
+from app.admission import Overloaded, ingest_admission
+from app.auth.jwt_auth import bearer_token, tenant_from_token
+from app.ingest import ingest_events
+from app.metrics.prometheus_metrics import get_metrics
 from app.models.event import Event
 import logging
-from typing import Dict, Any
+import orjson
+import os
+from typing import Dict, Any, List, Optional
+
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "1000"))
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-@router.post("/events")
-async def receive_event(event: Event):
+
+@router.get("/metrics")
+async def metrics():
+    data, content_type = get_metrics()
+    return Response(content=data, media_type=content_type)
+
+
+@router.get("/health")
+async def health():
+    report = await check_health()
+    return JSONResponse(report, status_code=200 if report["status"] == "ok" else 503)
+
+
+def _tenant(request: Request) -> Optional[str]:
+    return tenant_from_token(bearer_token(request.headers.get("authorization")))
+
+
+def _orjson_response(content: Dict[str, Any]) -> Response:
+    return Response(content=orjson.dumps(content), media_type="application/json")
+
+
+# Тело описано для OpenAPI вручную: парсинг и валидация выполняются
+# одним вызовом model_validate_json, без промежуточного dict
+EVENT_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {"application/json": {"schema": Event.model_json_schema(by_alias=False)}},
+    }
+}
+
+
+@router.post("/events", openapi_extra=EVENT_REQUEST_BODY)
+async def receive_event(request: Request):
     try:
-        event_dict = event.dict(by_alias=True)
-        
-        # Очистка данных
-        event_dict = {k: v for k, v in event_dict.items() 
-                     if v is not None and k != '_id'}
-        
-        # Валидация timestamp
-        if isinstance(event_dict.get('timestamp'), str):
-            ts = event_dict['timestamp']
-            # Фикс формата (удаление лишних цифр)
-            if '.' in ts:
-                ts = ts.split('.')[0] + 'Z'
-            elif len(ts.split(':')[-1]) > 6:
-                ts = ts[:19] + 'Z'
+        event = Event.model_validate_json(await request.body())
+    except ValidationError as e:
+        raise RequestValidationError(e.errors(include_url=False))
+
+    try:
+        event_dict = event.model_dump(exclude={"id"}, exclude_none=True)
+
+        # Контроль допуска: при перегрузке 429 с Retry-After (app.admission)
+        async with ingest_admission.admit(_tenant(request)):
+            # Сохранение в MongoDB
             try:
-                event_dict['timestamp'] = datetime.fromisoformat(ts.replace('Z', ''))
-            except ValueError:
-                event_dict['timestamp'] = datetime.now()
+                result = await save_event(event_dict)
+                if not result.inserted_id:
+                    raise Exception("MongoDB insert failed")
 
-        # Сохранение в MongoDB
-        try:
-            result = await save_event(event_dict)
-            if not result.inserted_id:
-                raise Exception("MongoDB insert failed")
-            
-            event_id = str(result.inserted_id)
-            logger.info(f"Event saved with ID: {event_id}")
-            
-            # Публикация в Redis (временно отключено для тестирования)
-            # TODO: Исправить Redis Streams интеграцию
-            logger.info("Redis publishing temporarily disabled for testing")
-            
-            return {"status": "success", "id": event_id}
-            
-        except Exception as e:
-            logger.error(f"Database error: {str(e)}")
-            raise HTTPException(status_code=500, detail="Failed to save event")
-
-    except HTTPException:
+                event_id = str(result.inserted_id)
+                if isinstance(result, DuplicateEvent):
+                    return _orjson_response({"status": "success", "id": event_id, "duplicate": True})
+
+                # Лог на каждое событие только на DEBUG и без форматирования заранее
+                logger.debug("Event saved with ID: %s", event_id)
+
+                # Публикация в Redis; в режиме outbox её выполняет relay
+                if not OUTBOX_ENABLED:
+                    try:
+                        await publish_events([(event_id, event_dict)])
+                    except Exception as e:
+                        logger.error(f"Redis publish error: {str(e)}")
+
+                return _orjson_response({"status": "success", "id": event_id})
+
+            except Exception as e:
+                logger.error(f"Database error: {str(e)}")
+                raise HTTPException(status_code=500, detail="Failed to save event")
+
+    except (HTTPException, Overloaded):
         raise
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+class _UnparsedLine:
+    """Строка NDJSON, которая не разобралась как JSON"""
+
+    def __init__(self, error: orjson.JSONDecodeError):
+        self.error = error
+
+    def errors(self) -> List[Dict[str, Any]]:
+        # Тот же формат, что у ValidationError.errors()
+        return [{"type": "json_invalid", "loc": [], "msg": f"Invalid JSON: {self.error}"}]
+
+
+def _parse_ndjson_line(line: bytes) -> Any:
+    try:
+        return orjson.loads(line)
+    except orjson.JSONDecodeError as e:
+        return _UnparsedLine(e)
+
+
+def _parse_batch_body(body: bytes, content_type: str) -> List[Any]:
+    """Разбирает тело batch-запроса: JSON-массив или NDJSON.
+
+    Битая строка NDJSON не отклоняет тело целиком: она становится
+    элементом _UnparsedLine и получает свой результат error, как
+    невалидный элемент JSON-массива.
+    """
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        return [_parse_ndjson_line(line) for line in body.splitlines() if line.strip()]
+
+    items = orjson.loads(body)
+    if not isinstance(items, list):
+        raise ValueError("Ожидается JSON-массив событий")
+    return items
+
+
+@router.post("/events/batch")
+async def receive_events_batch(request: Request):
+    body = await request.body()
+    try:
+        items = _parse_batch_body(body, request.headers.get("content-type", ""))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid batch body: {e}")
+
+    if not items:
+        raise HTTPException(status_code=400, detail="Empty batch")
+    if len(items) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch too large: {len(items)} > {MAX_BATCH_SIZE}"
+        )
+
+    # Валидация за один проход; невалидные элементы не блокируют остальные
+    results: List[Dict[str, Any]] = [None] * len(items)
+    valid_indexes: List[int] = []
+    docs: List[Dict[str, Any]] = []
+    for i, item in enumerate(items):
+        if isinstance(item, _UnparsedLine):
+            results[i] = {"index": i, "status": "error", "error": item.errors()}
+            continue
+        try:
+            event = Event.model_validate(item)
+        except ValidationError as e:
+            results[i] = {"index": i, "status": "error", "error": e.errors(include_url=False)}
+            continue
+        valid_indexes.append(i)
+        docs.append(event.model_dump(exclude={"id"}, exclude_none=True))
+
+    try:
+        async with ingest_admission.admit(_tenant(request), cost=max(1, len(docs))):
+            saved, published = await ingest_events(docs)
+    except Overloaded:
+        raise
+    except Exception as e:
+        logger.error(f"Database error: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to save events")
+
+    accepted = 0
+    for pos, i in enumerate(valid_indexes):
+        outcome = saved[pos]
+        if isinstance(outcome, Exception):
+            results[i] = {"index": i, "status": "error", "error": str(outcome)}
+        else:
+            results[i] = {"index": i, "status": "success", "id": str(outcome)}
+            if isinstance(outcome, DuplicateEvent):
+                results[i]["duplicate"] = True
+            accepted += 1
+
+    logger.info(f"Batch saved: {accepted}/{len(items)} events")
+
+    return {
+        "status": "success" if accepted == len(items) else "partial",
+        "accepted": accepted,
+        "rejected": len(items) - accepted,
+        "published": published,
+        "results": results
+    }
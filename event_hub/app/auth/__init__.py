@@ -7,15 +7,21 @@ from .jwt_auth import (
     require_writer_role,
     require_reader_role,
     GRPCAuthInterceptor,
+    current_grpc_principal,
     require_graphql_auth,
+    bearer_token,
+    tenant_from_token,
     JWTAuthError
 )
 
 __all__ = [
     'get_current_user',
-    'require_writer_role', 
+    'require_writer_role',
     'require_reader_role',
     'GRPCAuthInterceptor',
+    'current_grpc_principal',
     'require_graphql_auth',
+    'bearer_token',
+    'tenant_from_token',
     'JWTAuthError'
-] 
\ No newline at end of file
+]
@@ -3,14 +3,26 @@ JWT авторизация для Event Hub
 """
 
 import jwt
+import contextvars
 import functools
-from typing import Optional, Dict, Any
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
 from fastapi import HTTPException, Depends, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from grpc import RpcError, StatusCode
+from grpc import StatusCode
 import grpc
 from graphql import GraphQLError
 
+from app.metrics.prometheus_metrics import record_auth_verification
+
+logger = logging.getLogger(__name__)
+
 # Публичный ключ для проверки токенов
 PUBLIC_KEY = """-----BEGIN PUBLIC KEY-----
 MIIBIjANBgkqhkiG9w0BAQEFAAOCAQ8AMIIBCgKCAQEAu1SU1LfVLPHCgcy6eldO
@@ -21,22 +33,183 @@ I15YK19Xz/0p3YC/EELFs0XoTETwwOhFeX9iDtHqiEvIdz4LSFJamaid4DbNtAsb
 IMHPrgxxPqXEVbHZX1Cm/c+nqo+E60VJFPdqifZccpY2lUfUKmagdcBczwIDAQAB
 -----END PUBLIC KEY-----"""
 
+# JWKS-файл с ключами для ротации (выбор по kid); без него - PUBLIC_KEY
+JWKS_FILE = os.getenv("JWT_JWKS_FILE")
+# Как часто проверять изменение JWKS-файла, с
+JWKS_RELOAD_INTERVAL = float(os.getenv("JWT_JWKS_RELOAD_INTERVAL", "30"))
+
+# Кэш проверенных токенов: запись живёт до exp, но не дольше max TTL
+TOKEN_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", "10000"))
+TOKEN_CACHE_MAX_TTL = float(os.getenv("JWT_CACHE_MAX_TTL", "300"))
+
 security = HTTPBearer()
 
+
 class JWTAuthError(Exception):
     """Ошибка JWT авторизации"""
     pass
 
-def verify_token(token: str) -> Dict[str, Any]:
-    """Проверяет JWT токен и возвращает payload"""
+
+class KeyStore:
+    """Ключи проверки подписи, разобранные один раз.
+
+    PEM разбирается при первом обращении; JWKS-файл перечитывается при
+    изменении mtime (не чаще reload_interval), после чего кэш токенов
+    сбрасывается.
+    """
+
+    def __init__(self, pem: str, jwks_file: Optional[str] = None, reload_interval: float = 30):
+        self.pem = pem
+        self.jwks_file = jwks_file
+        self.reload_interval = reload_interval
+        self.version = 0
+        self._default = None
+        self._keys: Dict[str, Any] = {}
+        self._mtime: Optional[float] = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def _load_jwks(self):
+        mtime = os.path.getmtime(self.jwks_file)
+        if mtime == self._mtime:
+            return
+        with open(self.jwks_file) as f:
+            jwk_set = jwt.PyJWKSet.from_dict(json.load(f))
+        self._keys = {key.key_id: key.key for key in jwk_set.keys}
+        self._default = jwk_set.keys[0].key if len(jwk_set.keys) == 1 else None
+        self._mtime = mtime
+        self.version += 1
+        logger.info(f"Loaded {len(self._keys)} JWT keys from {self.jwks_file}")
+
+    def refresh(self, force: bool = False):
+        if not self.jwks_file:
+            return
+        now = time.monotonic()
+        if not force and now - self._checked < self.reload_interval:
+            return
+        with self._lock:
+            self._checked = now
+            try:
+                self._load_jwks()
+            except Exception as e:
+                logger.error(f"Failed to load JWKS from {self.jwks_file}: {e}")
+
+    def key_for(self, kid: Optional[str]):
+        """Ключ по kid из заголовка токена"""
+        if not self.jwks_file:
+            if self._default is None:
+                self._default = jwt.algorithms.RSAAlgorithm(
+                    jwt.algorithms.RSAAlgorithm.SHA256
+                ).prepare_key(self.pem)
+            return self._default
+
+        self.refresh()
+        key = self._keys.get(kid) if kid else self._default
+        if key is None and kid:
+            # Неизвестный kid: ключ могли только что добавить
+            self.refresh(force=True)
+            key = self._keys.get(kid)
+        if key is None:
+            raise JWTAuthError("Недействительный токен")
+        return key
+
+
+class TokenCache:
+    """LRU проверенных токенов по SHA-256 токена"""
+
+    def __init__(self, max_size: int, max_ttl: float):
+        self.max_size = max_size
+        self.max_ttl = max_ttl
+        self.key_version = 0
+        self._entries: "OrderedDict[bytes, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest: bytes, key_version: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if key_version != self.key_version:
+                self._entries.clear()
+                self.key_version = key_version
+                return None
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            payload, expires_at = entry
+            if time.time() >= expires_at:
+                del self._entries[digest]
+                return None
+            self._entries.move_to_end(digest)
+            return payload
+
+    def put(self, digest: bytes, payload: Dict[str, Any]):
+        expires_at = time.time() + self.max_ttl
+        if isinstance(payload.get('exp'), (int, float)):
+            expires_at = min(expires_at, payload['exp'])
+        with self._lock:
+            self._entries[digest] = (payload, expires_at)
+            self._entries.move_to_end(digest)
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+key_store = KeyStore(PUBLIC_KEY, JWKS_FILE, JWKS_RELOAD_INTERVAL)
+token_cache = TokenCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_MAX_TTL)
+
+
+def _decode(token: str) -> Dict[str, Any]:
     try:
-        payload = jwt.decode(token, PUBLIC_KEY, algorithms=['RS256'])
-        return payload
+        kid = jwt.get_unverified_header(token).get('kid')
+        return jwt.decode(token, key_store.key_for(kid), algorithms=['RS256'])
     except jwt.ExpiredSignatureError:
         raise JWTAuthError("Токен истек")
     except jwt.InvalidTokenError:
         raise JWTAuthError("Недействительный токен")
 
+
+def verify_token(token: str) -> Dict[str, Any]:
+    """Проверяет JWT токен и возвращает payload.
+
+    Повторная проверка того же токена до его exp берётся из кэша без RSA.
+    """
+    start = time.perf_counter()
+    digest = hashlib.sha256(token.encode()).digest()
+    key_store.refresh()
+    payload = token_cache.get(digest, key_store.version)
+    if payload is not None:
+        record_auth_verification("hit", time.perf_counter() - start)
+        return payload
+
+    try:
+        payload = _decode(token)
+    except JWTAuthError:
+        record_auth_verification("error", time.perf_counter() - start)
+        raise
+    token_cache.put(digest, payload)
+    record_auth_verification("miss", time.perf_counter() - start)
+    return payload
+
+
+def bearer_token(authorization: Optional[str]) -> Optional[str]:
+    """Токен из значения заголовка Authorization: Bearer <token>"""
+    if authorization and authorization.startswith('Bearer '):
+        return authorization[7:]
+    return None
+
+
+def tenant_from_token(token: Optional[str]) -> Optional[str]:
+    """Арендатор (sub, для старых токенов user_id) из проверенного токена"""
+    if not token:
+        return None
+    try:
+        payload = verify_token(token)
+    except JWTAuthError:
+        return None
+    return payload.get('sub') or payload.get('user_id')
+
+
 def require_role(required_role: str):
     """Декоратор для проверки роли пользователя"""
     def decorator(func):
@@ -49,27 +222,28 @@ def require_role(required_role: str):
                     status_code=status.HTTP_401_UNAUTHORIZED,
                     detail="Токен не предоставлен"
                 )
-            
+
             try:
                 payload = verify_token(token)
                 user_role = payload.get('role')
-                
+
                 if user_role != required_role:
                     raise HTTPException(
                         status_code=status.HTTP_403_FORBIDDEN,
                         detail=f"Недостаточно прав. Требуется роль: {required_role}"
                     )
-                
+
                 return await func(*args, **kwargs)
             except JWTAuthError as e:
                 raise HTTPException(
                     status_code=status.HTTP_401_UNAUTHORIZED,
                     detail=str(e)
                 )
-        
+
         return wrapper
     return decorator
 
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> Dict[str, Any]:
     """Получает текущего пользователя из JWT токена"""
     try:
@@ -81,61 +255,138 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             detail=str(e)
         )
 
+
 def require_writer_role():
     """Декоратор для проверки роли writer"""
     return require_role('writer')
 
+
 def require_reader_role():
     """Декоратор для проверки роли reader"""
     return require_role('reader')
 
+
 # gRPC авторизация
-class GRPCAuthInterceptor(grpc.aio.ServicerContext):
-    """gRPC интерцептор для авторизации"""
-    
-    def __init__(self, servicer_context: grpc.aio.ServicerContext):
-        self._servicer_context = servicer_context
-        self._metadata = servicer_context.invocation_metadata()
-    
-    def get_token(self) -> Optional[str]:
-        """Извлекает токен из метаданных gRPC"""
-        for key, value in self._metadata:
-            if key == 'authorization':
-                if value.startswith('Bearer '):
-                    return value[7:]
-        return None
-    
-    def verify_grpc_auth(self, required_role: str = None):
-        """Проверяет авторизацию для gRPC"""
-        token = self.get_token()
+# Принципал текущего вызова; обработчик читает его через current_grpc_principal()
+_grpc_principal: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar(
+    "grpc_principal", default=None
+)
+
+
+def current_grpc_principal() -> Optional[Dict[str, Any]]:
+    """Payload токена, проверенного интерцептором для текущего вызова"""
+    return _grpc_principal.get()
+
+
+def _metadata_token(metadata) -> Optional[str]:
+    for key, value in metadata or ():
+        if key == 'authorization':
+            return bearer_token(value)
+    return None
+
+
+class GRPCAuthInterceptor(grpc.aio.ServerInterceptor):
+    """Проверка JWT для gRPC вызовов.
+
+    Токен читается из метаданных один раз на вызов, в том числе на весь
+    потоковый вызов (StreamEvents, SendEvents): сообщения внутри потока
+    повторно не проверяются. Проверка идёт через кэш verify_token.
+    method_roles - требуемая роль по полному имени метода; методы без
+    записи требуют только валидный токен.
+    """
+
+    def __init__(self, method_roles: Optional[Dict[str, str]] = None):
+        self.method_roles = method_roles or {}
+
+    def _authorize(self, method: str, metadata) -> Tuple[Optional[Dict[str, Any]], Optional[Tuple[StatusCode, str]]]:
+        token = _metadata_token(metadata)
         if not token:
-            raise RpcError(StatusCode.UNAUTHENTICATED, "Токен не предоставлен")
-        
+            return None, (StatusCode.UNAUTHENTICATED, "Токен не предоставлен")
         try:
             payload = verify_token(token)
-            if required_role and payload.get('role') != required_role:
-                raise RpcError(StatusCode.PERMISSION_DENIED, f"Недостаточно прав. Требуется роль: {required_role}")
-            return payload
         except JWTAuthError as e:
-            raise RpcError(StatusCode.UNAUTHENTICATED, str(e))
+            return None, (StatusCode.UNAUTHENTICATED, str(e))
+
+        required_role = self.method_roles.get(method)
+        if required_role and payload.get('role') != required_role:
+            return None, (StatusCode.PERMISSION_DENIED, f"Недостаточно прав. Требуется роль: {required_role}")
+        return payload, None
+
+    async def intercept_service(self, continuation, handler_call_details):
+        handler = await continuation(handler_call_details)
+        if handler is None:
+            return None
+
+        payload, error = self._authorize(handler_call_details.method, handler_call_details.invocation_metadata)
+        if error:
+            return _abort_handler(handler, *error)
+        return _with_principal(handler, payload)
+
+
+def _rpc_handler_factory(handler):
+    if handler.request_streaming and handler.response_streaming:
+        return handler.stream_stream, grpc.stream_stream_rpc_method_handler
+    if handler.request_streaming:
+        return handler.stream_unary, grpc.stream_unary_rpc_method_handler
+    if handler.response_streaming:
+        return handler.unary_stream, grpc.unary_stream_rpc_method_handler
+    return handler.unary_unary, grpc.unary_unary_rpc_method_handler
+
+
+def _abort_handler(handler, code: StatusCode, details: str):
+    """Обработчик того же типа, что и исходный, завершающий вызов ошибкой"""
+    _, factory = _rpc_handler_factory(handler)
+
+    async def abort(request, context):
+        await context.abort(code, details)
+
+    return factory(
+        abort,
+        request_deserializer=handler.request_deserializer,
+        response_serializer=handler.response_serializer,
+    )
+
+
+def _with_principal(handler, payload: Dict[str, Any]):
+    """Оборачивает обработчик: принципал выставляется в его контексте"""
+    behavior, factory = _rpc_handler_factory(handler)
+
+    if handler.response_streaming:
+        async def wrapped(request, context):
+            _grpc_principal.set(payload)
+            async for response in behavior(request, context):
+                yield response
+    else:
+        async def wrapped(request, context):
+            _grpc_principal.set(payload)
+            return await behavior(request, context)
+
+    return factory(
+        wrapped,
+        request_deserializer=handler.request_deserializer,
+        response_serializer=handler.response_serializer,
+    )
 
 # GraphQL авторизация
+
+
 def get_graphql_user(info) -> Optional[Dict[str, Any]]:
     """Получает пользователя из GraphQL контекста"""
     request = info.context.get('request')
     if not request:
         return None
-    
+
     auth_header = request.headers.get('authorization')
     if not auth_header or not auth_header.startswith('Bearer '):
         return None
-    
+
     token = auth_header[7:]
     try:
         return verify_token(token)
     except JWTAuthError:
         return None
 
+
 def require_graphql_auth(required_role: str = None):
     """Декоратор для GraphQL авторизации"""
     def decorator(func):
@@ -143,14 +394,14 @@ def require_graphql_auth(required_role: str = None):
             info = kwargs.get('info') or args[-1] if args else None
             if not info:
                 raise GraphQLError("Информация о запросе недоступна")
-            
+
             user = get_graphql_user(info)
             if not user:
                 raise GraphQLError("Требуется авторизация", extensions={'code': 'UNAUTHENTICATED'})
-            
+
             if required_role and user.get('role') != required_role:
                 raise GraphQLError("Недостаточно прав", extensions={'code': 'FORBIDDEN'})
-            
+
             return func(*args, **kwargs)
         return wrapper
-    return decorator 
\ No newline at end of file
+    return decorator
@@ -0,0 +1,160 @@
+"""
+Микробатчинг записей в MongoDB: одиночные insert'ы склеиваются в insert_many
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from app.metrics.prometheus_metrics import (
+    record_batch_flush,
+    record_mongo_operation,
+    update_coalescer_queue_depth,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def write_error(err: Dict[str, Any]) -> Exception:
+    """Исключение по элементу writeErrors из BulkWriteError"""
+    message = err.get("errmsg", "write error")
+    if err.get("code") == 11000:
+        return DuplicateKeyError(message, 11000, err)
+    return Exception(message)
+
+
+class WriteCoalescer:
+    """Копит документы из разных запросов и пишет их одним insert_many.
+
+    Сброс происходит при достижении max_batch документов или через
+    max_delay секунд после первого документа в пачке. Очередь ограничена
+    max_pending: при переполнении submit() ждёт освобождения места.
+    """
+
+    def __init__(
+        self,
+        collection,
+        max_batch: int = 500,
+        max_delay: float = 0.005,
+        max_pending: int = 10000,
+        max_concurrent_flushes: int = 4,
+    ):
+        self.collection = collection
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.max_concurrent_flushes = max_concurrent_flushes
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._full: Optional[asyncio.Event] = None
+        self._flush_slots: Optional[asyncio.Semaphore] = None
+        self._flushes: set = set()
+        self._batch: List[Tuple[Dict[str, Any], asyncio.Future]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def _ensure_started(self):
+        """Лениво запускает фоновый цикл в текущем event loop"""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._task and not self._task.done():
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._full = asyncio.Event()
+        self._flush_slots = asyncio.Semaphore(self.max_concurrent_flushes)
+        self._flushes = set()
+        self._task = loop.create_task(self._run())
+
+    async def submit(self, doc: Dict[str, Any]) -> Any:
+        """Ставит документ в очередь и возвращает его inserted_id"""
+        self._ensure_started()
+        future = self._loop.create_future()
+        await self._queue.put((doc, future))
+        depth = self._queue.qsize()
+        update_coalescer_queue_depth(depth)
+        if depth >= self.max_batch:
+            self._full.set()
+        return await future
+
+    def _drain(self, batch: List[Tuple[Dict[str, Any], asyncio.Future]]):
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+
+    async def _run(self):
+        while True:
+            # Текущая пачка хранится в self._batch, чтобы close() её не потерял
+            self._batch = batch = [await self._queue.get()]
+            self._drain(batch)
+
+            # Ждём добора пачки, но не дольше max_delay
+            if len(batch) < self.max_batch:
+                self._full.clear()
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.max_delay)
+                except asyncio.TimeoutError:
+                    pass
+                self._drain(batch)
+
+            update_coalescer_queue_depth(self._queue.qsize())
+
+            await self._flush_slots.acquire()
+            self._batch = []
+            task = asyncio.create_task(self._flush(batch))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch: List[Tuple[Dict[str, Any], asyncio.Future]]):
+        docs = [doc for doc, _ in batch]
+        start = time.perf_counter()
+        try:
+            await self.collection.insert_many(docs, ordered=False)
+            failed = {}
+        except BulkWriteError as e:
+            failed = {err["index"]: err for err in e.details.get("writeErrors", [])}
+        except Exception as e:
+            logger.error(f"Batch insert failed: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            duration = time.perf_counter() - start
+            record_batch_flush(len(batch), duration)
+            record_mongo_operation("insert_many", self.collection.name, duration)
+            self._flush_slots.release()
+
+        for i, (doc, future) in enumerate(batch):
+            if future.done():
+                continue
+            if i in failed:
+                future.set_exception(write_error(failed[i]))
+            else:
+                future.set_result(doc["_id"])
+
+    async def close(self):
+        """Дописывает всё, что осталось в очереди, и останавливает цикл"""
+        if not self._task or self._loop is not asyncio.get_running_loop():
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+        batch, self._batch = self._batch, []
+        self._drain(batch)
+        while batch:
+            await self._flush_slots.acquire()
+            await self._flush(batch)
+            batch = []
+            self._drain(batch)
+
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+        self._task = None
@@ -0,0 +1,89 @@
+"""
+Жизненный цикл общих для процесса соединений MongoDB и Redis
+
+Клиенты создаются в app.db.mongo и app.db.redis без подключения;
+open_connections вызывается при старте FastAPI и gRPC сервера, прогревает
+пулы и запускает сбор метрик их загрузки, close_connections закрывает пулы.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+from app.db.mongo import client, MONGO_MAX_POOL_SIZE
+from app.db.redis import r
+from app.metrics.prometheus_metrics import set_pool_max_size, update_pool_connections
+
+logger = logging.getLogger(__name__)
+
+# Период публикации загрузки пула Redis (у MongoDB метрики событийные)
+POOL_METRICS_INTERVAL = float(os.getenv("POOL_METRICS_INTERVAL", "5"))
+HEALTH_CHECK_TIMEOUT = float(os.getenv("HEALTH_CHECK_TIMEOUT", "2"))
+
+_metrics_task: Optional[asyncio.Task] = None
+
+
+def redis_pool_stats() -> Dict[str, int]:
+    """Загрузка пула Redis текущего процесса"""
+    pool = r.connection_pool
+    in_use = len(pool._in_use_connections)
+    # В BlockingConnectionPool очередь заполнена заглушками None
+    idle = sum(1 for conn in pool._available_connections if conn is not None)
+    return {"in_use": in_use, "idle": idle, "max": pool.max_connections}
+
+
+async def _publish_redis_pool_metrics():
+    while True:
+        stats = redis_pool_stats()
+        update_pool_connections("redis", stats["in_use"], stats["idle"])
+        await asyncio.sleep(POOL_METRICS_INTERVAL)
+
+
+async def _check(ping) -> Dict[str, Any]:
+    start = time.perf_counter()
+    try:
+        await asyncio.wait_for(ping(), HEALTH_CHECK_TIMEOUT)
+    except Exception as e:
+        return {"status": "error", "error": str(e) or type(e).__name__}
+    return {"status": "ok", "latency_ms": round((time.perf_counter() - start) * 1000, 2)}
+
+
+async def check_health() -> Dict[str, Any]:
+    """Проверка доступности MongoDB и Redis; проверки выполняются параллельно"""
+    mongo, redis_ = await asyncio.gather(
+        _check(lambda: client.admin.command("ping")),
+        _check(r.ping),
+    )
+    healthy = mongo["status"] == "ok" and redis_["status"] == "ok"
+    return {
+        "status": "ok" if healthy else "degraded",
+        "mongo": mongo,
+        "redis": {**redis_, "pool": redis_pool_stats()},
+    }
+
+
+async def open_connections():
+    """Подключение при старте процесса; недоступность хранилищ не фатальна"""
+    global _metrics_task
+    set_pool_max_size("mongo", MONGO_MAX_POOL_SIZE)
+    set_pool_max_size("redis", r.connection_pool.max_connections)
+
+    health = await check_health()
+    for name in ("mongo", "redis"):
+        if health[name]["status"] != "ok":
+            logger.warning(f"{name} is not reachable at startup: {health[name]['error']}")
+
+    if _metrics_task is None:
+        _metrics_task = asyncio.create_task(_publish_redis_pool_metrics())
+
+
+async def close_connections():
+    """Закрывает пулы; вызывается после остановки обработки запросов"""
+    global _metrics_task
+    if _metrics_task is not None:
+        _metrics_task.cancel()
+        _metrics_task = None
+    await r.aclose(close_connection_pool=True)
+    client.close()
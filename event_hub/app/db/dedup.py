@@ -0,0 +1,141 @@
+"""
+Идемпотентность приёма: повтор события с тем же idempotency_key
+возвращает id оригинала без второй записи
+
+Проверка в три уровня: LRU в памяти процесса, Redis SET NX GET с TTL
+(одна команда на событие, для пачки - один pipeline) и уникальный
+частичный индекс MongoDB на случай потери ключа в Redis.
+
+При посуточных партициях (EVENTS_STORAGE=daily) индекс уникален только
+внутри партиции: повтор, попавший в другие сутки, отсекает лишь Redis,
+и без ключа в Redis он будет записан второй раз.
+"""
+
+import logging
+import os
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_FIELD = "idempotency_key"
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_LRU_SIZE = int(os.getenv("IDEMPOTENCY_LRU_SIZE", "100000"))
+
+
+class DuplicateEvent:
+    """Исход записи повторного события: id оригинала, запись не выполнялась.
+
+    Совместим с InsertOneResult по атрибуту inserted_id.
+    """
+
+    def __init__(self, event_id: Any):
+        self.inserted_id = event_id
+
+    def __str__(self) -> str:
+        return str(self.inserted_id)
+
+
+def idempotency_redis_key(key: str) -> str:
+    return f"idem:{key}"
+
+
+class IdempotencyCache:
+    """Ограниченный LRU ключей с резервированием в Redis"""
+
+    def __init__(self, redis, max_size: int = IDEMPOTENCY_LRU_SIZE, ttl: int = IDEMPOTENCY_TTL):
+        self.redis = redis
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lru: "OrderedDict[str, str]" = OrderedDict()
+
+    def _remember(self, key: str, event_id: str):
+        self._lru[key] = event_id
+        self._lru.move_to_end(key)
+        if len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+
+    def _lookup(self, key: str) -> Optional[str]:
+        event_id = self._lru.get(key)
+        if event_id is not None:
+            self._lru.move_to_end(key)
+        return event_id
+
+    async def claim(self, docs: List[Dict[str, Any]]) -> Dict[int, DuplicateEvent]:
+        """Резервирует ключи пачки документов.
+
+        Документам с новым ключом заранее назначается _id, он же
+        записывается в Redis. Возвращает {индекс: DuplicateEvent} для
+        повторов; их писать не нужно. Повторы внутри одной пачки
+        ссылаются на первое вхождение ключа.
+        """
+        duplicates: Dict[int, DuplicateEvent] = {}
+        pending: List[int] = []
+        first_seen: Dict[str, ObjectId] = {}
+        for i, doc in enumerate(docs):
+            key = doc.get(IDEMPOTENCY_FIELD)
+            if not key:
+                continue
+            cached = self._lookup(key)
+            if cached is not None:
+                duplicates[i] = DuplicateEvent(ObjectId(cached))
+            elif key in first_seen:
+                duplicates[i] = DuplicateEvent(first_seen[key])
+            else:
+                doc.setdefault("_id", ObjectId())
+                first_seen[key] = doc["_id"]
+                pending.append(i)
+
+        if not pending:
+            return duplicates
+
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for i in pending:
+                    doc = docs[i]
+                    pipe.set(
+                        idempotency_redis_key(doc[IDEMPOTENCY_FIELD]), str(doc["_id"]),
+                        nx=True, ex=self.ttl, get=True
+                    )
+                previous = await pipe.execute()
+        except Exception as e:
+            # Без Redis повторы отсекает уникальный индекс MongoDB
+            logger.warning(f"Idempotency check in Redis failed: {e}")
+            return duplicates
+
+        for i, existing in zip(pending, previous):
+            key = docs[i][IDEMPOTENCY_FIELD]
+            if existing is not None:
+                duplicates[i] = DuplicateEvent(ObjectId(existing))
+                self._remember(key, existing)
+            else:
+                self._remember(key, str(docs[i]["_id"]))
+        return duplicates
+
+    async def resolve(self, key: str, event_id: Any):
+        """Перезаписывает резерв id оригинала, найденного в MongoDB"""
+        self._remember(key, str(event_id))
+        try:
+            await self.redis.set(idempotency_redis_key(key), str(event_id), ex=self.ttl)
+        except Exception as e:
+            logger.warning(f"Failed to store idempotency key: {e}")
+
+    async def release(self, docs: List[Dict[str, Any]]):
+        """Снимает резерв с ключей документов, которые не удалось записать"""
+        keys = [doc[IDEMPOTENCY_FIELD] for doc in docs if doc.get(IDEMPOTENCY_FIELD)]
+        if not keys:
+            return
+        for key in keys:
+            self._lru.pop(key, None)
+        try:
+            await self.redis.delete(*(idempotency_redis_key(key) for key in keys))
+        except Exception as e:
+            logger.warning(f"Failed to release idempotency keys: {e}")
+
+
+async def find_original(collection, key: str) -> Optional[DuplicateEvent]:
+    """Оригинал по ключу после DuplicateKeyError уникального индекса"""
+    doc = await collection.find_one({IDEMPOTENCY_FIELD: key}, {"_id": 1})
+    return DuplicateEvent(doc["_id"]) if doc else None
@@ -0,0 +1,113 @@
+"""
+Индексы коллекции событий: создание при старте и проверка использования
+"""
+
+import logging
+import os
+from typing import Any, Dict, List
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+logger = logging.getLogger(__name__)
+
+# Индексы под get_last_events и выборки по типу/пользователю за период;
+# _id в конце ключа обслуживает keyset-пагинацию по (timestamp, _id)
+EVENT_INDEXES = [
+    IndexModel([("timestamp", DESCENDING), ("_id", DESCENDING)], name="timestamp_id_desc"),
+    IndexModel(
+        [("event_type", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)],
+        name="event_type_timestamp_id"
+    ),
+    IndexModel(
+        [("user_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)],
+        name="user_id_timestamp_id"
+    ),
+    # Последний рубеж идемпотентности приёма (app.db.dedup); события
+    # без ключа в индекс не попадают. При EVENTS_STORAGE=daily индекс
+    # у каждой партиции свой: уникальность между сутками MongoDB не
+    # гарантирует, там остаётся только резерв ключа в Redis
+    IndexModel(
+        [("idempotency_key", ASCENDING)],
+        name="idempotency_key_unique",
+        unique=True,
+        partialFilterExpression={"idempotency_key": {"$type": "string"}}
+    ),
+]
+
+# TTL-retention одиночной коллекции; при посуточных партициях
+# (EVENTS_STORAGE=daily) вместо него удаляются целые партиции
+EVENTS_TTL_DAYS = int(os.getenv("EVENTS_TTL_DAYS", "0"))
+if EVENTS_TTL_DAYS:
+    EVENT_INDEXES.append(IndexModel(
+        [("timestamp", ASCENDING)],
+        name="timestamp_ttl",
+        expireAfterSeconds=EVENTS_TTL_DAYS * 86400
+    ))
+
+
+def _spec_key(model: IndexModel) -> List[tuple]:
+    return list(model.document["key"].items())
+
+
+async def ensure_indexes(collection, indexes: List[IndexModel] = EVENT_INDEXES) -> List[str]:
+    """Создаёт недостающие индексы.
+
+    background=True учитывается серверами до 4.2; начиная с 4.2 MongoDB
+    всегда строит индексы без блокировки коллекции на всё время сборки.
+    """
+    existing = {
+        name: list(info["key"])
+        for name, info in (await collection.index_information()).items()
+    }
+    existing_keys = list(existing.values())
+
+    missing = [model for model in indexes if _spec_key(model) not in existing_keys]
+    if not missing:
+        return []
+
+    for model in missing:
+        model.document.setdefault("background", True)
+    names = await collection.create_indexes(missing)
+    logger.info(f"Created indexes on {collection.name}: {names}")
+    return names
+
+
+async def index_report(collection, indexes: List[IndexModel] = EVENT_INDEXES) -> Dict[str, Any]:
+    """Отчёт по индексам: каких не хватает и какие не используются"""
+    info = await collection.index_information()
+    existing_keys = {name: list(spec["key"]) for name, spec in info.items()}
+
+    missing = [
+        model.document["name"]
+        for model in indexes
+        if _spec_key(model) not in existing_keys.values()
+    ]
+
+    usage = {}
+    async for stats in collection.aggregate([{"$indexStats": {}}]):
+        usage[stats["name"]] = {
+            "ops": stats["accesses"]["ops"],
+            "since": stats["accesses"]["since"],
+        }
+
+    unused = [name for name, stats in usage.items() if stats["ops"] == 0 and name != "_id_"]
+
+    return {
+        "collection": collection.name,
+        "missing": missing,
+        "unused": unused,
+        "usage": usage,
+    }
+
+
+async def bootstrap_indexes(collection):
+    """Создание и проверка индексов при старте сервиса; ошибки не фатальны"""
+    try:
+        await ensure_indexes(collection)
+        report = await index_report(collection)
+        if report["missing"]:
+            logger.warning(f"Missing indexes on {collection.name}: {report['missing']}")
+        if report["unused"]:
+            logger.info(f"Unused indexes on {collection.name}: {report['unused']}")
+    except Exception as e:
+        logger.error(f"Index bootstrap failed: {e}")
@@ -0,0 +1,258 @@
+"""
+Итоги по пользователям и top-N по окнам на sorted set'ах Redis
+
+Для каждого окна (AGGREGATION_WINDOWS) и типа события поддерживаются два
+sorted set'а: сумма amount и число событий по user_id. Пачка событий
+добавляется одним pipeline ZINCRBY: в минутную корзину и во все окна.
+Когда минута выходит из окна, её корзина вычитается из окна одним
+ZUNIONSTORE с весом -1, а пользователи без событий в окне удаляются
+(по числу событий, а не по сумме: отрицательные итоги возвратов
+остаются). Поэтому
+topUsers - это ZREVRANGE, а итоги пользователя - ZSCORE/ZREVRANK,
+оба O(log n).
+
+Все ключи живут с TTL: если consumer остановлен, окна исчезают сами.
+Вычитание запускают все реплики consumer'а метрик, но выполняет его
+только владелец блокировки в Redis (SET NX с TTL); позиция вычитания
+перечитывается из Redis под блокировкой и сдвигается в той же
+транзакции, что и вычитание минуты, поэтому минута не вычитается дважды.
+Добавление читает позиции под WATCH и прибавляет в той же транзакции
+MULTI/EXEC: если другая реплика успела вычесть минуту, транзакция
+повторяется, и запоздавшие события не попадают в окно, из которого их
+минута уже вычтена.
+"""
+
+import logging
+import os
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from redis.exceptions import WatchError
+
+from app.db.redis import AGGREGATION_WINDOWS, ALL_EVENT_TYPES
+
+logger = logging.getLogger(__name__)
+
+METRICS = ("amount", "count")
+LEADERBOARD_RETIRE_LOCK_KEY = "leaderboard:retire:lock"
+# Время жизни блокировки вычитания, с; должно покрывать один проход retire()
+LEADERBOARD_RETIRE_LOCK_TTL = int(os.getenv("LEADERBOARD_RETIRE_LOCK_TTL", "30"))
+# Запас TTL сверх длины окна, с
+TTL_SLACK = 120
+
+# (user_id, event_type, amount, timestamp в секундах или None)
+UserEvent = Tuple[str, str, float, Optional[float]]
+
+
+def leaderboard_key(minutes: int, event_type: str, metric: str) -> str:
+    """Sorted set окна: user_id -> сумма amount или число событий"""
+    return f"leaderboard:{minutes}m:{metric}:{event_type}"
+
+
+def leaderboard_bucket_key(minute: int, event_type: str, metric: str) -> str:
+    return f"leaderboard:bucket:{minute}:{metric}:{event_type}"
+
+
+def leaderboard_types_key(minute: int) -> str:
+    """Типы событий, у которых есть корзина минуты"""
+    return f"leaderboard:types:{minute}"
+
+
+def leaderboard_retired_key(minutes: int) -> str:
+    """Последняя минута, уже вычтенная из окна"""
+    return f"leaderboard:retired:{minutes}m"
+
+
+class UserLeaderboard:
+    def __init__(self, redis, windows: Iterable[int] = AGGREGATION_WINDOWS,
+                 clock=time.time):
+        self.redis = redis
+        self.windows = tuple(sorted(set(windows)))
+        self.horizon = max(self.windows)
+        self.clock = clock
+        self.bucket_ttl = self.horizon * 60 + TTL_SLACK
+        self._retired: Dict[int, int] = {}
+
+    def _minute(self, timestamp: Optional[float] = None) -> int:
+        return int((self.clock() if timestamp is None else timestamp) // 60)
+
+    async def load_state(self):
+        """Восстанавливает позиции вычитания после рестарта"""
+        now = self._minute()
+        values = await self.redis.mget([leaderboard_retired_key(w) for w in self.windows])
+        for window, value in zip(self.windows, values):
+            if value is None:
+                # Без сохранённой позиции окно считается пустым; позиция
+                # сохраняется, чтобы остальные реплики начали с неё же
+                value = self._retired.get(window, now - window)
+                await self.redis.set(leaderboard_retired_key(window), value, nx=True, ex=self.bucket_ttl)
+        self._positions(values, now)
+
+    def _positions(self, values: List[Optional[str]], now: int) -> Dict[int, int]:
+        """Позиции вычитания из значений ключей leaderboard_retired_key"""
+        for window, value in zip(self.windows, values):
+            if value is None:
+                value = self._retired.get(window, now - window)
+            # Слишком старая позиция: минуты до неё уже вышли из всех ключей по TTL
+            self._retired[window] = max(int(value), now - window - 1)
+        return dict(self._retired)
+
+    def _deltas(self, events: Iterable[UserEvent], now: int) -> Dict[Tuple[int, str, str], List[float]]:
+        deltas: Dict[Tuple[int, str, str], List[float]] = defaultdict(lambda: [0.0, 0])
+        for user_id, event_type, amount, timestamp in events:
+            # События из будущего относятся к текущей минуте
+            minute = min(self._minute(timestamp), now)
+            if minute <= now - self.horizon:
+                continue
+            for key in (event_type, ALL_EVENT_TYPES):
+                totals = deltas[(minute, key, user_id)]
+                totals[0] += amount
+                totals[1] += 1
+        return deltas
+
+    async def add(self, events: Iterable[UserEvent]):
+        """Учитывает пачку событий одной транзакцией.
+
+        Позиции вычитания читаются под WATCH: кэш процесса мог устареть,
+        если минуту вычла другая реплика.
+        """
+        now = self._minute()
+        deltas = self._deltas(events, now)
+        if not deltas:
+            return
+        if not self._retired:
+            await self.load_state()
+
+        retired_keys = [leaderboard_retired_key(w) for w in self.windows]
+        async with self.redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(*retired_keys)
+                    retired = self._positions(await pipe.mget(retired_keys), now)
+                    pipe.multi()
+                    self._queue_add(pipe, deltas, retired)
+                    await pipe.execute()
+                    return
+                except WatchError:
+                    logger.debug("Leaderboard window retired concurrently, retrying add")
+
+    def _queue_add(self, pipe, deltas: Dict[Tuple[int, str, str], List[float]], retired: Dict[int, int]):
+        touched_windows = set()
+        touched_buckets = set()
+        for (minute, event_type, user_id), values in deltas.items():
+            for metric, value in zip(METRICS, values):
+                bucket = leaderboard_bucket_key(minute, event_type, metric)
+                pipe.zincrby(bucket, value, user_id)
+                touched_buckets.add(bucket)
+                # В окно попадают только ещё не вычтенные минуты
+                for window in self.windows:
+                    if minute > retired[window]:
+                        key = leaderboard_key(window, event_type, metric)
+                        pipe.zincrby(key, value, user_id)
+                        touched_windows.add((key, window))
+            pipe.sadd(leaderboard_types_key(minute), event_type)
+            touched_buckets.add(leaderboard_types_key(minute))
+        for bucket in touched_buckets:
+            pipe.expire(bucket, self.bucket_ttl)
+        for key, window in touched_windows:
+            pipe.expire(key, window * 60 + TTL_SLACK)
+
+    async def retire(self) -> int:
+        """Вычитает из окон вышедшие из них минуты; возвращает число шагов.
+
+        Если вычитание уже идёт в другой реплике, ничего не делает.
+        """
+        token = uuid.uuid4().hex
+        if not await self.redis.set(LEADERBOARD_RETIRE_LOCK_KEY, token, nx=True,
+                                    ex=LEADERBOARD_RETIRE_LOCK_TTL):
+            return 0
+        steps = 0
+        try:
+            # Другая реплика могла сдвинуть позиции: кэш процесса не годится
+            await self.load_state()
+            now = self._minute()
+            for window in self.windows:
+                for minute in range(self._retired[window] + 1, now - window + 1):
+                    await self._subtract(window, minute)
+                    self._retired[window] = minute
+                    steps += 1
+        finally:
+            if await self.redis.get(LEADERBOARD_RETIRE_LOCK_KEY) == token:
+                await self.redis.delete(LEADERBOARD_RETIRE_LOCK_KEY)
+        return steps
+
+    async def _subtract(self, window: int, minute: int):
+        """Вычитает минуту из окна и сдвигает позицию одной транзакцией.
+
+        Набор типов минуты читается под WATCH: событие нового типа,
+        добавленное до EXEC, иначе осталось бы в окне навсегда.
+        """
+        types_key = leaderboard_types_key(minute)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(types_key)
+                    event_types = await pipe.smembers(types_key)
+                    pipe.multi()
+                    self._queue_subtract(pipe, window, minute, event_types)
+                    await pipe.execute()
+                    return
+                except WatchError:
+                    logger.debug(f"Leaderboard minute {minute} changed, retrying retire")
+
+    def _queue_subtract(self, pipe, window: int, minute: int, event_types: Iterable[str]):
+        for event_type in event_types:
+            count_key = leaderboard_key(window, event_type, "count")
+            amount_key = leaderboard_key(window, event_type, "amount")
+            for key, metric in ((count_key, "count"), (amount_key, "amount")):
+                bucket = leaderboard_bucket_key(minute, event_type, metric)
+                pipe.zunionstore(key, {key: 1, bucket: -1})
+            # Число событий целое: ноль означает, что пользователь выпал
+            # из окна. В сумме остаются только оставшиеся пользователи
+            pipe.zremrangebyscore(count_key, "-inf", 0)
+            pipe.zinterstore(amount_key, {amount_key: 1, count_key: 0})
+            # ZUNIONSTORE/ZINTERSTORE пересоздают ключ без TTL
+            for key in (count_key, amount_key):
+                pipe.expire(key, window * 60 + TTL_SLACK)
+        pipe.set(leaderboard_retired_key(window), minute, ex=self.bucket_ttl)
+
+
+async def top_users(redis, minutes: int, event_type: Optional[str], n: int) -> List[Dict[str, Any]]:
+    """Top-n пользователей окна по сумме amount"""
+    event_type = event_type or ALL_EVENT_TYPES
+    leaders = await redis.zrevrange(leaderboard_key(minutes, event_type, "amount"), 0, n - 1, withscores=True)
+    if not leaders:
+        return []
+    users = [user_id for user_id, _ in leaders]
+    counts = await redis.zmscore(leaderboard_key(minutes, event_type, "count"), users)
+    return [
+        {"user_id": user_id, "total_amount": amount, "event_count": int(count or 0), "rank": rank + 1}
+        for rank, ((user_id, amount), count) in enumerate(zip(leaders, counts))
+    ]
+
+
+async def user_stats(redis, user_id: str, event_type: Optional[str] = None,
+                     windows: Iterable[int] = AGGREGATION_WINDOWS) -> List[Dict[str, Any]]:
+    """Итоги пользователя и его место по каждому окну одним pipeline"""
+    event_type = event_type or ALL_EVENT_TYPES
+    windows = tuple(windows)
+    async with redis.pipeline(transaction=False) as pipe:
+        for minutes in windows:
+            amount_key = leaderboard_key(minutes, event_type, "amount")
+            pipe.zscore(amount_key, user_id)
+            pipe.zrevrank(amount_key, user_id)
+            pipe.zscore(leaderboard_key(minutes, event_type, "count"), user_id)
+        results = await pipe.execute()
+
+    stats = []
+    for i, minutes in enumerate(windows):
+        amount, rank, count = results[i * 3:i * 3 + 3]
+        stats.append({
+            "minutes": minutes,
+            "total_amount": amount or 0.0,
+            "event_count": int(count or 0),
+            "rank": rank + 1 if rank is not None else None,
+        })
+    return stats
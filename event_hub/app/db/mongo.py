@@ -1,18 +1,141 @@
+import asyncio
+import logging
 import motor.motor_asyncio
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from pymongo.monitoring import ConnectionCheckOutFailedReason, ConnectionPoolListener
+from pymongo.results import InsertOneResult
 import os
+import threading
+import time
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
+
+from app.db.coalescer import WriteCoalescer, write_error
+from app.db.dedup import IDEMPOTENCY_FIELD, IdempotencyCache, find_original
+from app.db.indexes import bootstrap_indexes
+from app.db.partitions import PartitionedEvents
+from app.db.redis import r
+from app.metrics.prometheus_metrics import (
+    record_mongo_operation, record_pool_wait_timeout, set_pool_max_size, update_pool_connections
+)
+
+logger = logging.getLogger(__name__)
 
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://mongo:27017")
-client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URI)
+
+# Пул соединений на процесс (на каждый сервер кластера)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000"))
+# Сколько запрос ждёт свободное соединение при исчерпании пула
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+
+
+class PoolMetricsListener(ConnectionPoolListener):
+    """Публикует загрузку пула MongoDB по событиям CMAP драйвера"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open = 0
+        self.in_use = 0
+
+    def _publish(self):
+        update_pool_connections("mongo", self.in_use, max(0, self.open - self.in_use))
+
+    def _change(self, open_delta: int = 0, in_use_delta: int = 0):
+        # События приходят из потоков драйвера
+        with self._lock:
+            self.open += open_delta
+            self.in_use += in_use_delta
+            self._publish()
+
+    def pool_created(self, event):
+        set_pool_max_size("mongo", MONGO_MAX_POOL_SIZE)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._change(open_delta=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._change(open_delta=-1)
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        if event.reason == ConnectionCheckOutFailedReason.TIMEOUT:
+            record_pool_wait_timeout("mongo")
+
+    def connection_checked_out(self, event):
+        self._change(in_use_delta=1)
+
+    def connection_checked_in(self, event):
+        self._change(in_use_delta=-1)
+
+
+pool_listener = PoolMetricsListener()
+
+# connect=False: фоновый мониторинг и соединения создаются при первой
+# операции (или в app.db.connections.open_connections), а не при импорте
+client = motor.motor_asyncio.AsyncIOMotorClient(
+    MONGO_URI,
+    connect=False,
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    minPoolSize=MONGO_MIN_POOL_SIZE,
+    maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+    waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    event_listeners=[pool_listener],
+)
 db = client["event_hub"]
 collection = db["events"]
 
+# Хранилище событий: single - одна коллекция events (TTL - EVENTS_TTL_DAYS),
+# daily - посуточные партиции events_YYYYMMDD с удалением старше retention
+EVENTS_STORAGE = os.getenv("EVENTS_STORAGE", "single").lower()
+EVENTS_RETENTION_DAYS = int(os.getenv("EVENTS_RETENTION_DAYS", "30"))
+PARTITION_MAINTENANCE_INTERVAL = float(os.getenv("PARTITION_MAINTENANCE_INTERVAL", "3600"))
+PARTITIONED = EVENTS_STORAGE == "daily"
+events = PartitionedEvents(db, "events", EVENTS_RETENTION_DAYS) if PARTITIONED else collection
+
+# Создание индексов при старте (app.db.indexes)
+ENSURE_INDEXES = os.getenv("MONGO_ENSURE_INDEXES", "true").lower() == "true"
+
+# Transactional outbox: публикацию в Redis Stream выполняет app.queue.outbox
+OUTBOX_ENABLED = os.getenv("OUTBOX_ENABLED", "false").lower() == "true"
+
+# Дедупликация повторов по idempotency_key
+idempotency = IdempotencyCache(r)
+
+# Микробатчинг одиночных записей (REST, gRPC, GraphQL)
+COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "true").lower() == "true"
+coalescer = WriteCoalescer(
+    events,
+    max_batch=int(os.getenv("COALESCE_MAX_BATCH", "500")),
+    max_delay=float(os.getenv("COALESCE_MAX_DELAY_MS", "5")) / 1000,
+    max_pending=int(os.getenv("COALESCE_MAX_PENDING", "10000")),
+)
+
+
 async def save_event(event_dict: Dict[str, Any]):
     # Очистка и валидация
     if '_id' in event_dict:
         del event_dict['_id']
-    
+
     if not isinstance(event_dict.get('timestamp'), datetime):
         try:
             ts = event_dict['timestamp']
@@ -22,9 +145,173 @@ async def save_event(event_dict: Dict[str, Any]):
                 event_dict['timestamp'] = datetime.fromisoformat(ts.replace('Z', ''))
         except (ValueError, TypeError):
             event_dict['timestamp'] = datetime.now()
-    
-    return await collection.insert_one(event_dict)
+
+    if OUTBOX_ENABLED:
+        event_dict['published'] = False
+
+    # Повтор возвращает DuplicateEvent с id оригинала без записи
+    key = event_dict.get(IDEMPOTENCY_FIELD)
+    if key:
+        duplicates = await idempotency.claim([event_dict])
+        if duplicates:
+            return duplicates[0]
+
+    try:
+        if not COALESCE_ENABLED:
+            start = time.perf_counter()
+            try:
+                return await events.insert_one(event_dict)
+            finally:
+                record_mongo_operation("insert_one", events.name, time.perf_counter() - start)
+        inserted_id = await coalescer.submit(event_dict)
+    except DuplicateKeyError:
+        original = await find_original(events, key) if key else None
+        if original is None:
+            raise
+        await idempotency.resolve(key, original.inserted_id)
+        return original
+    except Exception:
+        if key:
+            await idempotency.release([event_dict])
+        raise
+    return InsertOneResult(inserted_id, acknowledged=True)
+
+
+async def save_events(event_dicts: List[Dict[str, Any]]) -> Dict[int, Any]:
+    """Сохраняет пачку событий одним неупорядоченным insert_many.
+
+    Возвращает словарь {индекс: ObjectId | DuplicateEvent | Exception},
+    чтобы вызывающий мог сообщить об ошибках по каждому элементу без
+    повтора всей пачки. Повторы по idempotency_key не записываются.
+    """
+    if not event_dicts:
+        return {}
+
+    if OUTBOX_ENABLED:
+        for event_dict in event_dicts:
+            event_dict['published'] = False
+
+    outcomes: Dict[int, Any] = await idempotency.claim(event_dicts)
+    positions = [i for i in range(len(event_dicts)) if i not in outcomes]
+    docs = [event_dicts[i] for i in positions]
+    if not docs:
+        return outcomes
+
+    start = time.perf_counter()
+    try:
+        await events.insert_many(docs, ordered=False)
+        failed = {}
+    except BulkWriteError as e:
+        failed = {
+            err["index"]: write_error(err)
+            for err in e.details.get("writeErrors", [])
+        }
+    except Exception:
+        await idempotency.release(docs)
+        raise
+    finally:
+        record_mongo_operation("insert_many", events.name, time.perf_counter() - start)
+
+    unwritten = []
+    for pos, i in enumerate(positions):
+        doc = docs[pos]
+        error = failed.get(pos)
+        if error is None:
+            # insert_many проставляет _id в документы до отправки
+            outcomes[i] = doc["_id"]
+            continue
+        key = doc.get(IDEMPOTENCY_FIELD)
+        original = await find_original(events, key) if key and isinstance(error, DuplicateKeyError) else None
+        if original is not None:
+            await idempotency.resolve(key, original.inserted_id)
+            outcomes[i] = original
+        else:
+            unwritten.append(doc)
+            outcomes[i] = error
+
+    await idempotency.release(unwritten)
+    return outcomes
+
+
+async def find_events(
+    query: Dict[str, Any],
+    projection: Optional[Dict[str, Any]],
+    limit: int,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    ascending: bool = False,
+) -> List[Dict[str, Any]]:
+    """Выборка, отсортированная по (timestamp, _id).
+
+    since/until - границы времени запроса: при посуточных партициях
+    читаются только пересекающие их партиции (условие по timestamp
+    должно быть и в query).
+    """
+    if PARTITIONED:
+        return await events.find_sorted(query, projection, limit, since, until, ascending)
+    direction = 1 if ascending else -1
+    cursor = collection.find(query, projection).sort([("timestamp", direction), ("_id", direction)]).limit(limit)
+    return await cursor.to_list(length=limit)
+
+
+async def bootstrap_storage():
+    """Индексы при старте; для партиций - периодическое обслуживание"""
+    if not PARTITIONED:
+        await bootstrap_indexes(collection)
+        return
+    while True:
+        try:
+            await events.bootstrap()
+        except Exception as e:
+            logger.error(f"Partition maintenance failed: {e}")
+        await asyncio.sleep(PARTITION_MAINTENANCE_INTERVAL)
+
 
 async def get_last_events(limit: int):
-    cursor = collection.find().sort("timestamp", -1).limit(limit)
-    return await cursor.to_list(length=limit)
\ No newline at end of file
+    return await find_events({}, None, limit)
+
+
+async def get_events_page(
+    limit: int,
+    after: Optional[Tuple[datetime, Any]] = None,
+    user_id: Optional[str] = None,
+    event_type: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    projection: Optional[List[str]] = None,
+) -> List[Dict[str, Any]]:
+    """Страница событий от новых к старым с keyset-пагинацией.
+
+    after - (timestamp, _id) последнего события предыдущей страницы;
+    запрос идёт по индексу с (timestamp, _id), поэтому глубокие страницы
+    стоят столько же, сколько первая.
+    """
+    conditions: List[Dict[str, Any]] = []
+    if user_id is not None:
+        conditions.append({"user_id": user_id})
+    if event_type is not None:
+        conditions.append({"event_type": event_type})
+
+    time_range = {}
+    if since is not None:
+        time_range["$gte"] = since
+    if until is not None:
+        time_range["$lt"] = until
+    if time_range:
+        conditions.append({"timestamp": time_range})
+
+    if after is not None:
+        after_ts, after_id = after
+        conditions.append({"$or": [
+            {"timestamp": {"$lt": after_ts}},
+            {"timestamp": after_ts, "_id": {"$lt": after_id}}
+        ]})
+
+    query = {"$and": conditions} if len(conditions) > 1 else (conditions[0] if conditions else {})
+    fields = None
+    if projection is not None:
+        fields = {field: 1 for field in set(projection) | {"timestamp"}}
+
+    # Последняя страница не старше after: партиции новее неё не читаются
+    upper = after[0] if after is not None else until
+    return await find_events(query, fields, limit, since=since, until=upper)
@@ -0,0 +1,226 @@
+"""
+Посуточное партиционирование событий: events_YYYYMMDD
+
+Запись маршрутизируется в коллекцию суток по timestamp, чтение
+обходит только партиции из диапазона времени запроса, а
+retention - это drop целых коллекций старше retention_days вместо
+удаления документов по одному.
+
+PartitionedEvents повторяет нужную сервису часть API коллекции Motor
+(insert_one/insert_many, find_one, update по документам, watch), поэтому
+WriteCoalescer, outbox relay и дедупликация работают с ним без изменений.
+"""
+
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import IndexModel
+from pymongo.errors import BulkWriteError
+from pymongo.results import InsertOneResult
+
+from app.db.indexes import EVENT_INDEXES, ensure_indexes
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT = "%Y%m%d"
+
+
+def to_utc(timestamp: datetime) -> datetime:
+    """Наивное время в UTC: aware-время переводится, наивное считается UTC (как в BSON)"""
+    if timestamp.tzinfo is None:
+        return timestamp
+    return timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class PartitionedEvents:
+    def __init__(self, db, prefix: str = "events", retention_days: int = 30,
+                 indexes: Optional[List[IndexModel]] = None,
+                 clock: Callable[[], datetime] = utc_now):
+        self.db = db
+        self.prefix = prefix
+        self.name = prefix
+        self.retention_days = retention_days
+        self.indexes = list(EVENT_INDEXES if indexes is None else indexes)
+        self.clock = clock
+        self._ready: set = set()
+        self._locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+    # Маршрутизация
+
+    def partition_name(self, timestamp: datetime) -> str:
+        # Граница суток - полночь UTC, независимо от зоны клиента и сервера
+        return f"{self.prefix}_{to_utc(timestamp).strftime(DATE_FORMAT)}"
+
+    def partition_day(self, name: str) -> Optional[datetime]:
+        suffix = name[len(self.prefix) + 1:]
+        if not name.startswith(self.prefix + "_") or len(suffix) != 8 or not suffix.isdigit():
+            return None
+        return datetime.strptime(suffix, DATE_FORMAT)
+
+    def partition_names(self, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                        now: Optional[datetime] = None) -> List[str]:
+        """Партиции, пересекающие [since, until], от новых к старым.
+
+        Без since диапазон ограничен сроком retention, без until - завтрашним
+        днём (запас на расхождение часов клиентов).
+        """
+        now = to_utc(now or self.clock())
+        last = to_utc(until or now + timedelta(days=1)).date()
+        first = to_utc(since or now - timedelta(days=self.retention_days)).date()
+        first = max(first, (now - timedelta(days=self.retention_days)).date())
+        names = []
+        day = last
+        while day >= first:
+            names.append(f"{self.prefix}_{day.strftime(DATE_FORMAT)}")
+            day -= timedelta(days=1)
+        return names
+
+    async def partition(self, name: str):
+        """Коллекция партиции; индексы создаются при первом обращении процесса"""
+        collection = self.db[name]
+        if name not in self._ready:
+            async with self._locks[name]:
+                if name not in self._ready:
+                    await ensure_indexes(collection, self.indexes)
+                    self._ready.add(name)
+        return collection
+
+    def _group(self, docs: Iterable[Dict[str, Any]]) -> Dict[str, List[Tuple[int, Dict[str, Any]]]]:
+        groups: Dict[str, List[Tuple[int, Dict[str, Any]]]] = defaultdict(list)
+        for i, doc in enumerate(docs):
+            groups[self.partition_name(doc["timestamp"])].append((i, doc))
+        return groups
+
+    # Запись
+
+    async def insert_many(self, docs: List[Dict[str, Any]], ordered: bool = False):
+        """insert_many по партициям; ошибки собираются в один BulkWriteError
+        с индексами исходного списка.
+
+        Сбой одной партиции (например, сетевой) не отменяет записанное в
+        другие: её документы попадают в writeErrors, чтобы вызывающий
+        освободил ключи идемпотентности только для них. Исключение
+        пробрасывается как есть, только если не записалась ни одна партиция.
+        """
+        groups = self._group(docs)
+
+        async def insert(name, items):
+            collection = await self.partition(name)
+            try:
+                await collection.insert_many([doc for _, doc in items], ordered=False)
+                return []
+            except BulkWriteError as e:
+                return [
+                    {**err, "index": items[err["index"]][0]}
+                    for err in e.details.get("writeErrors", [])
+                ]
+
+        results = await asyncio.gather(
+            *(insert(name, items) for name, items in groups.items()), return_exceptions=True
+        )
+        failures = [result for result in results if isinstance(result, BaseException)]
+        if failures and len(failures) == len(results):
+            raise failures[0]
+
+        write_errors = []
+        for (name, items), result in zip(groups.items(), results):
+            if isinstance(result, BaseException):
+                logger.error(f"Insert into partition {name} failed: {result}")
+                write_errors.extend({"index": i, "errmsg": str(result)} for i, _ in items)
+            else:
+                write_errors.extend(result)
+        write_errors.sort(key=lambda err: err["index"])
+        if write_errors:
+            raise BulkWriteError({"writeErrors": write_errors, "nInserted": len(docs) - len(write_errors)})
+
+    async def insert_one(self, doc: Dict[str, Any]) -> InsertOneResult:
+        collection = await self.partition(self.partition_name(doc["timestamp"]))
+        return await collection.insert_one(doc)
+
+    async def mark(self, docs: List[Dict[str, Any]], update: Dict[str, Any]):
+        """update_many по _id документов в их партициях"""
+        for name, items in self._group(docs).items():
+            await self.db[name].update_many({"_id": {"$in": [doc["_id"] for _, doc in items]}}, update)
+
+    # Чтение
+
+    async def find_one(self, query: Dict[str, Any], projection: Optional[Dict[str, Any]] = None):
+        """find_one по всем партициям срока retention одновременно.
+
+        Партицию нельзя вывести из _id: она выбирается по timestamp события,
+        а не по времени создания ObjectId. При нескольких совпадениях
+        возвращается документ из самой новой партиции.
+        """
+        docs = await asyncio.gather(
+            *(self.db[name].find_one(query, projection) for name in self.partition_names())
+        )
+        return next((doc for doc in docs if doc is not None), None)
+
+    async def find_sorted(self, query: Dict[str, Any], projection: Optional[Dict[str, Any]], limit: int,
+                          since: Optional[datetime] = None, until: Optional[datetime] = None,
+                          ascending: bool = False) -> List[Dict[str, Any]]:
+        """Запрос по партициям диапазона с сортировкой по (timestamp, _id).
+
+        Партиции не пересекаются по времени, поэтому результаты склеиваются
+        в порядке партиций и обход останавливается, как только набран limit.
+        """
+        direction = 1 if ascending else -1
+        names = self.partition_names(since, until)
+        if ascending:
+            names.reverse()
+        docs: List[Dict[str, Any]] = []
+        for name in names:
+            remaining = limit - len(docs)
+            if remaining <= 0:
+                break
+            cursor = self.db[name].find(query, projection).sort(
+                [("timestamp", direction), ("_id", direction)]
+            ).limit(remaining)
+            docs.extend(await cursor.to_list(length=remaining))
+        return docs
+
+    def watch(self, pipeline: List[Dict[str, Any]], **kwargs):
+        """Change stream по всем партициям (на уровне базы)"""
+        match = {"$match": {"ns.coll": {"$regex": f"^{self.prefix}_\\d{{8}}$"}}}
+        return self.db.watch([match] + pipeline, **kwargs)
+
+    # Обслуживание
+
+    async def create_index(self, keys, **kwargs):
+        """Добавляет индекс всем существующим и будущим партициям"""
+        model = IndexModel(keys, **kwargs)
+        self.indexes.append(model)
+        for name in await self.existing_partitions():
+            await ensure_indexes(self.db[name], [model])
+
+    async def existing_partitions(self) -> List[str]:
+        names = await self.db.list_collection_names()
+        return sorted((name for name in names if self.partition_day(name)), reverse=True)
+
+    async def drop_expired(self, now: Optional[datetime] = None) -> List[str]:
+        """Retention: удаляет партиции целиком"""
+        now = to_utc(now or self.clock())
+        cutoff = (now - timedelta(days=self.retention_days)).replace(hour=0, minute=0, second=0, microsecond=0)
+        dropped = []
+        for name in await self.existing_partitions():
+            if self.partition_day(name) < cutoff:
+                await self.db.drop_collection(name)
+                self._ready.discard(name)
+                dropped.append(name)
+        if dropped:
+            logger.info(f"Dropped expired partitions: {dropped}")
+        return dropped
+
+    async def bootstrap(self):
+        """Индексы для сегодняшней и завтрашней партиций и retention"""
+        now = self.clock()
+        for day in (now, now + timedelta(days=1)):
+            await self.partition(self.partition_name(day))
+        await self.drop_expired(now)
@@ -1,3 +1,69 @@
 import redis.asyncio as redis
+import os
+from typing import Dict, Any, List, Tuple
 
-r = redis.Redis(host="redis", port=6379, decode_responses=True)
+from app.queue.codec import encode_event
+
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+REDIS_DB = int(os.getenv("REDIS_DB", "0"))
+
+# Пул соединений на процесс: при исчерпании запрос ждёт свободное
+# соединение до REDIS_POOL_TIMEOUT секунд, а не открывает новое
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "5"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "5"))
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", "2"))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30"))
+
+
+def create_redis(**overrides) -> redis.Redis:
+    """Клиент Redis с ограниченным пулом; соединения открываются при первой команде.
+
+    surrogateescape: бинарные записи stream'а (app.queue.codec) читаются без потерь.
+    """
+    options = dict(
+        host=REDIS_HOST,
+        port=REDIS_PORT,
+        db=REDIS_DB,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+        decode_responses=True,
+        encoding_errors="surrogateescape",
+    )
+    options.update(overrides)
+    pool = redis.BlockingConnectionPool(**options)
+    return redis.Redis(connection_pool=pool)
+
+
+# Общий для процесса клиент: API, gRPC, GraphQL и consumer'ы
+r = create_redis()
+
+EVENTS_STREAM = "events"
+
+# Жёсткий потолок длины stream'а (XADD MAXLEN ~), 0 - без потолка (по умолчанию).
+# MAXLEN не смотрит на группы и удаляет в том числе неподтверждённые записи,
+# поэтому штатно stream укорачивает только app.queue.retention по подтверждениям
+# групп, а об отстающей группе предупреждает STREAM_LENGTH_ALERT
+STREAM_MAXLEN = int(os.getenv("STREAM_MAXLEN", "0"))
+
+# Окна агрегированных метрик (минуты); итоги копятся по корзинам в секунды
+# (app.db.window_totals) и суммируются по корзинам окна при чтении
+AGGREGATION_WINDOWS = (1, 5, 15, 60)
+ALL_EVENT_TYPES = "*"
+
+
+async def publish_events(events: List[Tuple[str, Dict[str, Any]]]) -> List[str]:
+    """Публикует пачку событий в stream одним pipeline (один round trip)"""
+    if not events:
+        return []
+    async with r.pipeline(transaction=False) as pipe:
+        for event_id, event_dict in events:
+            pipe.xadd(
+                EVENTS_STREAM, encode_event(event_id, event_dict),
+                maxlen=STREAM_MAXLEN or None, approximate=True
+            )
+        return await pipe.execute()
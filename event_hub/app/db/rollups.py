@@ -0,0 +1,223 @@
+"""
+Предагрегированные итоги событий по минутам, часам и суткам
+
+Consumer метрик копит приращения пачки в памяти и применяет их одним
+bulk_write на коллекцию: UpdateOne с $inc и upsert на корзину
+(event_type, bucket_start). Запрос ряда - чтение диапазона уникального
+индекса {event_type, bucket_start}, без обращения к сырым событиям.
+
+$inc не идемпотентен, а доставка из stream'а - at-least-once, поэтому
+применённые сообщения записываются в журнал rollup_applied
+(_id "<гранулярность>:<ID сообщения>", TTL). Сообщения из журнала при
+повторной доставке пропускаются, а журнал и $inc всех гранулярностей
+пишутся одной транзакцией. Без replica set транзакции недоступны: тогда
+журнал гранулярности пишется сразу после её bulk_write, и повтор
+возможен, только если процесс упал между этими двумя записями.
+"""
+
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import ASCENDING, IndexModel, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
+
+from app.db.indexes import ensure_indexes
+from app.db.redis import ALL_EVENT_TYPES
+
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = ("minute", "hour", "day")
+
+# Минутные корзины нужны для недавних графиков и удаляются по TTL
+ROLLUP_MINUTE_TTL_DAYS = int(os.getenv("ROLLUP_MINUTE_TTL_DAYS", "7"))
+
+# Журнал применённых сообщений; TTL должен покрывать время до повторной доставки
+ROLLUP_APPLIED_COLLECTION = "rollup_applied"
+ROLLUP_APPLIED_TTL_HOURS = int(os.getenv("ROLLUP_APPLIED_TTL_HOURS", "24"))
+
+ROLLUP_APPLIED_INDEXES = [
+    IndexModel(
+        [("applied_at", ASCENDING)],
+        name="applied_at_ttl",
+        expireAfterSeconds=ROLLUP_APPLIED_TTL_HOURS * 3600
+    ),
+]
+
+# IllegalOperation: транзакции только на replica set или mongos
+_NO_TRANSACTIONS_CODE = 20
+
+ROLLUP_INDEXES = [
+    IndexModel(
+        [("event_type", ASCENDING), ("bucket_start", ASCENDING)],
+        name="event_type_bucket_start",
+        unique=True
+    ),
+]
+
+
+def rollup_collection_name(granularity: str) -> str:
+    return f"rollup_{granularity}"
+
+
+def rollup_indexes(granularity: str) -> List[IndexModel]:
+    indexes = list(ROLLUP_INDEXES)
+    if granularity == "minute" and ROLLUP_MINUTE_TTL_DAYS:
+        indexes.append(IndexModel(
+            [("bucket_start", ASCENDING)],
+            name="bucket_start_ttl",
+            expireAfterSeconds=ROLLUP_MINUTE_TTL_DAYS * 86400
+        ))
+    return indexes
+
+
+def bucket_start(timestamp: datetime, granularity: str) -> datetime:
+    """Начало корзины, в которую попадает timestamp"""
+    start = timestamp.replace(second=0, microsecond=0)
+    if granularity in ("hour", "day"):
+        start = start.replace(minute=0)
+    if granularity == "day":
+        start = start.replace(hour=0)
+    return start
+
+
+def applied_id(granularity: str, message_id: str) -> str:
+    """_id записи журнала rollup_applied"""
+    return f"{granularity}:{message_id}"
+
+
+class RollupWriter:
+    """Накопитель событий пачки; flush применяет их пачкой upsert'ов.
+
+    Каждое событие учитывается дважды: в корзине своего типа и в общей
+    корзине ALL_EVENT_TYPES, так что ряд по всем типам тоже читается
+    одним диапазоном индекса. События с message_id применяются не более
+    одного раза на гранулярность (журнал rollup_applied).
+    """
+
+    # Общий для процесса признак: транзакции недоступны
+    transactions = True
+
+    def __init__(self, db, granularities: Tuple[str, ...] = GRANULARITIES):
+        self.db = db
+        self.granularities = granularities
+        self._events: List[Tuple[Optional[str], str, float, datetime]] = []
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def add(self, event_type: str, amount: float, timestamp: datetime, message_id: Optional[str] = None):
+        self._events.append((message_id, event_type, amount, timestamp))
+
+    def buckets(self, granularity: str, skip=frozenset()) -> Dict[Tuple[str, datetime], List[float]]:
+        """Приращения корзин гранулярности без сообщений из skip"""
+        buckets: Dict[Tuple[str, datetime], List[float]] = defaultdict(lambda: [0.0, 0])
+        for message_id, event_type, amount, timestamp in self._events:
+            if message_id is not None and message_id in skip:
+                continue
+            start = bucket_start(timestamp, granularity)
+            for key in (event_type, ALL_EVENT_TYPES):
+                totals = buckets[(key, start)]
+                totals[0] += amount
+                totals[1] += 1
+        return buckets
+
+    def operations(self, granularity: str, skip=frozenset()) -> List[UpdateOne]:
+        """UpdateOne с $inc на каждую корзину гранулярности"""
+        return [
+            UpdateOne(
+                {"event_type": event_type, "bucket_start": start},
+                {"$inc": {"total_amount": amount, "event_count": count}},
+                upsert=True
+            )
+            for (event_type, start), (amount, count) in self.buckets(granularity, skip).items()
+        ]
+
+    async def _applied(self, message_ids: List[str], session=None) -> Dict[str, set]:
+        """Гранулярность -> ID сообщений пачки, уже учтённых в ней"""
+        applied: Dict[str, set] = defaultdict(set)
+        ids = [applied_id(g, m) for g in self.granularities for m in message_ids]
+        cursor = self.db[ROLLUP_APPLIED_COLLECTION].find({"_id": {"$in": ids}}, {"_id": 1}, session=session)
+        async for doc in cursor:
+            granularity, _, message_id = doc["_id"].partition(":")
+            applied[granularity].add(message_id)
+        return applied
+
+    async def _apply(self, session=None) -> int:
+        message_ids = sorted({m for m, *_ in self._events if m is not None})
+        applied = await self._applied(message_ids, session) if message_ids else {}
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        written = 0
+        for granularity in self.granularities:
+            skip = applied.get(granularity, set())
+            ops = self.operations(granularity, skip)
+            if ops:
+                await self.db[rollup_collection_name(granularity)].bulk_write(ops, ordered=False, session=session)
+                written += len(ops)
+            new_ids = [m for m in message_ids if m not in skip]
+            if new_ids:
+                await self._record(granularity, new_ids, now, session)
+        return written
+
+    async def _record(self, granularity: str, message_ids: List[str], now: datetime, session=None):
+        docs = [{"_id": applied_id(granularity, m), "applied_at": now} for m in message_ids]
+        try:
+            await self.db[ROLLUP_APPLIED_COLLECTION].insert_many(docs, ordered=False, session=session)
+        except BulkWriteError as e:
+            # Без транзакции: запись журнала другой реплики, учитывавшей то же
+            # сообщение. В транзакции ошибка её прерывает, и пачка повторяется
+            if session is not None or any(
+                error.get("code") != 11000 for error in e.details.get("writeErrors", [])
+            ):
+                raise
+
+    async def flush(self) -> int:
+        """Применяет накопленное: одна транзакция на пачку, если доступна.
+
+        Возвращает число записанных корзин. Повторный flush той же пачки
+        (после ошибки или повторной доставки) не применяет её дважды.
+        """
+        if not self._events:
+            return 0
+        applied = None
+        if RollupWriter.transactions:
+            try:
+                async with await self.db.client.start_session() as session:
+                    applied = await session.with_transaction(self._apply)
+            except OperationFailure as e:
+                if e.code != _NO_TRANSACTIONS_CODE:
+                    raise
+                logger.warning("Transactions unavailable, rollups are written without them")
+                RollupWriter.transactions = False
+        if applied is None:
+            applied = await self._apply()
+        self._events.clear()
+        if applied:
+            logger.debug(f"Flushed {applied} rollup buckets")
+        return applied
+
+    async def ensure_indexes(self):
+        for granularity in self.granularities:
+            await ensure_indexes(self.db[rollup_collection_name(granularity)], rollup_indexes(granularity))
+        await ensure_indexes(self.db[ROLLUP_APPLIED_COLLECTION], ROLLUP_APPLIED_INDEXES)
+
+
+async def get_series(
+    db,
+    granularity: str,
+    since: datetime,
+    until: datetime,
+    event_type: Optional[str] = None,
+    limit: int = 1000,
+) -> List[Dict[str, Any]]:
+    """Корзины [since, until) по возрастанию времени"""
+    cursor = db[rollup_collection_name(granularity)].find(
+        {
+            "event_type": event_type or ALL_EVENT_TYPES,
+            "bucket_start": {"$gte": bucket_start(since, granularity), "$lt": until},
+        },
+        {"_id": 0, "bucket_start": 1, "total_amount": 1, "event_count": 1}
+    ).sort("bucket_start", ASCENDING).limit(limit)
+    return await cursor.to_list(length=limit)
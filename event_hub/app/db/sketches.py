@@ -0,0 +1,200 @@
+"""
+Приближённая аналитика по минутам: уникальные пользователи и перцентили amount
+
+Для каждой минуты и типа события (и для всех типов) хранятся:
+- HyperLogLog пользователей (PFADD); уникальные за окно - PFCOUNT по
+  ключам минут окна, Redis объединяет их сам, ошибка ~0.81%;
+- DDSketch сумм: хэш "индекс корзины -> число значений" (HINCRBY).
+  Корзины логарифмические, поэтому перцентиль оценивается с
+  относительной ошибкой не больше SKETCH_RELATIVE_ACCURACY, а скетчи
+  минут объединяются сложением счётчиков. Отрицательные суммы (возвраты)
+  хранятся в зеркальных корзинах по модулю значения с префиксом "n".
+
+Размер ключей не зависит от числа событий и пользователей: HLL - не
+больше 12 КБ, хэш - по одному полю на корзину в диапазоне значений.
+"""
+
+import math
+import os
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, Optional, Tuple
+
+from app.db.redis import AGGREGATION_WINDOWS, ALL_EVENT_TYPES
+
+SKETCH_RELATIVE_ACCURACY = float(os.getenv("SKETCH_RELATIVE_ACCURACY", "0.01"))
+# Предел числа корзин скетча при слиянии окна; лишние младшие корзины сливаются
+SKETCH_MAX_BUCKETS = int(os.getenv("SKETCH_MAX_BUCKETS", "2048"))
+# Значения меньше порога по модулю (в том числе 0) учитываются в корзине нуля
+MIN_INDEXABLE_VALUE = 1e-9
+ZERO_BUCKET = "z"
+# Префикс корзин отрицательных значений
+NEGATIVE_PREFIX = "n"
+# Запас TTL минутных ключей сверх самого длинного окна, с
+TTL_SLACK = 120
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# (user_id, event_type, amount, timestamp в секундах или None)
+SketchEvent = Tuple[str, str, float, Optional[float]]
+
+
+def distinct_users_key(minute: int, event_type: str) -> str:
+    return f"sketch:users:{minute}:{event_type}"
+
+
+def amount_sketch_key(minute: int, event_type: str) -> str:
+    return f"sketch:amount:{minute}:{event_type}"
+
+
+class DDSketch:
+    """DDSketch с логарифмическими корзинами (Masson et al., 2019)"""
+
+    def __init__(self, relative_accuracy: float = SKETCH_RELATIVE_ACCURACY,
+                 max_buckets: int = SKETCH_MAX_BUCKETS):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.max_buckets = max_buckets
+        self.bins: Dict[int, int] = defaultdict(int)
+        # Корзины отрицательных значений по индексу модуля
+        self.negative_bins: Dict[int, int] = defaultdict(int)
+        self.zero_count = 0
+
+    @property
+    def count(self) -> int:
+        return self.zero_count + sum(self.bins.values()) + sum(self.negative_bins.values())
+
+    def _index(self, value: float) -> int:
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def key(self, value: float) -> str:
+        """Поле хэша Redis для значения"""
+        if abs(value) < MIN_INDEXABLE_VALUE:
+            return ZERO_BUCKET
+        if value < 0:
+            return f"{NEGATIVE_PREFIX}{self._index(-value)}"
+        return str(self._index(value))
+
+    def add(self, value: float, count: int = 1):
+        self.merge_fields({self.key(value): count})
+
+    def merge_fields(self, fields: Dict[str, int]):
+        """Добавляет счётчики из хэша Redis (или другого скетча)"""
+        for key, count in fields.items():
+            if key == ZERO_BUCKET:
+                self.zero_count += int(count)
+            elif key.startswith(NEGATIVE_PREFIX):
+                self.negative_bins[int(key[len(NEGATIVE_PREFIX):])] += int(count)
+            else:
+                self.bins[int(key)] += int(count)
+        for bins in (self.bins, self.negative_bins):
+            if len(bins) > self.max_buckets:
+                self._collapse(bins)
+
+    def _collapse(self, bins: Dict[int, int]):
+        # Корзины самых малых по модулю значений сливаются в одну: точность
+        # сохраняется для старших перцентилей, которые и запрашиваются
+        keys = sorted(bins)
+        extra = keys[:len(keys) - self.max_buckets + 1]
+        merged = sum(bins.pop(key) for key in extra)
+        bins[extra[-1]] += merged
+
+    def _value(self, index: int) -> float:
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def quantile(self, q: float) -> Optional[float]:
+        total = self.count
+        if total == 0:
+            return None
+        rank = q * (total - 1)
+        seen = 0
+        # По возрастанию значения: отрицательные от больших по модулю
+        for index in sorted(self.negative_bins, reverse=True):
+            seen += self.negative_bins[index]
+            if seen > rank:
+                return -self._value(index)
+        seen += self.zero_count
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                return self._value(index)
+        # Сюда приводит только погрешность float: наибольшее значение
+        if self.bins:
+            return self._value(max(self.bins))
+        return 0.0 if self.zero_count else -self._value(min(self.negative_bins))
+
+
+class MinuteSketches:
+    def __init__(self, redis, windows: Iterable[int] = AGGREGATION_WINDOWS,
+                 relative_accuracy: float = SKETCH_RELATIVE_ACCURACY, clock=time.time):
+        self.redis = redis
+        self.horizon = max(windows)
+        self.ttl = self.horizon * 60 + TTL_SLACK
+        self.clock = clock
+        # Только разметка корзин: счётчики копятся в Redis
+        self._layout = DDSketch(relative_accuracy)
+
+    def _minute(self, timestamp: Optional[float] = None) -> int:
+        return int((self.clock() if timestamp is None else timestamp) // 60)
+
+    async def add(self, events: Iterable[SketchEvent]):
+        """Пачка событий -> один pipeline PFADD/HINCRBY.
+
+        Счётчики корзин пачки складываются заранее, поэтому число команд
+        зависит от числа различных (минута, тип, корзина), а не событий.
+        """
+        now = self._minute()
+        users: Dict[Tuple[int, str], set] = defaultdict(set)
+        amounts: Dict[Tuple[int, str], Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        for user_id, event_type, amount, timestamp in events:
+            minute = min(self._minute(timestamp), now)
+            if minute <= now - self.horizon:
+                continue
+            bucket = self._layout.key(amount)
+            for key in (event_type, ALL_EVENT_TYPES):
+                users[(minute, key)].add(user_id)
+                amounts[(minute, key)][bucket] += 1
+        if not users:
+            return
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for (minute, event_type), members in users.items():
+                key = distinct_users_key(minute, event_type)
+                pipe.pfadd(key, *members)
+                pipe.expire(key, self.ttl)
+            for (minute, event_type), buckets in amounts.items():
+                key = amount_sketch_key(minute, event_type)
+                for bucket, count in buckets.items():
+                    pipe.hincrby(key, bucket, count)
+                pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+
+async def window_sketch_stats(
+    redis,
+    minutes: int,
+    event_type: Optional[str] = None,
+    now: Optional[float] = None,
+    relative_accuracy: float = SKETCH_RELATIVE_ACCURACY,
+) -> Dict[str, Optional[float]]:
+    """Уникальные пользователи и перцентили amount за последние minutes минут"""
+    event_type = event_type or ALL_EVENT_TYPES
+    current = int((time.time() if now is None else now) // 60)
+    window = range(current - minutes + 1, current + 1)
+
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.pfcount(*(distinct_users_key(minute, event_type) for minute in window))
+        for minute in window:
+            pipe.hgetall(amount_sketch_key(minute, event_type))
+        distinct, *hashes = await pipe.execute()
+
+    sketch = DDSketch(relative_accuracy)
+    for fields in hashes:
+        sketch.merge_fields(fields)
+    stats: Dict[str, Optional[float]] = {"distinct_users": distinct}
+    for q in QUANTILES:
+        stats[f"p{int(q * 100)}"] = sketch.quantile(q)
+    return stats
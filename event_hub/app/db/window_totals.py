@@ -0,0 +1,98 @@
+"""
+Итоги скользящих окон aggregatedMetrics в Redis
+
+Каждое событие группы "metrics" доставляется ровно одной реплике
+consumer'а, и она прибавляет его к хэшу корзины в WINDOW_BUCKET_SECONDS
+секунд (HINCRBYFLOAT/HINCRBY) с полями amount:<event_type> и
+count:<event_type>, а также amount:*/count:* по всем типам. Итог окна
+[now - minutes, now] - сумма корзин окна при чтении; самая старая
+корзина, которую делит граница окна, учитывается пропорционально своей
+доле в окне. Поэтому окно скользит вместе с текущим временем, а не
+по календарным минутам, реплики не перезаписывают результаты друг
+друга, а после рестарта не нужно восстанавливать состояние из stream'а.
+"""
+
+import os
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, Optional, Tuple
+
+from app.db.redis import AGGREGATION_WINDOWS, ALL_EVENT_TYPES
+
+# Размер корзины, с: шаг скольжения окна и число HMGET на чтение окна
+WINDOW_BUCKET_SECONDS = int(os.getenv("WINDOW_BUCKET_SECONDS", "10"))
+# Запас TTL корзин сверх самого длинного окна, с
+TTL_SLACK = 120
+
+# (event_type, amount, timestamp в секундах или None)
+TotalsEvent = Tuple[str, float, Optional[float]]
+
+
+def metrics_bucket_key(bucket: int) -> str:
+    """Хэш итогов корзины: bucket - номер корзины от эпохи"""
+    return f"aggregated_metrics:bucket:{bucket}"
+
+
+class WindowTotals:
+    def __init__(self, redis, windows: Iterable[int] = AGGREGATION_WINDOWS, clock=time.time,
+                 bucket_seconds: int = WINDOW_BUCKET_SECONDS):
+        self.redis = redis
+        self.horizon = max(windows) * 60
+        self.ttl = self.horizon + TTL_SLACK
+        self.clock = clock
+        self.bucket_seconds = bucket_seconds
+
+    async def add(self, events: Iterable[TotalsEvent]):
+        """Пачка событий -> один pipeline HINCRBYFLOAT/HINCRBY.
+
+        Итоги пачки складываются заранее, поэтому число команд зависит от
+        числа различных (корзина, тип), а не событий.
+        """
+        now = self.clock()
+        current = int(now // self.bucket_seconds)
+        totals: Dict[int, Dict[str, list]] = defaultdict(lambda: defaultdict(lambda: [0.0, 0]))
+        for event_type, amount, timestamp in events:
+            # События из будущего относятся к текущей корзине
+            bucket = current if timestamp is None else min(int(timestamp // self.bucket_seconds), current)
+            # Корзина целиком старше самого длинного окна
+            if (bucket + 1) * self.bucket_seconds <= now - self.horizon:
+                continue
+            for key in (event_type, ALL_EVENT_TYPES):
+                entry = totals[bucket][key]
+                entry[0] += amount
+                entry[1] += 1
+        if not totals:
+            return
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for bucket, by_type in totals.items():
+                key = metrics_bucket_key(bucket)
+                for event_type, (amount, count) in by_type.items():
+                    pipe.hincrbyfloat(key, f"amount:{event_type}", amount)
+                    pipe.hincrby(key, f"count:{event_type}", count)
+                pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+
+async def window_totals(redis, minutes: int, event_type: Optional[str] = None,
+                        now: Optional[float] = None,
+                        bucket_seconds: int = WINDOW_BUCKET_SECONDS) -> Tuple[float, int]:
+    """Сумма amount и число событий за последние minutes минут.
+
+    Погрешность - события одной корзины на границе окна: её доля
+    оценивается в предположении равномерного распределения внутри корзины.
+    """
+    field = event_type or ALL_EVENT_TYPES
+    now = time.time() if now is None else now
+    start = now - minutes * 60
+    first, last = int(start // bucket_seconds), int(now // bucket_seconds)
+    async with redis.pipeline(transaction=False) as pipe:
+        for bucket in range(first, last + 1):
+            pipe.hmget(metrics_bucket_key(bucket), f"amount:{field}", f"count:{field}")
+        rows = await pipe.execute()
+
+    # Доля первой корзины, попадающая в окно
+    weights = [((first + 1) * bucket_seconds - start) / bucket_seconds] + [1.0] * (len(rows) - 1)
+    total_amount = sum(float(amount or 0) * weight for (amount, _), weight in zip(rows, weights))
+    total_count = round(sum(int(count or 0) * weight for (_, count), weight in zip(rows, weights)))
+    return total_amount, total_count
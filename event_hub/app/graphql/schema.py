@@ -1,12 +1,26 @@
 import strawberry
-import json
-from typing import List, AsyncGenerator
+import base64
+import enum
+import logging
+import os
+from typing import Annotated, List, AsyncGenerator, Optional, Tuple, Any, Dict
 from datetime import datetime
-import asyncio
-from app.db.mongo import get_last_events
-from app.db.redis import r
+from bson import ObjectId
+from bson.errors import InvalidId
+from graphql import GraphQLError
+from strawberry.types.nodes import SelectedField, InlineFragment
+from app.db.mongo import db, get_events_page
+from app.db.leaderboard import top_users, user_stats
+from app.db.window_totals import window_totals
+from app.db.rollups import get_series
+from app.db.sketches import window_sketch_stats
+from app.queue.fanout import events_hub, EventFilter
+from app.db.redis import r, AGGREGATION_WINDOWS
 from strawberry.fastapi import GraphQLRouter
 
+logger = logging.getLogger(__name__)
+
+
 @strawberry.type
 class Event:
     id: str
@@ -14,79 +28,304 @@ class Event:
     event_type: str = strawberry.field(name="eventType")
     amount: float
     timestamp: datetime
+    # Позиция для продолжения: keyset-курсор в lastEvents/eventsPage
+    # и ID записи Redis Stream в eventStream
+    cursor: Optional[str] = None
+
+
+@strawberry.type
+class EventPage:
+    events: List[Event]
+    next_cursor: Optional[str]
+    has_more: bool
+
 
 @strawberry.type
 class AggregatedMetric:
     total_amount: float
     event_count: int
     time_window: str
+    event_type: Optional[str] = None
+    # Оценки по скетчам минут окна: HyperLogLog (~0.8%) и DDSketch
+    distinct_users: Optional[int] = None
+    p50_amount: Optional[float] = None
+    p95_amount: Optional[float] = None
+    p99_amount: Optional[float] = None
+
+
+# Поля AggregatedMetric, для которых читаются скетчи
+SKETCH_FIELDS = {"distinctUsers", "p50Amount", "p95Amount", "p99Amount"}
+
+
+@strawberry.enum
+class Granularity(enum.Enum):
+    MINUTE = "minute"
+    HOUR = "hour"
+    DAY = "day"
+
+
+@strawberry.type
+class MetricPoint:
+    bucket_start: datetime
+    total_amount: float
+    event_count: int
+
+
+@strawberry.type
+class UserTotal:
+    user_id: str
+    total_amount: float
+    event_count: int
+    rank: int
+
+
+@strawberry.type
+class UserWindowStats:
+    time_window: str
+    total_amount: float
+    event_count: int
+    # Место по сумме amount в окне; null - событий в окне нет
+    rank: Optional[int] = None
+
+
+# Жёсткий предел размера страницы событий
+MAX_PAGE_SIZE = int(os.getenv("GRAPHQL_MAX_PAGE_SIZE", "100"))
+# Предел числа точек ряда metricsSeries
+MAX_SERIES_POINTS = int(os.getenv("GRAPHQL_MAX_SERIES_POINTS", "2000"))
+# Предел n в topUsers
+MAX_TOP_USERS = int(os.getenv("GRAPHQL_MAX_TOP_USERS", "100"))
+
+
+def check_window(minutes: int):
+    if minutes not in AGGREGATION_WINDOWS:
+        raise GraphQLError(
+            f"Unsupported window: {minutes}. Supported: {list(AGGREGATION_WINDOWS)}",
+            extensions={'code': 'BAD_USER_INPUT'}
+        )
+
+
+# Поле GraphQL -> поле документа MongoDB
+EVENT_FIELD_MAP = {
+    "id": "_id",
+    "userId": "user_id",
+    "eventType": "event_type",
+    "amount": "amount",
+    "timestamp": "timestamp",
+}
+
+
+def encode_cursor(timestamp: datetime, event_id: Any) -> str:
+    raw = f"{timestamp.isoformat()}|{event_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    try:
+        timestamp, event_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(timestamp), ObjectId(event_id)
+    except (ValueError, InvalidId):
+        raise GraphQLError("Invalid cursor", extensions={'code': 'BAD_USER_INPUT'})
+
+
+def requested_event_fields(selections) -> List[str]:
+    """Поля документа, нужные для запрошенных полей Event"""
+    fields = []
+    for selection in selections:
+        if isinstance(selection, InlineFragment):
+            fields.extend(requested_event_fields(selection.selections))
+        elif isinstance(selection, SelectedField) and selection.name in EVENT_FIELD_MAP:
+            fields.append(EVENT_FIELD_MAP[selection.name])
+        elif not isinstance(selection, SelectedField):
+            # Именованный фрагмент: проекцию не сужаем
+            return list(EVENT_FIELD_MAP.values())
+    return fields
+
+
+def to_event(e: Dict[str, Any]) -> Event:
+    # При проекции отсутствующие поля не запрошены клиентом
+    return Event(
+        id=str(e.get("_id", "")),
+        user_id=e.get("user_id", ""),
+        event_type=e.get("event_type", ""),
+        amount=e.get("amount", 0.0),
+        timestamp=e["timestamp"],
+        cursor=encode_cursor(e["timestamp"], e["_id"])
+    )
+
+
+async def load_events_page(
+    limit: int,
+    after: Optional[str],
+    user_id: Optional[str],
+    event_type: Optional[str],
+    since: Optional[datetime],
+    until: Optional[datetime],
+    projection: List[str],
+) -> EventPage:
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise GraphQLError(
+            f"limit must be between 1 and {MAX_PAGE_SIZE}",
+            extensions={'code': 'BAD_USER_INPUT'}
+        )
+    docs = await get_events_page(
+        limit + 1,
+        after=decode_cursor(after) if after else None,
+        user_id=user_id,
+        event_type=event_type,
+        since=since,
+        until=until,
+        projection=projection
+    )
+    has_more = len(docs) > limit
+    events = [to_event(e) for e in docs[:limit]]
+    return EventPage(
+        events=events,
+        next_cursor=events[-1].cursor if has_more else None,
+        has_more=has_more
+    )
+
 
 @strawberry.type
 class Query:
     @strawberry.field
-    async def last_events(self, limit: int = 5) -> List[Event]:
-        events = await get_last_events(limit)
-        return [Event(
-            id=str(e.get("_id", "")),
-            user_id=e["user_id"],
-            event_type=e["event_type"],
-            amount=e["amount"],
-            timestamp=e["timestamp"]
-        ) for e in events]
-    
+    async def last_events(
+        self,
+        info: strawberry.Info,
+        limit: int = 5,
+        after: Optional[str] = None,
+        user_id: Optional[str] = None,
+        event_type: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ) -> List[Event]:
+        projection = requested_event_fields(info.selected_fields[0].selections)
+        page = await load_events_page(limit, after, user_id, event_type, since, until, projection)
+        return page.events
+
     @strawberry.field
-    async def aggregated_metrics(self, minutes: int = 1) -> AggregatedMetric:
+    async def events_page(
+        self,
+        info: strawberry.Info,
+        limit: int = 20,
+        after: Optional[str] = None,
+        user_id: Optional[str] = None,
+        event_type: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ) -> EventPage:
+        projection: List[str] = []
+        for selection in info.selected_fields[0].selections:
+            if isinstance(selection, SelectedField) and selection.name == "events":
+                projection = requested_event_fields(selection.selections)
+        return await load_events_page(limit, after, user_id, event_type, since, until, projection)
+
+    @strawberry.field
+    async def aggregated_metrics(
+        self, info: strawberry.Info, minutes: int = 1, event_type: Optional[str] = None
+    ) -> AggregatedMetric:
+        check_window(minutes)
+
+        total_amount, total_count = 0.0, 0
         try:
-            # Получаем агрегированные метрики из Redis
-            metrics_data = await r.get("aggregated_metrics")
-            if metrics_data:
-                metrics = json.loads(metrics_data)
-                total_amount = sum(m["total_amount"] for m in metrics.values())
-                total_count = sum(m["count"] for m in metrics.values())
-                
-                return AggregatedMetric(
-                    total_amount=total_amount,
-                    event_count=total_count,
-                    time_window=f"last_{minutes}_minutes"
-                )
+            # Сумма минутных хэшей окна, которые пополняет consumer метрик
+            total_amount, total_count = await window_totals(r, minutes, event_type)
         except Exception as e:
-            print(f"Error getting aggregated metrics: {e}")
-        
-        # Fallback если метрики недоступны
-        return AggregatedMetric(
-            total_amount=0.0,
-            event_count=0,
-            time_window=f"last_{minutes}_minutes"
+            logger.exception(f"Error getting aggregated metrics: {e}")
+
+        metric = AggregatedMetric(
+            total_amount=total_amount,
+            event_count=total_count,
+            time_window=f"last_{minutes}_minutes",
+            event_type=event_type
         )
+        selected = {
+            selection.name for selection in info.selected_fields[0].selections
+            if isinstance(selection, SelectedField)
+        }
+        # Скетчи читаются, только если запрошены (или поля не разобрать)
+        if selected & SKETCH_FIELDS or len(selected) < len(info.selected_fields[0].selections):
+            try:
+                stats = await window_sketch_stats(r, minutes, event_type)
+                metric.distinct_users = stats["distinct_users"]
+                metric.p50_amount = stats["p50"]
+                metric.p95_amount = stats["p95"]
+                metric.p99_amount = stats["p99"]
+            except Exception as e:
+                logger.exception(f"Error getting sketch metrics: {e}")
+        return metric
+
+    @strawberry.field
+    async def metrics_series(
+        self,
+        granularity: Granularity,
+        since: Annotated[datetime, strawberry.argument(name="from")],
+        until: Annotated[datetime, strawberry.argument(name="to")],
+        event_type: Optional[str] = None,
+    ) -> List[MetricPoint]:
+        """Итоги по корзинам [from, to) из rollup-коллекций; корзины без событий пропущены"""
+        if until <= since:
+            raise GraphQLError("'to' must be after 'from'", extensions={'code': 'BAD_USER_INPUT'})
+        docs = await get_series(db, granularity.value, since, until, event_type, limit=MAX_SERIES_POINTS)
+        return [
+            MetricPoint(
+                bucket_start=doc["bucket_start"],
+                total_amount=doc["total_amount"],
+                event_count=doc["event_count"]
+            )
+            for doc in docs
+        ]
+
+    @strawberry.field
+    async def top_users(self, window: int = 60, event_type: Optional[str] = None, n: int = 10) -> List[UserTotal]:
+        """Пользователи с наибольшей суммой amount за последние window минут"""
+        check_window(window)
+        if not 1 <= n <= MAX_TOP_USERS:
+            raise GraphQLError(
+                f"n must be between 1 and {MAX_TOP_USERS}",
+                extensions={'code': 'BAD_USER_INPUT'}
+            )
+        leaders = await top_users(r, window, event_type, n)
+        return [UserTotal(**leader) for leader in leaders]
+
+    @strawberry.field
+    async def user_stats(self, user_id: str, event_type: Optional[str] = None) -> List[UserWindowStats]:
+        """Итоги пользователя по всем окнам"""
+        return [
+            UserWindowStats(
+                time_window=f"last_{stats['minutes']}_minutes",
+                total_amount=stats["total_amount"],
+                event_count=stats["event_count"],
+                rank=stats["rank"]
+            )
+            for stats in await user_stats(r, user_id, event_type)
+        ]
+
 
 @strawberry.type
 class Subscription:
     @strawberry.subscription
-    async def event_stream(self) -> AsyncGenerator[Event, None]:
-        last_id = "0"
-        while True:
-            try:
-                messages = await r.xread({"events": last_id}, count=1, block=1000)
-                
-                for stream, stream_messages in messages:
-                    for message_id, fields in stream_messages:
-                        last_id = message_id
-                        
-                        # Создаем Event объект из Redis данных
-                        event = Event(
-                            id=fields.get("event_id", ""),
-                            user_id=fields.get("user_id", ""),
-                            event_type=fields.get("event_type", ""),
-                            amount=float(fields.get("amount", 0)),
-                            timestamp=datetime.fromisoformat(fields.get("timestamp", ""))
-                        )
-                        yield event
-                
-                await asyncio.sleep(0.1)  # Небольшая пауза
-                
-            except Exception as e:
-                print(f"Subscription error: {e}")
-                await asyncio.sleep(1)
+    async def event_stream(
+        self,
+        cursor: Optional[str] = None,
+        event_types: Optional[List[str]] = None,
+        user_id: Optional[str] = None,
+        min_amount: Optional[float] = None,
+        max_amount: Optional[float] = None,
+    ) -> AsyncGenerator[Event, None]:
+        # Без cursor подписка начинается с новых событий ("$");
+        # фильтры применяются на сервере до постановки в очередь
+        subscriber = events_hub.subscribe(EventFilter(event_types, user_id, min_amount, max_amount))
+        # События приходят уже декодированными (app.queue.codec)
+        async for message_id, fields in subscriber.messages(cursor):
+            yield Event(
+                id=fields["event_id"],
+                user_id=fields["user_id"],
+                event_type=fields["event_type"],
+                amount=fields["amount"],
+                timestamp=fields["timestamp"],
+                cursor=message_id
+            )
+
 
 schema = strawberry.Schema(query=Query, subscription=Subscription)
-graphql_app = GraphQLRouter(schema)
\ No newline at end of file
+graphql_app = GraphQLRouter(schema)
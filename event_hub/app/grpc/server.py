@@ -1,17 +1,26 @@
 import asyncio
 import grpc
-from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor
+import os
+import signal
+from datetime import datetime, timezone
 import logging
-from typing import AsyncIterator
+from typing import AsyncIterator, Any, Dict, List, Optional, Tuple
 
-from app.db.mongo import save_event
-from app.db.redis import r
-from app.models.event import Event
+from app.admission import Overloaded, ingest_admission
+from app.auth.jwt_auth import GRPCAuthInterceptor, bearer_token, current_grpc_principal, tenant_from_token
+from app.db.connections import open_connections, close_connections
+from app.db.dedup import DuplicateEvent
+from app.db.mongo import save_event, bootstrap_storage, coalescer, OUTBOX_ENABLED, ENSURE_INDEXES
+from app.db.redis import publish_events
+from app.ingest import ingest_events
+
+from app.queue.fanout import events_hub, EventFilter
+from app.queue.codec import from_timestamp_us
 
 # Импортируем сгенерированные protobuf классы
 try:
-    from protos import event_pb2, event_pb2_grpc
+    from protos import event_pb2_grpc
+    from protos.event_pb2 import EventResponse, EventAck, BatchAck
 except ImportError:
     # Fallback для случая, когда protobuf не сгенерированы
     class EventRequest:
@@ -20,52 +29,112 @@ except ImportError:
             self.event_type = ""
             self.amount = 0.0
             self.timestamp = ""
-    
+            self.idempotency_key = ""
+
     class EventResponse:
-        def __init__(self):
-            self.event_id = ""
-            self.status = ""
-            self.message = ""
-    
+        def __init__(self, event_id="", status="", message=""):
+            self.event_id = event_id
+            self.status = status
+            self.message = message
+
     class StreamRequest:
         def __init__(self):
             self.limit = 0
 
+    class EventAck:
+        def __init__(self, index=0, event_id="", status="", message=""):
+            self.index = index
+            self.event_id = event_id
+            self.status = status
+            self.message = message
+
+    class BatchAck:
+        def __init__(self, acks=(), accepted=0, rejected=0):
+            self.acks = list(acks)
+            self.accepted = accepted
+            self.rejected = rejected
+
 logger = logging.getLogger(__name__)
 
+# Пачки потокового приёма SendEvents
+SEND_EVENTS_BATCH_SIZE = int(os.getenv("GRPC_SEND_EVENTS_BATCH_SIZE", "500"))
+SEND_EVENTS_MAX_DELAY = float(os.getenv("GRPC_SEND_EVENTS_MAX_DELAY_MS", "20")) / 1000
+
+_STREAM_END = object()
+
+
+def request_to_dict(request) -> Dict[str, Any]:
+    """Создает словарь события из gRPC запроса"""
+    # v2-клиенты передают типизированный event_time, строка - для старых клиентов
+    if request.HasField("event_time"):
+        timestamp = from_timestamp_us(request.event_time.ToMicroseconds())
+    elif request.timestamp:
+        timestamp = datetime.fromisoformat(request.timestamp.replace('Z', ''))
+    else:
+        # Наивное время хранится как UTC
+        timestamp = datetime.now(timezone.utc).replace(tzinfo=None)
+    event_dict = {
+        "user_id": request.user_id,
+        "event_type": request.event_type,
+        "amount": request.amount,
+        "timestamp": timestamp
+    }
+    if request.idempotency_key:
+        event_dict["idempotency_key"] = request.idempotency_key
+    return event_dict
+
+
+def grpc_tenant(context) -> Optional[str]:
+    """Арендатор вызова: принципал из интерцептора или токен из метаданных"""
+    principal = current_grpc_principal()
+    if principal is not None:
+        return principal.get("sub") or principal.get("user_id")
+    for key, value in context.invocation_metadata() or ():
+        if key == "authorization":
+            return tenant_from_token(bearer_token(value))
+    return None
+
+
+async def abort_overloaded(context, error: Overloaded):
+    """RESOURCE_EXHAUSTED с retry-after в trailing metadata"""
+    context.set_trailing_metadata((("retry-after", error.retry_after_header),))
+    await context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, str(error))
+
+
 class EventServicer:
     async def SendEvent(self, request, context):
+        # Контроль допуска до начала обработки (app.admission)
+        try:
+            async with ingest_admission.admit(grpc_tenant(context)):
+                return await self._send_event(request)
+        except Overloaded as e:
+            await abort_overloaded(context, e)
+
+    async def _send_event(self, request):
         try:
             # Создаем Event объект из gRPC запроса
-            event_dict = {
-                "user_id": request.user_id,
-                "event_type": request.event_type,
-                "amount": request.amount,
-                "timestamp": datetime.fromisoformat(request.timestamp.replace('Z', '')) if request.timestamp else datetime.now()
-            }
-            
+            event_dict = request_to_dict(request)
+
             # Сохраняем в MongoDB
             result = await save_event(event_dict)
             event_id = str(result.inserted_id)
-            
-            # Публикуем в Redis
-            redis_data = {
-                "event_id": event_id,
-                "user_id": event_dict["user_id"],
-                "event_type": event_dict["event_type"],
-                "amount": str(event_dict["amount"]),
-                "timestamp": event_dict["timestamp"].isoformat()
-            }
-            await r.xadd("events", redis_data)
-            
-            logger.info(f"gRPC Event saved with ID: {event_id}")
-            
+
+            # Повтор уже опубликован вместе с оригиналом
+            if isinstance(result, DuplicateEvent):
+                return EventResponse(event_id=event_id, status="success", message="Duplicate event")
+
+            # Публикуем в Redis; в режиме outbox это делает relay
+            if not OUTBOX_ENABLED:
+                await publish_events([(event_id, event_dict)])
+
+            logger.debug("gRPC Event saved with ID: %s", event_id)
+
             return EventResponse(
                 event_id=event_id,
                 status="success",
                 message="Event saved successfully"
             )
-            
+
         except Exception as e:
             logger.error(f"gRPC error: {str(e)}")
             return EventResponse(
@@ -73,25 +142,129 @@ class EventServicer:
                 status="error",
                 message=str(e)
             )
-    
+
+    async def _commit_batch(self, batch: List[Any], first_index: int) -> BatchAck:
+        """Сохраняет пачку запросов и формирует подтверждение по каждому"""
+        acks: List[EventAck] = []
+        docs: List[Dict[str, Any]] = []
+        positions: List[int] = []
+        for offset, request in enumerate(batch):
+            try:
+                docs.append(request_to_dict(request))
+                positions.append(offset)
+            except ValueError as e:
+                acks.append(EventAck(index=first_index + offset, status="error", message=str(e)))
+
+        saved, _ = await ingest_events(docs) if docs else ({}, True)
+        for pos, offset in enumerate(positions):
+            outcome = saved[pos]
+            if isinstance(outcome, Exception):
+                acks.append(EventAck(index=first_index + offset, status="error", message=str(outcome)))
+            else:
+                message = "Duplicate event" if isinstance(outcome, DuplicateEvent) else ""
+                acks.append(EventAck(
+                    index=first_index + offset, event_id=str(outcome), status="success", message=message
+                ))
+
+        acks.sort(key=lambda ack: ack.index)
+        accepted = sum(1 for ack in acks if ack.status == "success")
+        return BatchAck(acks=acks, accepted=accepted, rejected=len(acks) - accepted)
+
+    async def SendEvents(self, request_iterator, context) -> AsyncIterator[BatchAck]:
+        """Потоковый приём: пачка фиксируется по размеру или по таймауту"""
+        # Ограниченная очередь: пока идёт запись пачки, чтение потока
+        # приостанавливается и gRPC flow control тормозит клиента
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SEND_EVENTS_BATCH_SIZE * 2)
+
+        async def read_requests():
+            # Маркер конца ставится и после ошибки чтения, но не после
+            # отмены: тогда очередь никто не читает и put() ждал бы вечно
+            try:
+                async for request in request_iterator:
+                    await queue.put(request)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                await queue.put(_STREAM_END)
+                raise
+            await queue.put(_STREAM_END)
+
+        tenant = grpc_tenant(context)
+        reader = asyncio.create_task(read_requests())
+        loop = asyncio.get_running_loop()
+        next_index = 0
+        finished = False
+        try:
+            while not finished:
+                item = await queue.get()
+                if item is _STREAM_END:
+                    break
+                batch = [item]
+                deadline = loop.time() + SEND_EVENTS_MAX_DELAY
+                while len(batch) < SEND_EVENTS_BATCH_SIZE:
+                    try:
+                        item = queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        remaining = deadline - loop.time()
+                        if remaining <= 0:
+                            break
+                        try:
+                            item = await asyncio.wait_for(queue.get(), remaining)
+                        except asyncio.TimeoutError:
+                            break
+                    if item is _STREAM_END:
+                        finished = True
+                        break
+                    batch.append(item)
+
+                try:
+                    async with ingest_admission.admit(tenant, cost=len(batch)):
+                        ack = await self._commit_batch(batch, next_index)
+                except Overloaded as e:
+                    # Пачки до этой уже подтверждены, клиент повторит остаток
+                    await abort_overloaded(context, e)
+                except Exception as e:
+                    logger.error(f"gRPC batch error: {str(e)}")
+                    ack = BatchAck(
+                        acks=[EventAck(index=next_index + i, status="error", message=str(e))
+                              for i in range(len(batch))],
+                        accepted=0,
+                        rejected=len(batch)
+                    )
+                next_index += len(batch)
+                yield ack
+            # Ошибка чтения потока (обрыв, некорректное сообщение) завершает
+            # вызов ошибкой после подтверждения уже принятых пачек
+            await reader
+        finally:
+            if not reader.done():
+                reader.cancel()
+            await asyncio.gather(reader, return_exceptions=True)
+
     async def StreamEvents(self, request, context) -> AsyncIterator[EventResponse]:
         try:
-            # Читаем события из Redis Stream
-            last_id = "0"
-            while True:
-                messages = await r.xread({"events": last_id}, count=request.limit, block=1000)
-                
-                for stream, stream_messages in messages:
-                    for message_id, fields in stream_messages:
-                        last_id = message_id
-                        yield EventResponse(
-                            event_id=fields.get("event_id", ""),
-                            status="stream",
-                            message=f"Event: {fields.get('event_type', '')} - {fields.get('amount', '')}"
-                        )
-                
-                await asyncio.sleep(1)  # Пауза между чтениями
-                
+            # Читаем события через общий hub с фильтрацией на сервере
+            event_filter = EventFilter(
+                event_types=list(request.event_types),
+                user_id=request.user_id or None,
+                min_amount=request.min_amount if request.HasField("min_amount") else None,
+                max_amount=request.max_amount if request.HasField("max_amount") else None,
+            )
+            subscriber = events_hub.subscribe(event_filter)
+            sent = 0
+            # limit - размер чтения истории, как у прежнего XREAD count;
+            # завершить поток можно только явным max_events
+            messages = subscriber.messages(request.cursor or None, batch_size=request.limit or None)
+            async for message_id, fields in messages:
+                yield EventResponse(
+                    event_id=fields["event_id"],
+                    status="stream",
+                    message=f"Event: {fields['event_type']} - {fields['amount']}"
+                )
+                sent += 1
+                if request.max_events and sent >= request.max_events:
+                    return
+
         except Exception as e:
             logger.error(f"gRPC stream error: {str(e)}")
             yield EventResponse(
@@ -100,24 +273,131 @@ class EventServicer:
                 message=str(e)
             )
 
-async def serve():
-    server = grpc.aio.server(ThreadPoolExecutor(max_workers=10))
-    
+
+# Роли, требуемые методами EventService при GRPC_AUTH_ENABLED=true
+METHOD_ROLES = {
+    "/event.EventService/SendEvent": "writer",
+    "/event.EventService/SendEvents": "writer",
+    "/event.EventService/StreamEvents": "reader",
+}
+
+
+class ServerConfig:
+    """Настройки gRPC сервера (переменные окружения GRPC_*)"""
+
+    def __init__(
+        self,
+        listen_addr: str = '[::]:50051',
+        max_concurrent_rpcs: Optional[int] = None,
+        max_concurrent_streams: int = 0,
+        keepalive_time_ms: int = 60000,
+        keepalive_timeout_ms: int = 20000,
+        max_message_mb: int = 4,
+        compression: str = "none",
+        reuse_port: bool = False,
+        shutdown_grace: float = 10.0,
+        auth_enabled: bool = False,
+    ):
+        self.listen_addr = listen_addr
+        self.max_concurrent_rpcs = max_concurrent_rpcs
+        self.max_concurrent_streams = max_concurrent_streams
+        self.keepalive_time_ms = keepalive_time_ms
+        self.keepalive_timeout_ms = keepalive_timeout_ms
+        self.max_message_mb = max_message_mb
+        self.compression = compression
+        self.reuse_port = reuse_port
+        self.shutdown_grace = shutdown_grace
+        self.auth_enabled = auth_enabled
+
+    @classmethod
+    def from_env(cls) -> "ServerConfig":
+        max_rpcs = int(os.getenv("GRPC_MAX_CONCURRENT_RPCS", "0"))
+        return cls(
+            listen_addr=os.getenv("GRPC_LISTEN_ADDR", '[::]:50051'),
+            max_concurrent_rpcs=max_rpcs or None,
+            max_concurrent_streams=int(os.getenv("GRPC_MAX_CONCURRENT_STREAMS", "0")),
+            keepalive_time_ms=int(os.getenv("GRPC_KEEPALIVE_TIME_MS", "60000")),
+            keepalive_timeout_ms=int(os.getenv("GRPC_KEEPALIVE_TIMEOUT_MS", "20000")),
+            max_message_mb=int(os.getenv("GRPC_MAX_MESSAGE_MB", "4")),
+            compression=os.getenv("GRPC_COMPRESSION", "none").lower(),
+            reuse_port=os.getenv("GRPC_SO_REUSEPORT", "false").lower() == "true",
+            shutdown_grace=float(os.getenv("GRPC_SHUTDOWN_GRACE_SECONDS", "10")),
+            auth_enabled=os.getenv("GRPC_AUTH_ENABLED", "false").lower() == "true",
+        )
+
+    def options(self) -> List[Tuple[str, Any]]:
+        """Channel arguments для grpc.aio.server"""
+        max_message = self.max_message_mb * 1024 * 1024
+        options = [
+            ("grpc.keepalive_time_ms", self.keepalive_time_ms),
+            ("grpc.keepalive_timeout_ms", self.keepalive_timeout_ms),
+            ("grpc.keepalive_permit_without_calls", 1),
+            ("grpc.http2.min_ping_interval_without_data_ms", self.keepalive_time_ms // 2),
+            ("grpc.max_receive_message_length", max_message),
+            ("grpc.max_send_message_length", max_message),
+            # SO_REUSEPORT позволяет нескольким процессам слушать один порт
+            ("grpc.so_reuseport", 1 if self.reuse_port else 0),
+        ]
+        if self.max_concurrent_streams:
+            options.append(("grpc.max_concurrent_streams", self.max_concurrent_streams))
+        return options
+
+    def grpc_compression(self) -> grpc.Compression:
+        if self.compression == "gzip":
+            return grpc.Compression.Gzip
+        return grpc.Compression.NoCompression
+
+
+def build_server(config: ServerConfig, servicer=None) -> grpc.aio.Server:
+    """Создает gRPC сервер; все обработчики асинхронные, пул потоков не нужен"""
+    # JWT проверяется один раз на вызов; для потоков - один раз на поток
+    interceptors = [GRPCAuthInterceptor(METHOD_ROLES)] if config.auth_enabled else []
+    server = grpc.aio.server(
+        options=config.options(),
+        compression=config.grpc_compression(),
+        maximum_concurrent_rpcs=config.max_concurrent_rpcs,
+        interceptors=interceptors,
+    )
+
     # Регистрируем сервис
     try:
-        from protos import event_pb2_grpc
-        event_pb2_grpc.add_EventServiceServicer_to_server(EventServicer(), server)
-    except ImportError:
+        event_pb2_grpc.add_EventServiceServicer_to_server(servicer or EventServicer(), server)
+    except NameError:
         # Fallback если protobuf не сгенерированы
-        pass
-    
-    listen_addr = '[::]:50051'
-    server.add_insecure_port(listen_addr)
-    
-    logger.info(f"Starting gRPC server on {listen_addr}")
+        logger.warning("protobuf modules not generated, EventService not registered")
+
+    server.add_insecure_port(config.listen_addr)
+    return server
+
+
+async def serve(config: Optional[ServerConfig] = None):
+    config = config or ServerConfig.from_env()
+    server = build_server(config)
+
+    # Graceful shutdown: по SIGTERM/SIGINT новые вызовы отклоняются,
+    # а текущие дорабатывают в течение shutdown_grace секунд
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    logger.info(f"Starting gRPC server on {config.listen_addr}")
+    await open_connections()
     await server.start()
-    await server.wait_for_termination()
+    index_task = asyncio.create_task(bootstrap_storage()) if ENSURE_INDEXES else None
+    try:
+        await stop.wait()
+        logger.info(f"Stopping gRPC server, draining for up to {config.shutdown_grace}s")
+        await server.stop(config.shutdown_grace)
+    finally:
+        if index_task and not index_task.done():
+            index_task.cancel()
+        await coalescer.close()
+        await close_connections()
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
-    asyncio.run(serve()) 
\ No newline at end of file
+    asyncio.run(serve())
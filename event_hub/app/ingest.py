@@ -0,0 +1,37 @@
+"""
+Пакетный приём событий, общий для REST и gRPC
+"""
+
+import logging
+from typing import Any, Dict, List, Tuple
+
+from app.db.dedup import DuplicateEvent
+from app.db.mongo import save_events, OUTBOX_ENABLED
+from app.db.redis import publish_events
+
+logger = logging.getLogger(__name__)
+
+
+async def ingest_events(event_dicts: List[Dict[str, Any]]) -> Tuple[Dict[int, Any], bool]:
+    """Сохраняет пачку одним insert_many и публикует её одним pipeline.
+
+    Возвращает {индекс: ObjectId | DuplicateEvent | Exception} и признак
+    успешной публикации. Повторы не публикуются; в режиме outbox
+    публикацию выполняет relay.
+    """
+    saved = await save_events(event_dicts)
+
+    if OUTBOX_ENABLED:
+        return saved, True
+
+    to_publish = [
+        (str(outcome), event_dicts[i])
+        for i, outcome in saved.items()
+        if not isinstance(outcome, (Exception, DuplicateEvent))
+    ]
+    try:
+        await publish_events(to_publish)
+        return saved, True
+    except Exception as e:
+        logger.error(f"Redis publish error: {str(e)}")
+        return saved, False
@@ -1,9 +1,38 @@
 # app/main.py
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from app.admission import Overloaded
 from app.api.routes import router as api_router
+from app.db.connections import open_connections, close_connections
+from app.db.mongo import bootstrap_storage, coalescer, ENSURE_INDEXES
 from app.graphql.schema import graphql_app
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await open_connections()
+    # Индексы строятся в фоне и не задерживают старт
+    index_task = asyncio.create_task(bootstrap_storage()) if ENSURE_INDEXES else None
+    yield
+    if index_task and not index_task.done():
+        index_task.cancel()
+    # Дописываем накопленные в микробатче события перед остановкой
+    await coalescer.close()
+    await close_connections()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    return JSONResponse(
+        {"detail": str(exc), "reason": exc.reason},
+        status_code=429,
+        headers={"Retry-After": exc.retry_after_header},
+    )
 
 app.include_router(api_router)
 app.include_router(graphql_app, prefix="/graphql")  # ⬅️ ВАЖНО!
@@ -16,31 +16,35 @@ from contextlib import contextmanager
 from typing import Dict, Any, Optional
 
 # Настройка трейсера
+
+
 def setup_tracing():
     """Настраивает OpenTelemetry трейсинг"""
     # Создаем провайдер трейсов
     resource = Resource.create({"service.name": "event-hub"})
     provider = TracerProvider(resource=resource)
-    
+
     # Настраиваем экспорт в Jaeger
     jaeger_exporter = JaegerExporter(
         agent_host_name=os.getenv("JAEGER_HOST", "localhost"),
         agent_port=int(os.getenv("JAEGER_PORT", "6831")),
     )
-    
+
     # Добавляем процессор для батчинга
     processor = BatchSpanProcessor(jaeger_exporter)
     provider.add_span_processor(processor)
-    
+
     # Устанавливаем провайдер как глобальный
     trace.set_tracer_provider(provider)
-    
+
     return provider
 
+
 def get_tracer(name: str = "event-hub"):
     """Получает трейсер"""
     return trace.get_tracer(name)
 
+
 @contextmanager
 def trace_operation(operation_name: str, attributes: Optional[Dict[str, Any]] = None):
     """Контекстный менеджер для трейсинга операций"""
@@ -53,6 +57,7 @@ def trace_operation(operation_name: str, attributes: Optional[Dict[str, Any]] =
             span.set_status(trace.Status(trace.StatusCode.ERROR, str(e)))
             raise
 
+
 def trace_persist_event(event_id: str, event_type: str, source: str):
     """Трейсит операцию сохранения события"""
     def decorator(func):
@@ -78,6 +83,7 @@ def trace_persist_event(event_id: str, event_type: str, source: str):
         return wrapper
     return decorator
 
+
 def trace_http_request(method: str, path: str, status_code: int, duration: float):
     """Трейсит HTTP запрос"""
     tracer = get_tracer()
@@ -95,6 +101,7 @@ def trace_http_request(method: str, path: str, status_code: int, duration: float
         else:
             span.set_status(trace.Status(trace.StatusCode.OK))
 
+
 def trace_grpc_request(method: str, status_code: int, duration: float):
     """Трейсит gRPC запрос"""
     tracer = get_tracer()
@@ -111,6 +118,7 @@ def trace_grpc_request(method: str, status_code: int, duration: float):
         else:
             span.set_status(trace.Status(trace.StatusCode.OK))
 
+
 def trace_mongo_operation(operation: str, collection: str, duration: float):
     """Трейсит операцию MongoDB"""
     tracer = get_tracer()
@@ -124,6 +132,7 @@ def trace_mongo_operation(operation: str, collection: str, duration: float):
     ) as span:
         span.set_status(trace.Status(trace.StatusCode.OK))
 
+
 def trace_queue_operation(operation: str, queue_name: str, message_count: int = None):
     """Трейсит операцию с очередью"""
     tracer = get_tracer()
@@ -133,26 +142,34 @@ def trace_queue_operation(operation: str, queue_name: str, message_count: int =
     }
     if message_count is not None:
         attributes["queue.message_count"] = message_count
-    
+
     with tracer.start_as_current_span("queue_operation", attributes=attributes) as span:
         span.set_status(trace.Status(trace.StatusCode.OK))
 
 # Инструментирование FastAPI
+
+
 def instrument_fastapi(app):
     """Инструментирует FastAPI приложение"""
     FastAPIInstrumentor.instrument_app(app)
 
 # Инструментирование gRPC
+
+
 def instrument_grpc():
     """Инструментирует gRPC сервер"""
     GrpcInstrumentorServer().instrument()
 
 # Инструментирование MongoDB
+
+
 def instrument_mongo():
     """Инструментирует MongoDB клиент"""
     PyMongoInstrumentor().instrument()
 
 # Инструментирование Redis
+
+
 def instrument_redis():
     """Инструментирует Redis клиент"""
-    RedisInstrumentor().instrument() 
\ No newline at end of file
+    RedisInstrumentor().instrument()
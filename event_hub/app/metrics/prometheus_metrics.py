@@ -2,9 +2,11 @@
 Prometheus метрики для Event Hub
 """
 
-from prometheus_client import Counter, Histogram, Gauge, generate_latest, CONTENT_TYPE_LATEST
-from typing import Dict, Any
-import time
+from prometheus_client import (
+    Counter, Histogram, Gauge, CollectorRegistry, generate_latest, CONTENT_TYPE_LATEST, multiprocess
+)
+from typing import Tuple
+import os
 
 # HTTP метрики
 http_requests_total = Counter(
@@ -27,10 +29,18 @@ events_ingested_total = Counter(
 )
 
 # Очередь
+# multiprocess_mode задаёт сведение gauge между воркерами (run_prod.py)
 queue_lag = Gauge(
     'queue_lag',
     'Number of messages in queue',
-    ['queue_name']
+    ['queue_name'],
+    multiprocess_mode='livemax'
+)
+
+subscription_messages_dropped_total = Counter(
+    'subscription_messages_dropped_total',
+    'Messages dropped for slow stream subscribers',
+    ['stream']
 )
 
 # MongoDB операции
@@ -46,6 +56,24 @@ mongo_operation_duration = Histogram(
     ['operation', 'collection']
 )
 
+# Микробатчинг записей в MongoDB
+mongo_batch_flush_size = Histogram(
+    'mongo_batch_flush_size',
+    'Number of documents per coalesced insert_many',
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000)
+)
+
+mongo_batch_flush_duration = Histogram(
+    'mongo_batch_flush_duration_seconds',
+    'Coalesced insert_many duration in seconds'
+)
+
+write_coalescer_queue_depth = Gauge(
+    'write_coalescer_queue_depth',
+    'Number of documents waiting in the write coalescer',
+    multiprocess_mode='livesum'
+)
+
 # gRPC метрики
 grpc_requests_total = Counter(
     'grpc_requests_total',
@@ -76,41 +104,190 @@ graphql_request_duration = Histogram(
 active_connections = Gauge(
     'active_connections',
     'Number of active connections',
-    ['type']
+    ['type'],
+    multiprocess_mode='livesum'
+)
+
+db_pool_connections = Gauge(
+    'db_pool_connections',
+    'Connections in client pool by state',
+    ['pool', 'state'],
+    multiprocess_mode='livesum'
+)
+
+db_pool_max_size = Gauge(
+    'db_pool_max_size',
+    'Configured maximum size of client pool',
+    ['pool'],
+    multiprocess_mode='livesum'
+)
+
+db_pool_wait_timeouts_total = Counter(
+    'db_pool_wait_timeouts_total',
+    'Requests that timed out waiting for a pooled connection',
+    ['pool']
 )
 
+# Проверка JWT: hit - из кэша, miss - с проверкой подписи
+auth_verification_duration = Histogram(
+    'auth_verification_duration_seconds',
+    'JWT verification duration in seconds',
+    ['result'],
+    buckets=(0.00001, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05)
+)
+
+# Контроль допуска на приём (app.admission)
+admission_rejections_total = Counter(
+    'admission_rejections_total',
+    'Ingestion requests rejected by admission control',
+    ['reason']
+)
+
+admission_in_flight = Gauge(
+    'admission_in_flight',
+    'Ingestion requests currently admitted',
+    multiprocess_mode='livesum'
+)
+
+admission_queue_depth = Gauge(
+    'admission_queue_depth',
+    'Ingestion requests waiting for admission',
+    multiprocess_mode='livesum'
+)
+
+admission_limit = Gauge(
+    'admission_limit',
+    'Current adaptive in-flight limit',
+    multiprocess_mode='livesum'
+)
+
+# Retention Redis Stream'ов (app.queue.retention)
+redis_stream_length = Gauge(
+    'redis_stream_length',
+    'Number of entries in Redis stream',
+    ['stream'],
+    multiprocess_mode='livemax'
+)
+
+redis_stream_memory_bytes = Gauge(
+    'redis_stream_memory_bytes',
+    'Memory used by Redis stream (MEMORY USAGE)',
+    ['stream'],
+    multiprocess_mode='livemax'
+)
+
+
 def record_http_request(method: str, endpoint: str, status: int, duration: float):
     """Записывает метрики HTTP запроса"""
     http_requests_total.labels(method=method, endpoint=endpoint, status=status).inc()
     http_request_duration.labels(method=method, endpoint=endpoint).observe(duration)
 
+
 def record_event_ingested(source: str, event_type: str):
     """Записывает метрики ингестированного события"""
     events_ingested_total.labels(source=source, type=event_type).inc()
 
+
 def update_queue_lag(queue_name: str, lag: int):
     """Обновляет метрики лага очереди"""
     queue_lag.labels(queue_name=queue_name).set(lag)
 
+
+def record_subscription_drop(stream: str):
+    """Учитывает сообщение, отброшенное для медленного подписчика"""
+    subscription_messages_dropped_total.labels(stream=stream).inc()
+
+
 def record_mongo_operation(operation: str, collection: str, duration: float):
     """Записывает метрики операции MongoDB"""
     mongo_ops_total.labels(operation=operation, collection=collection).inc()
     mongo_operation_duration.labels(operation=operation, collection=collection).observe(duration)
 
+
+def record_batch_flush(size: int, duration: float):
+    """Записывает метрики сброса пачки документов в MongoDB"""
+    mongo_batch_flush_size.observe(size)
+    mongo_batch_flush_duration.observe(duration)
+
+
+def update_coalescer_queue_depth(depth: int):
+    """Обновляет глубину очереди микробатчинга"""
+    write_coalescer_queue_depth.set(depth)
+
+
 def record_grpc_request(method: str, status: str, duration: float):
     """Записывает метрики gRPC запроса"""
     grpc_requests_total.labels(method=method, status=status).inc()
     grpc_request_duration.labels(method=method).observe(duration)
 
+
 def record_graphql_request(operation: str, status: str, duration: float):
     """Записывает метрики GraphQL запроса"""
     graphql_requests_total.labels(operation=operation, status=status).inc()
     graphql_request_duration.labels(operation=operation).observe(duration)
 
+
 def update_active_connections(conn_type: str, count: int):
     """Обновляет метрики активных соединений"""
     active_connections.labels(type=conn_type).set(count)
 
+
+def update_pool_connections(pool: str, in_use: int, idle: int):
+    """Обновляет загрузку пула соединений"""
+    db_pool_connections.labels(pool=pool, state='in_use').set(in_use)
+    db_pool_connections.labels(pool=pool, state='idle').set(idle)
+
+
+def set_pool_max_size(pool: str, size: int):
+    """Фиксирует настроенный размер пула"""
+    db_pool_max_size.labels(pool=pool).set(size)
+
+
+def record_pool_wait_timeout(pool: str):
+    """Учитывает таймаут ожидания соединения из пула"""
+    db_pool_wait_timeouts_total.labels(pool=pool).inc()
+
+
+def record_admission_rejection(reason: str):
+    """Учитывает отказ контроля допуска"""
+    admission_rejections_total.labels(reason=reason).inc()
+
+
+def update_admission_state(in_flight: int, queued: int, limit: int):
+    """Обновляет состояние контроля допуска"""
+    admission_in_flight.set(in_flight)
+    admission_queue_depth.set(queued)
+    admission_limit.set(limit)
+
+
+def record_auth_verification(result: str, duration: float):
+    """Записывает длительность проверки JWT"""
+    auth_verification_duration.labels(result=result).observe(duration)
+
+
+def mongo_latency_totals() -> Tuple[float, float]:
+    """Суммарные длительность и число операций MongoDB в этом процессе"""
+    duration = count = 0.0
+    for metric in mongo_operation_duration.collect():
+        for sample in metric.samples:
+            if sample.name.endswith('_sum'):
+                duration += sample.value
+            elif sample.name.endswith('_count'):
+                count += sample.value
+    return duration, count
+
+
+def update_stream_retention(stream: str, length: int, memory: int):
+    """Обновляет длину и занимаемую память stream'а"""
+    redis_stream_length.labels(stream=stream).set(length)
+    redis_stream_memory_bytes.labels(stream=stream).set(memory)
+
+
 def get_metrics():
     """Возвращает метрики в формате Prometheus"""
-    return generate_latest(), CONTENT_TYPE_LATEST 
\ No newline at end of file
+    # В multiprocess-режиме метрики собираются со всех воркеров
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -1,16 +1,17 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Optional
 from datetime import datetime
 
+
 class Event(BaseModel):
+    # timestamp приходит строкой ISO 8601 и разбирается pydantic-core один раз;
+    # datetime сериализуется в isoformat без дополнительных encoders
+    model_config = ConfigDict(populate_by_name=True)
+
     user_id: str
     event_type: str
     amount: float
     timestamp: datetime
     id: Optional[str] = Field(None, alias="_id")
-
-    class Config:
-        populate_by_name = True
-        json_encoders = {
-            datetime: lambda v: v.isoformat()
-        }
\ No newline at end of file
+    # Повтор с тем же ключом возвращает id исходного события (app.db.dedup)
+    idempotency_key: Optional[str] = Field(None, min_length=1, max_length=128)
@@ -0,0 +1,106 @@
+"""
+Кодек событий Redis Stream: одно бинарное поле (protobuf StreamEvent)
+вместо пяти строковых, общий для gRPC, consumer'ов и GraphQL
+"""
+
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Mapping
+
+try:
+    from protos.event_pb2 import StreamEvent
+except ImportError:
+    StreamEvent = None
+
+# Поле записи stream'а с сериализованным StreamEvent
+PAYLOAD_FIELD = "p"
+
+# binary - protobuf в одном поле, fields - прежние строковые поля
+STREAM_FORMAT = os.getenv("STREAM_FORMAT", "binary" if StreamEvent is not None else "fields")
+
+# Клиент Redis читает ответы как str с surrogateescape, поэтому бинарные
+# данные восстанавливаются без потерь
+_BYTES_ENCODING = ("utf-8", "surrogateescape")
+
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _naive_utc(dt: datetime) -> datetime:
+    """Наивное время в UTC: aware-время переводится, наивное считается UTC (как в BSON)"""
+    if dt.tzinfo is None:
+        return dt
+    return dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def to_timestamp_us(dt: datetime) -> int:
+    """datetime -> микросекунды от эпохи; наивное время - UTC.
+
+    Целочисленная арифметика: через float микросекунды теряются уже для
+    современных дат.
+    """
+    delta = _naive_utc(dt) - _EPOCH
+    return (delta.days * 86_400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+def from_timestamp_us(timestamp_us: int) -> datetime:
+    """Микросекунды от эпохи -> наивное datetime в UTC, независимо от TZ процесса"""
+    return _EPOCH + timedelta(microseconds=timestamp_us)
+
+
+def _as_str(value: Any) -> str:
+    return value.decode(*_BYTES_ENCODING) if isinstance(value, bytes) else value
+
+
+def encode_event(event_id: str, event_dict: Mapping[str, Any]) -> Dict[str, Any]:
+    """Поля записи stream'а для события"""
+    if STREAM_FORMAT == "binary":
+        payload = StreamEvent(
+            event_id=event_id,
+            user_id=event_dict["user_id"],
+            event_type=event_dict["event_type"],
+            amount=event_dict["amount"],
+            timestamp_us=to_timestamp_us(event_dict["timestamp"]),
+        )
+        return {PAYLOAD_FIELD: payload.SerializeToString()}
+
+    return {
+        "event_id": event_id,
+        "user_id": event_dict["user_id"],
+        "event_type": event_dict["event_type"],
+        "amount": str(event_dict["amount"]),
+        "timestamp": event_dict["timestamp"].isoformat()
+    }
+
+
+def decode_event(fields: Mapping[Any, Any]) -> Dict[str, Any]:
+    """Событие из записи stream'а в любом из двух форматов.
+
+    Возвращает словарь с event_id, user_id, event_type, amount (float)
+    и timestamp (datetime).
+    """
+    payload = fields.get(PAYLOAD_FIELD)
+    if payload is None:
+        payload = fields.get(PAYLOAD_FIELD.encode())
+    if payload is not None and StreamEvent is not None:
+        if isinstance(payload, str):
+            payload = payload.encode(*_BYTES_ENCODING)
+        message = StreamEvent.FromString(payload)
+        return {
+            "event_id": message.event_id,
+            "user_id": message.user_id,
+            "event_type": message.event_type,
+            "amount": message.amount,
+            "timestamp": from_timestamp_us(message.timestamp_us),
+        }
+
+    # Прежний формат: строковые поля
+    fields = {_as_str(k): _as_str(v) for k, v in fields.items()}
+    timestamp = fields.get("timestamp")
+    return {
+        "event_id": fields.get("event_id", ""),
+        "user_id": fields.get("user_id", ""),
+        "event_type": fields.get("event_type", ""),
+        "amount": float(fields.get("amount") or 0),
+        "timestamp": _naive_utc(datetime.fromisoformat(timestamp.replace('Z', ''))) if timestamp else None,
+    }
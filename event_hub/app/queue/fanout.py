@@ -0,0 +1,310 @@
+"""
+Fan-out Redis Stream'а: один XREAD на процесс, раздача подписчикам
+через ограниченные asyncio-очереди
+"""
+
+import asyncio
+import logging
+import os
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from app.db.redis import r, EVENTS_STREAM
+from app.queue.codec import decode_event
+from app.queue.reliable_delivery import is_replay
+from app.metrics.prometheus_metrics import (
+    record_subscription_drop,
+    update_active_connections,
+)
+
+logger = logging.getLogger(__name__)
+
+# (ID записи stream'а, декодированное событие)
+Message = Tuple[str, Dict[str, Any]]
+
+# Политики для медленных подписчиков
+DROP = "drop"
+DISCONNECT = "disconnect"
+
+_CLOSED = object()
+
+
+class SlowConsumerError(Exception):
+    """Подписчик отключён, потому что не успевал читать сообщения"""
+    pass
+
+
+def parse_stream_id(message_id: str) -> Tuple[int, int]:
+    """Разбирает ID записи stream'а для сравнения"""
+    ms, _, seq = message_id.partition("-")
+    return int(ms), int(seq or 0)
+
+
+class EventFilter:
+    """Серверный фильтр подписки.
+
+    Тип события проверяется индексом hub'а, а остальные условия
+    собираются в предикат один раз при подписке, так что проверка
+    сообщения не разбирает параметры фильтра заново.
+    """
+
+    def __init__(
+        self,
+        event_types: Optional[Iterable[str]] = None,
+        user_id: Optional[str] = None,
+        min_amount: Optional[float] = None,
+        max_amount: Optional[float] = None,
+    ):
+        self.event_types = frozenset(event_types) if event_types else None
+        self.user_id = user_id
+        self.min_amount = min_amount
+        self.max_amount = max_amount
+        self.matches = self._compile()
+
+    def _compile(self) -> Callable[[Dict[str, Any], float], bool]:
+        """Предикат по user_id и диапазону amount (без event_type)"""
+        user_id, lo, hi = self.user_id, self.min_amount, self.max_amount
+        checks = []
+        if user_id is not None:
+            checks.append(lambda fields, amount: fields.get("user_id") == user_id)
+        if lo is not None:
+            checks.append(lambda fields, amount: amount >= lo)
+        if hi is not None:
+            checks.append(lambda fields, amount: amount <= hi)
+
+        if not checks:
+            return lambda fields, amount: True
+        if len(checks) == 1:
+            return checks[0]
+        return lambda fields, amount: all(check(fields, amount) for check in checks)
+
+    def accepts(self, fields: Dict[str, Any]) -> bool:
+        """Полная проверка сообщения, включая event_type"""
+        if self.event_types is not None and fields.get("event_type") not in self.event_types:
+            return False
+        return self.matches(fields, message_amount(fields))
+
+
+def message_amount(fields: Dict[str, Any]) -> float:
+    try:
+        return float(fields.get("amount") or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class Subscriber:
+    """Подписка на stream с собственной ограниченной очередью"""
+
+    def __init__(self, hub: "StreamHub", queue_size: int, policy: str,
+                 event_filter: Optional[EventFilter] = None):
+        self.hub = hub
+        self.policy = policy
+        self.filter = event_filter or EventFilter()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.closed = False
+        # Во время догона истории переполнение очереди не считается
+        # медленным чтением: потерянное перечитывается из stream'а
+        self.backfilling = False
+        self.overflowed = False
+
+    def offer(self, message: Message) -> bool:
+        """Кладёт сообщение в очередь; False - подписчика нужно отключить"""
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            if self.backfilling:
+                self.overflowed = True
+                return True
+            if self.policy == DISCONNECT:
+                return False
+            self.dropped += 1
+            record_subscription_drop(self.hub.stream)
+            return True
+
+    def close(self):
+        """Отключает подписчика, будя ожидающего читателя"""
+        if self.closed:
+            return
+        self.closed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(_CLOSED)
+
+    async def messages(self, cursor: Optional[str] = None,
+                       batch_size: Optional[int] = None) -> AsyncIterator[Message]:
+        """Сообщения подписки; с cursor сначала догоняет историю из stream'а.
+
+        Если за время догона очередь живых сообщений переполнилась, она
+        очищается и догон продолжается с последней отданной записи: так
+        долгий догон не теряет живые сообщения и не отключает подписчика.
+        """
+        last_seen = None
+        try:
+            position = cursor
+            self.backfilling = bool(cursor)
+            while self.backfilling:
+                self.overflowed = False
+                async for message in self.hub.backfill(position, batch_size):
+                    position = message[0]
+                    last_seen = parse_stream_id(position)
+                    if self.filter.accepts(message[1]):
+                        yield message
+                if not self.overflowed:
+                    self.backfilling = False
+                    break
+                while not self.queue.empty():
+                    self.queue.get_nowait()
+
+            while True:
+                message = await self.queue.get()
+                if message is _CLOSED:
+                    raise SlowConsumerError("Подписчик не успевал читать сообщения")
+                # Живые сообщения, уже отданные при догоне, пропускаем
+                if last_seen is not None and parse_stream_id(message[0]) <= last_seen:
+                    continue
+                yield message
+        finally:
+            self.hub.unsubscribe(self)
+
+
+class StreamHub:
+    """Единственный читатель stream'а в процессе.
+
+    Нагрузка на Redis не зависит от числа подписчиков: один XREAD-цикл
+    читает stream пачками и раздаёт сообщения по очередям подписчиков.
+    Подписчики проиндексированы по event_type, поэтому сообщение
+    проверяется только у тех, кому его тип интересен.
+    Цикл запускается с первой подпиской и останавливается с последней.
+    """
+
+    def __init__(
+        self,
+        redis,
+        stream: str,
+        batch_size: int = 500,
+        block_ms: int = 1000,
+        queue_size: int = 1000,
+        slow_policy: str = DROP,
+        decoder: Callable[[Dict[str, Any]], Dict[str, Any]] = decode_event,
+    ):
+        self.redis = redis
+        self.stream = stream
+        self.decoder = decoder
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.queue_size = queue_size
+        self.slow_policy = slow_policy
+
+        self._subscribers: Set[Subscriber] = set()
+        # Индекс по event_type и подписчики без фильтра по типу
+        self._by_type: Dict[str, Set[Subscriber]] = {}
+        self._any_type: Set[Subscriber] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def subscribe(self, event_filter: Optional[EventFilter] = None,
+                  queue_size: Optional[int] = None, policy: Optional[str] = None) -> Subscriber:
+        """Регистрирует подписчика и при необходимости запускает чтение"""
+        subscriber = Subscriber(
+            self, queue_size or self.queue_size, policy or self.slow_policy, event_filter
+        )
+        self._subscribers.add(subscriber)
+        if subscriber.filter.event_types is None:
+            self._any_type.add(subscriber)
+        else:
+            for event_type in subscriber.filter.event_types:
+                self._by_type.setdefault(event_type, set()).add(subscriber)
+        self._update_gauge()
+
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._loop = loop
+            self._task = loop.create_task(self._run())
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        if subscriber not in self._subscribers:
+            return
+        self._subscribers.discard(subscriber)
+        self._any_type.discard(subscriber)
+        for event_type in subscriber.filter.event_types or ():
+            subscribers = self._by_type.get(event_type)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._by_type[event_type]
+        self._update_gauge()
+
+    def _update_gauge(self):
+        update_active_connections(f"stream_subscribers:{self.stream}", len(self._subscribers))
+
+    async def _latest_id(self) -> str:
+        entries = await self.redis.xrevrange(self.stream, count=1)
+        return entries[0][0] if entries else "0-0"
+
+    async def backfill(self, cursor: str, batch_size: Optional[int] = None) -> AsyncIterator[Message]:
+        """История stream'а после cursor (не включая его) чтениями по batch_size"""
+        batch_size = batch_size or self.batch_size
+        start = f"({cursor}"
+        while True:
+            entries = await self.redis.xrange(self.stream, min=start, count=batch_size)
+            for message_id, fields in entries:
+                # Подписчики уже получили оригинал записи из DLQ
+                if not is_replay(fields):
+                    yield message_id, self.decoder(fields)
+            if len(entries) < batch_size:
+                return
+            start = f"({entries[-1][0]}"
+
+    def dispatch(self, messages: List[Message]):
+        """Раздаёт пачку сообщений подписчикам, чьи фильтры их принимают"""
+        slow: Set[Subscriber] = set()
+        for message in messages:
+            fields = message[1]
+            typed = self._by_type.get(fields.get("event_type"))
+            if not typed and not self._any_type:
+                continue
+
+            amount = message_amount(fields)
+            for candidates in (typed or (), self._any_type):
+                for subscriber in candidates:
+                    if subscriber in slow or not subscriber.filter.matches(fields, amount):
+                        continue
+                    if not subscriber.offer(message):
+                        slow.add(subscriber)
+
+        for subscriber in slow:
+            logger.warning(f"Disconnecting slow subscriber on {self.stream}")
+            subscriber.close()
+            self.unsubscribe(subscriber)
+
+    async def _run(self):
+        last_id = None
+        while self._subscribers:
+            try:
+                if last_id is None:
+                    last_id = await self._latest_id()
+                response = await self.redis.xread(
+                    {self.stream: last_id}, count=self.batch_size, block=self.block_ms
+                )
+                for _, messages in response or []:
+                    if messages:
+                        last_id = messages[-1][0]
+                        # Каждая запись декодируется один раз для всех подписчиков
+                        self.dispatch([
+                            (mid, self.decoder(fields)) for mid, fields in messages if not is_replay(fields)
+                        ])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Stream hub error: {e}")
+                await asyncio.sleep(1)
+
+
+# Общий для процесса hub stream'а событий
+events_hub = StreamHub(
+    r, EVENTS_STREAM,
+    queue_size=int(os.getenv("SUBSCRIBER_QUEUE_SIZE", "1000")),
+    slow_policy=os.getenv("SUBSCRIBER_SLOW_POLICY", DROP),
+)
@@ -0,0 +1,183 @@
+"""
+Transactional outbox: события пишутся в MongoDB с published=false,
+а relay пачками публикует их в Redis Stream и помечает опубликованными
+"""
+
+import asyncio
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+from pymongo.errors import OperationFailure
+
+from app.db.mongo import events, db
+from app.db.partitions import PartitionedEvents
+from app.db.redis import publish_events
+
+logger = logging.getLogger(__name__)
+
+RELAY_STATE_ID = "events_relay"
+
+# ChangeStreamHistoryLost, InvalidResumeToken: сохранённый токен больше
+# не годится, продолжить с него нельзя
+RESUME_TOKEN_LOST_CODES = (286, 260)
+
+
+class OutboxRelay:
+    """Переносит неопубликованные события из MongoDB в Redis Stream.
+
+    Основной режим - change stream с сохранённым resume token, так что
+    relay не опрашивает коллекцию и после рестарта продолжает с места
+    остановки. Если токен выпал из oplog, он сбрасывается, и relay
+    открывает stream заново с catch-up по published=false. Без replica
+    set relay откатывается на опрос по частичному индексу {published: 1}.
+    Документы помечаются одним update_many на пачку.
+    Доставка at-least-once: потребители дедуплицируют по event_id.
+    """
+
+    def __init__(
+        self,
+        collection,
+        state_collection,
+        batch_size: int = 500,
+        max_delay: float = 0.05,
+        poll_interval: float = 0.2,
+    ):
+        self.collection = collection
+        self.state_collection = state_collection
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+
+    async def publish_batch(self, docs: List[Dict[str, Any]]):
+        """Публикует пачку одним pipeline и помечает её одним update_many"""
+        if not docs:
+            return
+        await publish_events([(str(doc["_id"]), doc) for doc in docs])
+        update = {"$set": {"published": True}}
+        if isinstance(self.collection, PartitionedEvents):
+            # Пометка в партициях документов, по одному update_many на партицию
+            await self.collection.mark(docs, update)
+        else:
+            await self.collection.update_many({"_id": {"$in": [doc["_id"] for doc in docs]}}, update)
+        logger.debug(f"Outbox relay published {len(docs)} events")
+
+    async def drain_pending(self) -> int:
+        """Публикует всё, что осталось с published=false (catch-up)"""
+        total = 0
+        while True:
+            if isinstance(self.collection, PartitionedEvents):
+                docs = await self.collection.find_sorted({"published": False}, None, self.batch_size, ascending=True)
+            else:
+                cursor = self.collection.find({"published": False}).sort("_id", 1).limit(self.batch_size)
+                docs = await cursor.to_list(length=self.batch_size)
+            if not docs:
+                return total
+            await self.publish_batch(docs)
+            total += len(docs)
+
+    async def _load_token(self) -> Optional[Dict[str, Any]]:
+        state = await self.state_collection.find_one({"_id": RELAY_STATE_ID})
+        return state.get("resume_token") if state else None
+
+    async def _save_token(self, token: Optional[Dict[str, Any]]):
+        if token is None:
+            return
+        await self.state_collection.update_one(
+            {"_id": RELAY_STATE_ID},
+            {"$set": {"resume_token": token}},
+            upsert=True
+        )
+
+    async def _reset_token(self):
+        await self.state_collection.update_one(
+            {"_id": RELAY_STATE_ID},
+            {"$set": {"resume_token": None}},
+            upsert=True
+        )
+
+    async def tail_change_stream(self):
+        """Читает вставки из change stream и публикует их пачками"""
+        pipeline = [{"$match": {
+            "operationType": "insert",
+            "fullDocument.published": False
+        }}]
+        token = await self._load_token()
+        max_await_ms = max(1, int(self.max_delay * 1000))
+
+        async with self.collection.watch(
+            pipeline, resume_after=token, max_await_time_ms=max_await_ms
+        ) as stream:
+            # Stream уже открыт, поэтому catch-up не пропустит новые вставки
+            await self.drain_pending()
+
+            loop = asyncio.get_running_loop()
+            while True:
+                batch = []
+                deadline = loop.time() + self.max_delay
+                while len(batch) < self.batch_size and loop.time() < deadline:
+                    change = await stream.try_next()
+                    if change is None:
+                        break
+                    batch.append(change["fullDocument"])
+
+                if batch:
+                    await self.publish_batch(batch)
+                await self._save_token(stream.resume_token)
+
+    async def poll(self):
+        """Fallback без change streams: опрос по частичному индексу"""
+        while True:
+            if not await self.drain_pending():
+                await asyncio.sleep(self.poll_interval)
+
+    async def run(self):
+        """Основной цикл relay"""
+        await self.collection.create_index(
+            "published",
+            partialFilterExpression={"published": False},
+            name="outbox_unpublished"
+        )
+        use_change_stream = True
+        while True:
+            try:
+                if use_change_stream:
+                    await self.tail_change_stream()
+                else:
+                    await self.poll()
+            except OperationFailure as e:
+                # 40573: change streams доступны только на replica set
+                if use_change_stream and e.code == 40573:
+                    logger.warning("Change streams unavailable, falling back to polling")
+                    use_change_stream = False
+                    continue
+                if use_change_stream and e.code in RESUME_TOKEN_LOST_CODES:
+                    # Пропущенное за время простоя догоняется catch-up'ом
+                    # после открытия stream'а без токена
+                    logger.warning(f"Outbox resume token lost ({e.code}), reopening change stream")
+                    await self._reset_token()
+                    continue
+                logger.error(f"Outbox relay error: {e}")
+                await asyncio.sleep(1)
+            except Exception as e:
+                logger.error(f"Outbox relay error: {e}")
+                await asyncio.sleep(1)
+
+
+async def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    relay = OutboxRelay(
+        events,
+        db["outbox_state"],
+        batch_size=int(os.getenv("OUTBOX_BATCH_SIZE", "500")),
+        max_delay=float(os.getenv("OUTBOX_MAX_DELAY_MS", "50")) / 1000,
+    )
+    logger.info("Starting outbox relay...")
+    await relay.run()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1 +1,239 @@
- 
\ No newline at end of file
+"""
+Надёжная доставка из Redis Streams на consumer groups:
+XREADGROUP/XACK, перехват зависших сообщений через XAUTOCLAIM и DLQ
+"""
+
+import asyncio
+import logging
+import os
+import socket
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from redis.exceptions import ResponseError
+
+from app.metrics.prometheus_metrics import update_queue_lag
+
+logger = logging.getLogger(__name__)
+
+Message = Tuple[str, Dict[str, str]]
+MessageHandler = Callable[[str, Dict[str, str]], Awaitable[None]]
+BatchHandler = Callable[[List[Message]], Awaitable[None]]
+
+
+def default_consumer_name() -> str:
+    """Имя consumer'а, уникальное для реплики"""
+    return os.getenv("CONSUMER_NAME") or f"{socket.gethostname()}-{os.getpid()}"
+
+
+# Запись, возвращённая из DLQ, адресована одной группе: остальные группы
+# уже обработали оригинал и подтверждают её без обработчика
+REPLAY_GROUP_FIELD = "replay_group"
+
+
+def dlq_stream_name(stream: str) -> str:
+    """Имя dead-letter stream'а для основного stream'а"""
+    return f"{stream}:dlq"
+
+
+def is_replay(fields: Optional[Dict[str, str]]) -> bool:
+    """Запись возвращена из DLQ для повторной обработки одной группой"""
+    return fields is not None and REPLAY_GROUP_FIELD in fields
+
+
+class StreamConsumer:
+    """Consumer group поверх Redis Stream.
+
+    Несколько реплик с одной группой делят stream между собой. Сообщение
+    подтверждается (XACK) только после успешной обработки; упавшие остаются
+    в PEL и через min_idle_ms перехватываются XAUTOCLAIM'ом любой живой
+    репликой. После max_deliveries неудачных доставок сообщение уходит в
+    dead-letter stream.
+
+    Обработчик задаётся либо на сообщение (handler), либо на пачку
+    (batch_handler) - тогда ошибка пачки считается ошибкой каждого сообщения.
+
+    Записи из DLQ с полем replay_group обрабатывает только указанная
+    группа, остальные подтверждают их сразу.
+    """
+
+    def __init__(
+        self,
+        redis,
+        stream: str,
+        group: str,
+        handler: Optional[MessageHandler] = None,
+        batch_handler: Optional[BatchHandler] = None,
+        consumer_name: Optional[str] = None,
+        batch_size: int = 100,
+        concurrency: int = 10,
+        block_ms: int = 1000,
+        min_idle_ms: int = 60000,
+        max_deliveries: int = 3,
+        claim_interval: float = 5.0,
+        start_id: str = "$",
+        dlq_stream: Optional[str] = None,
+    ):
+        if (handler is None) == (batch_handler is None):
+            raise ValueError("Нужно указать ровно один из handler или batch_handler")
+
+        self.redis = redis
+        self.stream = stream
+        self.group = group
+        self.handler = handler
+        self.batch_handler = batch_handler
+        self.consumer_name = consumer_name or default_consumer_name()
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.block_ms = block_ms
+        self.min_idle_ms = min_idle_ms
+        self.max_deliveries = max_deliveries
+        self.claim_interval = claim_interval
+        self.start_id = start_id
+        self.dlq_stream = dlq_stream or dlq_stream_name(stream)
+
+        self._running = False
+        self._claim_cursor = "0-0"
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def ensure_group(self):
+        """Создаёт consumer group (и сам stream), если её ещё нет"""
+        try:
+            await self.redis.xgroup_create(self.stream, self.group, id=self.start_id, mkstream=True)
+            logger.info(f"Created consumer group {self.group} on {self.stream}")
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def _handle_one(self, message_id: str, fields: Dict[str, str]) -> Optional[Exception]:
+        async with self._semaphore:
+            try:
+                await self.handler(message_id, fields)
+                return None
+            except Exception as e:
+                return e
+
+    async def process(self, messages: List[Message]):
+        """Обрабатывает пачку, подтверждает успешные и разбирает упавшие"""
+        # Записи, удалённые из stream'а до перехвата, приходят без полей;
+        # повторы из DLQ для других групп подтверждаются без обработки
+        alive, dead_ids = [], []
+        for mid, fields in messages:
+            if fields is None or fields.get(REPLAY_GROUP_FIELD, self.group) != self.group:
+                dead_ids.append(mid)
+            else:
+                alive.append((mid, fields))
+        if not alive and not dead_ids:
+            return
+
+        if self.batch_handler is not None:
+            try:
+                await self.batch_handler(alive)
+                errors = [None] * len(alive)
+            except Exception as e:
+                errors = [e] * len(alive)
+        else:
+            errors = await asyncio.gather(*(self._handle_one(mid, f) for mid, f in alive))
+
+        acked = dead_ids + [mid for (mid, _), err in zip(alive, errors) if err is None]
+        failed = [(msg, err) for msg, err in zip(alive, errors) if err is not None]
+
+        if acked:
+            await self.redis.xack(self.stream, self.group, *acked)
+        if failed:
+            await self._handle_failures(failed)
+
+    async def _handle_failures(self, failed: List[Tuple[Message, Exception]]):
+        """Отправляет в DLQ сообщения, исчерпавшие лимит доставок"""
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for (mid, _), _ in failed:
+                pipe.xpending_range(self.stream, self.group, min=mid, max=mid, count=1)
+            pending = await pipe.execute()
+
+        to_dlq = []
+        for ((mid, fields), err), info in zip(failed, pending):
+            deliveries = info[0]["times_delivered"] if info else self.max_deliveries
+            logger.warning(f"Message {mid} failed (delivery {deliveries}/{self.max_deliveries}): {err}")
+            if deliveries >= self.max_deliveries:
+                to_dlq.append((mid, fields, err))
+
+        if not to_dlq:
+            return
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for mid, fields, err in to_dlq:
+                pipe.xadd(self.dlq_stream, {
+                    **fields,
+                    "dlq_original_id": mid,
+                    "dlq_group": self.group,
+                    "dlq_error": str(err),
+                    "dlq_failed_at": datetime.now().isoformat()
+                })
+            pipe.xack(self.stream, self.group, *[mid for mid, _, _ in to_dlq])
+            await pipe.execute()
+        logger.error(f"Moved {len(to_dlq)} messages to {self.dlq_stream}")
+
+    async def claim_stale(self) -> int:
+        """Перехватывает сообщения, зависшие у упавших consumer'ов"""
+        result = await self.redis.xautoclaim(
+            self.stream, self.group, self.consumer_name,
+            min_idle_time=self.min_idle_ms,
+            start_id=self._claim_cursor,
+            count=self.batch_size
+        )
+        self._claim_cursor, messages = result[0], result[1]
+        if messages:
+            logger.info(f"Claimed {len(messages)} stale messages from {self.stream}")
+            await self.process(messages)
+        return len(messages)
+
+    async def report_lag(self):
+        """Экспортирует лаг и размер PEL группы в Prometheus"""
+        for info in await self.redis.xinfo_groups(self.stream):
+            if info.get("name") != self.group:
+                continue
+            queue_name = f"{self.stream}:{self.group}"
+            update_queue_lag(queue_name, info.get("lag") or 0)
+            update_queue_lag(f"{queue_name}:pending", info.get("pending") or 0)
+
+    async def read_new(self) -> int:
+        """Читает и обрабатывает новые сообщения группы"""
+        response = await self.redis.xreadgroup(
+            self.group, self.consumer_name, {self.stream: ">"},
+            count=self.batch_size, block=self.block_ms
+        )
+        count = 0
+        for _, messages in response or []:
+            await self.process(messages)
+            count += len(messages)
+        return count
+
+    async def run(self):
+        """Основной цикл consumer'а"""
+        await self.ensure_group()
+        self._running = True
+        loop = asyncio.get_running_loop()
+        next_claim = 0.0
+
+        logger.info(f"Consumer {self.consumer_name} joined {self.stream}/{self.group}")
+        while self._running:
+            try:
+                if loop.time() >= next_claim:
+                    await self.claim_stale()
+                    await self.report_lag()
+                    next_claim = loop.time() + self.claim_interval
+                await self.read_new()
+            except ResponseError as e:
+                # Группу могли удалить вместе со stream'ом
+                if "NOGROUP" in str(e):
+                    await self.ensure_group()
+                    continue
+                logger.error(f"Consumer error: {e}")
+                await asyncio.sleep(1)
+            except Exception as e:
+                logger.error(f"Consumer error: {e}")
+                await asyncio.sleep(1)
+
+    def stop(self):
+        """Останавливает цикл после текущей итерации"""
+        self._running = False
@@ -0,0 +1,119 @@
+"""
+Retention Redis Stream'а событий
+
+Фоновый trimmer регулярно удаляет записи через XTRIM MINID ~ до позиции,
+которую подтвердили все consumer group'ы, и никогда не заходит за
+неподтверждённые записи. Если stream всё же разрастается (группа отстала
+или брошена), trimmer пишет предупреждение с именем группы, которая держит
+границу; жёсткий потолок MAXLEN ~ при публикации (STREAM_MAXLEN) по
+умолчанию выключен. Записи моложе retention хранятся в
+любом случае: их читают backfill подписок и прогрев окон метрик.
+
+    python -m app.queue.retention
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Optional, Tuple
+
+from app.db.redis import r, EVENTS_STREAM
+from app.metrics.prometheus_metrics import update_stream_retention
+from app.queue.fanout import parse_stream_id
+
+logger = logging.getLogger(__name__)
+
+# Минимальное время хранения записей (по умолчанию - самое длинное окно метрик)
+STREAM_RETENTION_SECONDS = int(os.getenv("STREAM_RETENTION_SECONDS", "3600"))
+STREAM_TRIM_INTERVAL = float(os.getenv("STREAM_TRIM_INTERVAL", "10"))
+# Длина stream'а, после которой trimmer предупреждает об отстающей группе, 0 - не предупреждать
+STREAM_LENGTH_ALERT = int(os.getenv("STREAM_LENGTH_ALERT", "1000000"))
+
+
+def format_stream_id(stream_id: Tuple[int, int]) -> str:
+    return f"{stream_id[0]}-{stream_id[1]}"
+
+
+class StreamTrimmer:
+    """Удаляет из stream'а записи, подтверждённые самой отстающей группой.
+
+    Граница группы - минимальный ID в её PEL (выдан, но не подтверждён),
+    а при пустом PEL - last-delivered-id + 1 (всё до него подтверждено).
+    Итоговая граница - минимум по группам и по окну retention; XTRIM
+    с ~ удаляет только целые узлы stream'а и поэтому дешёв.
+    """
+
+    def __init__(self, redis, stream: str, retention: float = STREAM_RETENTION_SECONDS,
+                 interval: float = STREAM_TRIM_INTERVAL, length_alert: int = STREAM_LENGTH_ALERT):
+        self.redis = redis
+        self.stream = stream
+        self.retention = retention
+        self.interval = interval
+        self.length_alert = length_alert
+        # Группа, граница которой оказалась минимальной на последнем проходе
+        self.slowest_group: Optional[str] = None
+
+    async def _group_boundary(self, info) -> Tuple[int, int]:
+        if info["pending"]:
+            summary = await self.redis.xpending(self.stream, info["name"])
+            return parse_stream_id(summary["min"])
+        ms, seq = parse_stream_id(info["last-delivered-id"])
+        return ms, seq + 1
+
+    async def safe_min_id(self, now: Optional[float] = None) -> Tuple[int, int]:
+        """ID, до которого записи можно удалить, не теряя неподтверждённые"""
+        now = time.time() if now is None else now
+        boundary = (int((now - self.retention) * 1000), 0)
+        self.slowest_group = None
+        for info in await self.redis.xinfo_groups(self.stream):
+            group_boundary = await self._group_boundary(info)
+            if group_boundary < boundary:
+                boundary = group_boundary
+                self.slowest_group = info["name"]
+        return boundary
+
+    async def trim_once(self) -> int:
+        """Один проход: XTRIM MINID ~ и обновление метрик; возвращает число удалённых"""
+        try:
+            min_id = await self.safe_min_id()
+        except Exception as e:
+            # Stream ещё не создан
+            logger.debug(f"Stream {self.stream} is not available: {e}")
+            return 0
+
+        removed = await self.redis.xtrim(self.stream, minid=format_stream_id(min_id), approximate=True)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.xlen(self.stream)
+            pipe.memory_usage(self.stream)
+            length, memory = await pipe.execute()
+        update_stream_retention(self.stream, length, memory or 0)
+        if self.length_alert and length > self.length_alert and self.slowest_group:
+            logger.warning(
+                f"Stream {self.stream} holds {length} entries (alert at {self.length_alert}): "
+                f"group {self.slowest_group} has not acked past {format_stream_id(min_id)}"
+            )
+
+        if removed:
+            logger.info(f"Trimmed {removed} entries from {self.stream} (min id {format_stream_id(min_id)})")
+        return removed
+
+    async def run(self):
+        logger.info(f"Starting trimmer for {self.stream}, retention {self.retention}s")
+        while True:
+            try:
+                await self.trim_once()
+            except Exception as e:
+                logger.error(f"Stream trim error: {e}")
+            await asyncio.sleep(self.interval)
+
+
+async def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    await StreamTrimmer(r, EVENTS_STREAM).run()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк транспортного слоя gRPC сервера при разных настройках
+
+Обработчики не обращаются к MongoDB/Redis, поэтому измеряется только
+накладная стоимость gRPC: unary SendEvent и потоковый SendEvents.
+
+    python -m benchmarks.grpc_server --seconds 5 --concurrency 64
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import grpc
+from bson import ObjectId
+
+from app.grpc.server import EventServicer, ServerConfig, build_server, request_to_dict
+from protos import event_pb2, event_pb2_grpc
+
+CONFIGS = {
+    "default": ServerConfig(),
+    "gzip": ServerConfig(compression="gzip"),
+    "streams_100": ServerConfig(max_concurrent_streams=100),
+    "rpc_limit_256": ServerConfig(max_concurrent_rpcs=256),
+}
+
+
+class NullServicer(EventServicer):
+    """Сервис без хранилища: подтверждает события сразу"""
+
+    async def SendEvent(self, request, context):
+        request_to_dict(request)
+        return event_pb2.EventResponse(event_id=str(ObjectId()), status="success")
+
+    async def _commit_batch(self, batch, first_index):
+        acks = []
+        for offset, request in enumerate(batch):
+            request_to_dict(request)
+            acks.append(event_pb2.EventAck(index=first_index + offset, event_id=str(ObjectId()), status="success"))
+        return event_pb2.BatchAck(acks=acks, accepted=len(acks))
+
+
+def make_request(i: int) -> event_pb2.EventRequest:
+    request = event_pb2.EventRequest(user_id=f"user_{i % 1000}", event_type="purchase", amount=float(i))
+    request.event_time.FromMicroseconds(int(time.time() * 1_000_000))
+    return request
+
+
+async def bench_unary(stub, seconds: float, concurrency: int):
+    latencies = []
+    deadline = time.perf_counter() + seconds
+
+    async def worker(worker_id: int):
+        i = worker_id
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            await stub.SendEvent(make_request(i))
+            latencies.append(time.perf_counter() - start)
+            i += concurrency
+
+    await asyncio.gather(*(worker(w) for w in range(concurrency)))
+    latencies.sort()
+    return {
+        "rps": len(latencies) / seconds,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+    }
+
+
+async def bench_stream(stub, events: int):
+    async def requests():
+        for i in range(events):
+            yield make_request(i)
+
+    start = time.perf_counter()
+    acked = 0
+    async for ack in stub.SendEvents(requests()):
+        acked += ack.accepted
+    return {"events_per_s": acked / (time.perf_counter() - start)}
+
+
+async def run_config(name: str, config: ServerConfig, port: int, args):
+    config.listen_addr = f"127.0.0.1:{port}"
+    server = build_server(config, NullServicer())
+    await server.start()
+    try:
+        async with grpc.aio.insecure_channel(
+            config.listen_addr, compression=config.grpc_compression()
+        ) as channel:
+            stub = event_pb2_grpc.EventServiceStub(channel)
+            unary = await bench_unary(stub, args.seconds, args.concurrency)
+            stream = await bench_stream(stub, args.stream_events)
+    finally:
+        await server.stop(0)
+
+    print(f"{name:<16}{unary['rps']:>12.0f}{unary['p50_ms']:>10.2f}{unary['p99_ms']:>10.2f}"
+          f"{stream['events_per_s']:>16.0f}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк настроек gRPC сервера')
+    parser.add_argument('--seconds', type=float, default=5, help='Длительность unary-теста')
+    parser.add_argument('--concurrency', type=int, default=64, help='Параллельных unary-вызовов')
+    parser.add_argument('--stream-events', type=int, default=50000, help='Событий в SendEvents')
+    parser.add_argument('--port', type=int, default=50151, help='Порт для тестовых серверов')
+    args = parser.parse_args()
+
+    print(f"{'config':<16}{'unary rps':>12}{'p50 ms':>10}{'p99 ms':>10}{'stream ev/s':>16}")
+    for offset, (name, config) in enumerate(CONFIGS.items()):
+        await run_config(name, config, args.port + offset, args)
+
+if __name__ == "__main__":
+    asyncio.run(main())
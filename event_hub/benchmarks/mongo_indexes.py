@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк запросов к коллекции событий с индексами и без них
+
+Пример (10M документов, отдельная коллекция events_bench):
+    python -m benchmarks.mongo_indexes --docs 10000000
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+import motor.motor_asyncio
+
+from app.db.indexes import EVENT_INDEXES, ensure_indexes
+from app.db.mongo import MONGO_URI
+
+EVENT_TYPES = ["purchase", "return", "refund", "exchange"]
+
+
+async def seed(collection, docs: int, users: int, batch_size: int = 10000):
+    """Заполняет коллекцию событиями, равномерно распределёнными за 30 дней"""
+    await collection.drop()
+    now = datetime.now()
+    span = timedelta(days=30).total_seconds()
+    for start in range(0, docs, batch_size):
+        batch = [
+            {
+                "user_id": f"user_{random.randrange(users)}",
+                "event_type": random.choice(EVENT_TYPES),
+                "amount": round(random.uniform(1, 500), 2),
+                "timestamp": now - timedelta(seconds=random.uniform(0, span)),
+            }
+            for _ in range(min(batch_size, docs - start))
+        ]
+        await collection.insert_many(batch, ordered=False)
+        print(f"\rseeded {start + len(batch)}/{docs}", end="", flush=True)
+    print()
+
+
+def queries(collection):
+    """Запросы, которые выполняет сервис"""
+    now = datetime.now()
+    return {
+        "last_events": lambda: collection.find().sort("timestamp", -1).limit(100).to_list(100),
+        "by_event_type": lambda: collection.find(
+            {"event_type": "purchase", "timestamp": {"$gte": now - timedelta(hours=1)}}
+        ).sort("timestamp", -1).limit(100).to_list(100),
+        "by_user": lambda: collection.find(
+            {"user_id": "user_42"}
+        ).sort("timestamp", -1).limit(100).to_list(100),
+        "aggregate_last_minute": lambda: collection.aggregate([
+            {"$match": {"timestamp": {"$gte": now - timedelta(minutes=1)}}},
+            {"$group": {"_id": "$event_type", "total_amount": {"$sum": "$amount"}, "count": {"$sum": 1}}},
+        ]).to_list(None),
+    }
+
+
+async def measure(collection, runs: int):
+    results = {}
+    for name, query in queries(collection).items():
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            await query()
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        results[name] = {
+            "p50_ms": statistics.median(timings),
+            "p99_ms": timings[min(len(timings) - 1, int(len(timings) * 0.99))],
+        }
+    return results
+
+
+def print_results(title: str, results):
+    print(f"\n{title}")
+    print(f"{'query':<24}{'p50, ms':>12}{'p99, ms':>12}")
+    for name, stats in results.items():
+        print(f"{name:<24}{stats['p50_ms']:>12.2f}{stats['p99_ms']:>12.2f}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк индексов коллекции событий')
+    parser.add_argument('--docs', type=int, default=10_000_000, help='Число документов')
+    parser.add_argument('--users', type=int, default=100_000, help='Число пользователей')
+    parser.add_argument('--runs', type=int, default=20, help='Повторов каждого запроса')
+    parser.add_argument('--skip-seed', action='store_true', help='Не пересоздавать данные')
+    args = parser.parse_args()
+
+    client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URI)
+    collection = client["event_hub"]["events_bench"]
+
+    if not args.skip_seed:
+        await seed(collection, args.docs, args.users)
+
+    await collection.drop_indexes()
+    print_results(f"Без индексов ({args.docs} документов)", await measure(collection, max(1, args.runs // 4)))
+
+    start = time.perf_counter()
+    await ensure_indexes(collection, EVENT_INDEXES)
+    print(f"\nИндексы построены за {time.perf_counter() - start:.1f} с")
+    print_results(f"С индексами ({args.docs} документов)", await measure(collection, args.runs))
+
+if __name__ == "__main__":
+    asyncio.run(main())
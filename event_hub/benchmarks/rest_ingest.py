@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк CPU на один запрос POST /events: прежний обработчик и текущий
+
+Хранилище заменено заглушками, поэтому измеряется только работа процесса:
+разбор JSON, валидация, подготовка документа, логирование и ответ. Логи
+пишутся на уровне INFO в /dev/null, как в production.
+
+    python -m benchmarks.rest_ingest --requests 20000
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+
+import httpx
+from bson import ObjectId
+from fastapi import FastAPI, HTTPException
+from pymongo.results import InsertOneResult
+
+from app.api import routes
+from app.models.event import Event
+
+logger = logging.getLogger("benchmarks.rest_ingest")
+
+
+async def fake_save_event(event_dict):
+    return InsertOneResult(ObjectId(), acknowledged=True)
+
+
+async def fake_publish_events(events):
+    return []
+
+
+async def legacy_receive_event(event: Event):
+    """Обработчик POST /events до оптимизации (без обращения к хранилищу)"""
+    event_dict = event.model_dump(by_alias=True)
+    event_dict = {k: v for k, v in event_dict.items()
+                  if v is not None and k != '_id'}
+
+    if isinstance(event_dict.get('timestamp'), str):
+        ts = event_dict['timestamp']
+        if '.' in ts:
+            ts = ts.split('.')[0] + 'Z'
+        elif len(ts.split(':')[-1]) > 6:
+            ts = ts[:19] + 'Z'
+        try:
+            event_dict['timestamp'] = datetime.fromisoformat(ts.replace('Z', ''))
+        except ValueError:
+            event_dict['timestamp'] = datetime.now()
+
+    result = await fake_save_event(event_dict)
+    if not result.inserted_id:
+        raise HTTPException(status_code=500, detail="Failed to save event")
+    event_id = str(result.inserted_id)
+    logger.info(f"Event saved with ID: {event_id}")
+    await fake_publish_events([(event_id, event_dict)])
+    return {"status": "success", "id": event_id}
+
+
+def build_apps():
+    routes.save_event = fake_save_event
+    routes.publish_events = fake_publish_events
+
+    legacy = FastAPI()
+    legacy.post("/events")(legacy_receive_event)
+
+    current = FastAPI()
+    current.post("/events")(routes.receive_event)
+    return {"legacy": legacy, "current": current}
+
+
+async def measure(app, requests: int, body: bytes):
+    transport = httpx.ASGITransport(app=app)
+    headers = {"content-type": "application/json"}
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        # Прогрев: компиляция схем, кэши FastAPI
+        for _ in range(200):
+            await client.post("/events", content=body, headers=headers)
+
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        for _ in range(requests):
+            response = await client.post("/events", content=body, headers=headers)
+            assert response.status_code == 200, response.text
+        cpu = time.process_time() - cpu_start
+        wall = time.perf_counter() - wall_start
+    return {"cpu_us": cpu / requests * 1e6, "rps": requests / wall}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='CPU на запрос POST /events')
+    parser.add_argument('--requests', type=int, default=20000, help='Число запросов на вариант')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=open(os.devnull, "w"))
+    body = (
+        b'{"user_id": "user_42", "event_type": "purchase", "amount": 129.99,'
+        b' "timestamp": "2024-05-01T12:34:56.789123Z"}'
+    )
+
+    results = {}
+    print(f"{'handler':<12}{'cpu us/req':>14}{'req/s':>12}")
+    for name, app in build_apps().items():
+        results[name] = await measure(app, args.requests, body)
+        print(f"{name:<12}{results[name]['cpu_us']:>14.1f}{results[name]['rps']:>12.0f}")
+
+    saved = 1 - results["current"]["cpu_us"] / results["legacy"]["cpu_us"]
+    print(f"\nCPU на запрос: -{saved:.0%}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
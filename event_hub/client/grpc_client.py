@@ -1,16 +1,31 @@
 import asyncio
 import grpc
 import logging
+import os
+import sys
+import time
+import uuid
 from datetime import datetime
-from typing import AsyncGenerator
+from typing import AsyncGenerator, AsyncIterator, Iterable, List, Optional, Tuple, Union
+
+# Сгенерированные protobuf классы (запуск из корня проекта или из client/)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+try:
+    from protos import event_pb2, event_pb2_grpc
+except ImportError:
+    event_pb2 = event_pb2_grpc = None
 
 # Fallback классы для случая, когда protobuf не сгенерированы
+
+
 class EventRequest:
-    def __init__(self, user_id="", event_type="", amount=0.0, timestamp=""):
+    def __init__(self, user_id="", event_type="", amount=0.0, timestamp="", idempotency_key=""):
         self.user_id = user_id
         self.event_type = event_type
         self.amount = amount
         self.timestamp = timestamp
+        self.idempotency_key = idempotency_key
+
 
 class EventResponse:
     def __init__(self, event_id="", status="", message=""):
@@ -18,21 +33,40 @@ class EventResponse:
         self.status = status
         self.message = message
 
+
 class StreamRequest:
-    def __init__(self, limit=0):
+    def __init__(self, limit=0, max_events=0):
         self.limit = limit
+        self.max_events = max_events
+
+
+class EventAck:
+    def __init__(self, index=0, event_id="", status="", message=""):
+        self.index = index
+        self.event_id = event_id
+        self.status = status
+        self.message = message
+
+
+class BatchAck:
+    def __init__(self, acks=(), accepted=0, rejected=0):
+        self.acks = list(acks)
+        self.accepted = accepted
+        self.rejected = rejected
 
 # Заглушка для gRPC stub
+
+
 class MockStub:
-    async def SendEvent(self, request):
+    async def SendEvent(self, request, metadata=None):
         return EventResponse(
             event_id="mock_id_123",
             status="success",
             message="Event sent successfully (mock)"
         )
-    
-    async def StreamEvents(self, request):
-        for i in range(request.limit):
+
+    async def StreamEvents(self, request, metadata=None):
+        for i in range(request.max_events):
             yield EventResponse(
                 event_id=f"stream_id_{i}",
                 status="stream",
@@ -40,96 +74,192 @@ class MockStub:
             )
             await asyncio.sleep(0.1)
 
+    async def SendEvents(self, request_iterator, metadata=None):
+        index = 0
+        async for _ in request_iterator:
+            yield BatchAck(
+                acks=[EventAck(index=index, event_id=f"mock_id_{index}", status="success")],
+                accepted=1
+            )
+            index += 1
+
+
 logger = logging.getLogger(__name__)
 
+EventTuple = Tuple[str, str, float]
+
+# Повторы SendEvent при временной недоступности сервера или перегрузке
+SEND_RETRIES = 3
+RETRY_BACKOFF = 0.5
+RETRY_CODES = {
+    grpc.StatusCode.UNAVAILABLE,
+    grpc.StatusCode.DEADLINE_EXCEEDED,
+    grpc.StatusCode.RESOURCE_EXHAUSTED,
+}
+
+
 class EventClient:
-    def __init__(self, host: str = "localhost", port: int = 50051):
+    def __init__(self, host: str = "localhost", port: int = 50051, token: Optional[str] = None):
         self.host = host
         self.port = port
         self.channel = None
         self.stub = None
-    
-    async def connect(self):
+        # JWT передаётся в метаданных каждого вызова (issue_token.py)
+        self.metadata = (("authorization", f"Bearer {token}"),) if token else None
+
+    async def connect(self, timeout: float = 3.0):
         """Устанавливает соединение с gRPC сервером"""
-        try:
-            # Используем mock stub для демонстрации
-            self.stub = MockStub()
-            logger.info(f"Using mock gRPC client (server at {self.host}:{self.port} not available)")
-        except Exception as e:
-            logger.error(f"Failed to connect to gRPC server: {e}")
-            raise
-    
-    async def send_event(self, user_id: str, event_type: str, amount: float) -> str:
-        """Отправляет событие через gRPC"""
+        if event_pb2_grpc is not None:
+            try:
+                self.channel = grpc.aio.insecure_channel(f"{self.host}:{self.port}")
+                await asyncio.wait_for(self.channel.channel_ready(), timeout)
+                self.stub = event_pb2_grpc.EventServiceStub(self.channel)
+                logger.info(f"Connected to gRPC server at {self.host}:{self.port}")
+                return
+            except Exception as e:
+                logger.warning(f"gRPC server at {self.host}:{self.port} not available: {e}")
+                if self.channel:
+                    await self.channel.close()
+                    self.channel = None
+
+        # Используем mock stub для демонстрации
+        self.stub = MockStub()
+        logger.info(f"Using mock gRPC client (server at {self.host}:{self.port} not available)")
+
+    def _request(self, user_id: str, event_type: str, amount: float):
+        """Запрос для одного события; ключ идемпотентности создаётся здесь один
+        раз, и повторы отправляют этот же запрос"""
+        idempotency_key = uuid.uuid4().hex
+        if self.channel:
+            # v2: типизированное время вместо ISO-строки
+            request = event_pb2.EventRequest(
+                user_id=user_id, event_type=event_type, amount=amount, idempotency_key=idempotency_key
+            )
+            request.event_time.FromMicroseconds(round(time.time() * 1_000_000))
+            return request
+        return EventRequest(
+            user_id=user_id,
+            event_type=event_type,
+            amount=amount,
+            timestamp=datetime.now().isoformat(),
+            idempotency_key=idempotency_key
+        )
+
+    async def send_event(self, user_id: str, event_type: str, amount: float,
+                         retries: int = SEND_RETRIES) -> str:
+        """Отправляет событие через gRPC, повторяя при UNAVAILABLE и перегрузке"""
         if not self.stub:
             raise Exception("Stub not initialized. Call connect() first.")
-            
+
+        request = self._request(user_id, event_type, amount)
+        for attempt in range(retries + 1):
+            try:
+                response = await self.stub.SendEvent(request, metadata=self.metadata)
+                logger.info(f"Event sent: {response.status} - {response.message}")
+                return response.event_id
+            except grpc.aio.AioRpcError as e:
+                if e.code() not in RETRY_CODES or attempt == retries:
+                    logger.error(f"Failed to send event: {e}")
+                    raise
+                logger.warning(f"Retrying event after {e.code().name} (attempt {attempt + 1})")
+            except Exception as e:
+                logger.error(f"Failed to send event: {e}")
+                raise
+            await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+
+    async def send_events(self, events: Union[Iterable[EventTuple], AsyncIterator[EventTuple]]) -> List[str]:
+        """Отправляет поток событий одним вызовом SendEvents.
+
+        Сервер фиксирует события пачками и подтверждает каждую пачку;
+        возвращает ID событий в порядке отправки ("" для отклонённых).
+        """
+        if not self.stub:
+            raise Exception("Stub not initialized. Call connect() first.")
+
+        async def requests():
+            if hasattr(events, "__aiter__"):
+                async for user_id, event_type, amount in events:
+                    yield self._request(user_id, event_type, amount)
+            else:
+                for user_id, event_type, amount in events:
+                    yield self._request(user_id, event_type, amount)
+
+        event_ids: List[str] = []
+        rejected = 0
         try:
-            request = EventRequest(
-                user_id=user_id,
-                event_type=event_type,
-                amount=amount,
-                timestamp=datetime.now().isoformat()
-            )
-            
-            response = await self.stub.SendEvent(request)
-            logger.info(f"Event sent: {response.status} - {response.message}")
-            return response.event_id
-            
+            async for batch_ack in self.stub.SendEvents(requests(), metadata=self.metadata):
+                for ack in batch_ack.acks:
+                    if ack.index >= len(event_ids):
+                        event_ids.extend([""] * (ack.index + 1 - len(event_ids)))
+                    event_ids[ack.index] = ack.event_id
+                rejected += batch_ack.rejected
         except Exception as e:
-            logger.error(f"Failed to send event: {e}")
+            logger.error(f"Failed to send events: {e}")
             raise
-    
+
+        logger.info(f"Events sent: {len(event_ids) - rejected} accepted, {rejected} rejected")
+        return event_ids
+
     async def stream_events(self, limit: int = 5) -> AsyncGenerator[str, None]:
-        """Получает поток событий через gRPC"""
+        """Получает limit событий через gRPC (0 - бесконечный поток)"""
         if not self.stub:
             raise Exception("Stub not initialized. Call connect() first.")
-            
+
         try:
-            request = StreamRequest(limit=limit)
-            async for response in self.stub.StreamEvents(request):
+            request_cls = event_pb2.StreamRequest if self.channel else StreamRequest
+            request = request_cls(max_events=limit)
+            async for response in self.stub.StreamEvents(request, metadata=self.metadata):
                 yield f"{response.status}: {response.message}"
-                
+
         except Exception as e:
             logger.error(f"Failed to stream events: {e}")
             raise
-    
+
     async def close(self):
         """Закрывает соединение"""
         # Mock client не требует закрытия соединения
-        pass
+        if self.channel:
+            await self.channel.close()
+            self.channel = None
+
 
 async def main():
     """Пример использования gRPC клиента"""
     logging.basicConfig(level=logging.INFO)
-    
+
     client = EventClient()
-    
+
     try:
         await client.connect()
-        
+
         # Отправляем несколько тестовых событий
         events = [
             ("user1", "purchase", 100.50),
             ("user2", "return", 25.00),
             ("user3", "purchase", 75.25),
         ]
-        
+
         for user_id, event_type, amount in events:
             event_id = await client.send_event(user_id, event_type, amount)
             print(f"Sent event: {event_id}")
             await asyncio.sleep(1)
-        
+
+        # Отправляем пачку событий одним потоком
+        event_ids = await client.send_events(
+            (f"user{i % 10}", "purchase", float(i)) for i in range(1000)
+        )
+        print(f"Sent batch: {len(event_ids)} events")
+
         # Получаем поток событий
         print("Streaming events...")
         async for event in client.stream_events(limit=3):
             print(f"Received: {event}")
             await asyncio.sleep(0.5)
-            
+
     except Exception as e:
         logger.error(f"Client error: {e}")
     finally:
         await client.close()
 
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    asyncio.run(main())
@@ -6,47 +6,66 @@
 import asyncio
 import aiohttp
 import logging
+import uuid
 from datetime import datetime
 from typing import List, Dict, Any
 
 logger = logging.getLogger(__name__)
 
+# Повторы отправки одного события: сбои сети, 5xx и 429 (перегрузка)
+SEND_RETRIES = 3
+RETRY_BACKOFF = 0.5
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
 class SimpleEventClient:
     def __init__(self, base_url: str = "http://localhost:8000"):
         self.base_url = base_url
         self.session = None
-    
+
     async def __aenter__(self):
         self.session = aiohttp.ClientSession()
         return self
-    
+
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         if self.session:
             await self.session.close()
-    
-    async def send_event(self, user_id: str, event_type: str, amount: float) -> Dict[str, Any]:
-        """Отправляет событие через REST API"""
+
+    async def send_event(self, user_id: str, event_type: str, amount: float,
+                         retries: int = SEND_RETRIES) -> Dict[str, Any]:
+        """Отправляет событие через REST API, повторяя при сбоях сети и 5xx/429"""
         event_data = {
             "user_id": user_id,
             "event_type": event_type,
             "amount": amount,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": datetime.now().isoformat(),
+            # Ключ создаётся один раз на событие: повторы ниже отправляют
+            # его же, и сервер ответит id оригинала с "duplicate": true
+            "idempotency_key": uuid.uuid4().hex
         }
-        
-        try:
-            async with self.session.post(f"{self.base_url}/events", json=event_data) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    logger.info(f"Event sent successfully: {result['id']}")
-                    return result
-                else:
+
+        for attempt in range(retries + 1):
+            try:
+                async with self.session.post(f"{self.base_url}/events", json=event_data) as response:
+                    if response.status == 200:
+                        result = await response.json()
+                        logger.info(f"Event sent successfully: {result['id']}")
+                        return result
                     error_text = await response.text()
-                    logger.error(f"Failed to send event: {response.status} - {error_text}")
-                    return {"error": error_text}
-        except Exception as e:
-            logger.error(f"Error sending event: {e}")
-            return {"error": str(e)}
-    
+                    if response.status not in RETRY_STATUSES or attempt == retries:
+                        logger.error(f"Failed to send event: {response.status} - {error_text}")
+                        return {"error": error_text}
+                    logger.warning(f"Retrying event after {response.status} (attempt {attempt + 1})")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == retries:
+                    logger.error(f"Error sending event: {e}")
+                    return {"error": str(e)}
+                logger.warning(f"Retrying event after error: {e} (attempt {attempt + 1})")
+            except Exception as e:
+                logger.error(f"Error sending event: {e}")
+                return {"error": str(e)}
+            await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+
     async def get_events(self, limit: int = 5) -> List[Dict[str, Any]]:
         """Получает последние события через GraphQL"""
         query = """
@@ -60,7 +79,7 @@ class SimpleEventClient:
             }
         }
         """ % limit
-        
+
         try:
             async with self.session.post(f"{self.base_url}/graphql", json={"query": query}) as response:
                 if response.status == 200:
@@ -72,7 +91,7 @@ class SimpleEventClient:
         except Exception as e:
             logger.error(f"Error getting events: {e}")
             return []
-    
+
     async def get_metrics(self, minutes: int = 1) -> Dict[str, Any]:
         """Получает агрегированные метрики"""
         query = """
@@ -84,7 +103,7 @@ class SimpleEventClient:
             }
         }
         """ % minutes
-        
+
         try:
             async with self.session.post(f"{self.base_url}/graphql", json={"query": query}) as response:
                 if response.status == 200:
@@ -97,16 +116,17 @@ class SimpleEventClient:
             logger.error(f"Error getting metrics: {e}")
             return {}
 
+
 async def main():
     """Демонстрация работы клиента"""
     logging.basicConfig(
         level=logging.INFO,
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
-    
+
     async with SimpleEventClient() as client:
         logger.info("🚀 Starting Event Hub client demo...")
-        
+
         # Отправляем тестовые события
         events = [
             ("user1", "purchase", 150.75),
@@ -114,7 +134,7 @@ async def main():
             ("user3", "purchase", 89.99),
             ("user4", "refund", 25.00),
         ]
-        
+
         logger.info("📤 Sending test events...")
         for user_id, event_type, amount in events:
             result = await client.send_event(user_id, event_type, amount)
@@ -123,14 +143,14 @@ async def main():
             else:
                 print(f"❌ Failed: {event_type} - ${amount}")
             await asyncio.sleep(0.5)
-        
+
         # Получаем последние события
         logger.info("📥 Getting recent events...")
         events = await client.get_events(limit=5)
         print(f"📊 Found {len(events)} events:")
         for event in events:
             print(f"   • {event['eventType']} - ${event['amount']} by {event['userId']}")
-        
+
         # Получаем метрики
         logger.info("📈 Getting aggregated metrics...")
         metrics = await client.get_metrics(minutes=1)
@@ -138,8 +158,8 @@ async def main():
             print(f"📊 Metrics: ${metrics['totalAmount']} total, {metrics['eventCount']} events")
         else:
             print("📊 No metrics available yet")
-        
+
         logger.info("🎉 Demo completed!")
 
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    asyncio.run(main())
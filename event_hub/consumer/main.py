@@ -1,16 +1,18 @@
 import asyncio
-import redis.asyncio as redis
 
-r = redis.Redis(host="redis", port=6379, decode_responses=True)
+from app.db.redis import r, EVENTS_STREAM
+from app.queue.codec import decode_event
+from app.queue.reliable_delivery import StreamConsumer
+
+
+async def print_event(message_id, fields):
+    data = decode_event(fields)
+    print(f"[{data['timestamp']}] {data['event_type']} by {data['user_id']}: {data['amount']}")
+
 
 async def consume():
-    last_id = "$"
-    while True:
-        messages = await r.xread({"events": last_id}, block=1000, count=1)
-        for stream, entries in messages:
-            for id, data in entries:
-                print(f"[{data['timestamp']}] {data['event_type']} by {data['user_id']}: {data['amount']}")
-                last_id = id
+    consumer = StreamConsumer(r, EVENTS_STREAM, "printer", handler=print_event, batch_size=10)
+    await consumer.run()
 
 if __name__ == "__main__":
     asyncio.run(consume())
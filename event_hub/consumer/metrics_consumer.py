@@ -1,103 +1,156 @@
 import asyncio
-import json
 import logging
-from datetime import datetime, timedelta
-from typing import Dict, Any
-from collections import defaultdict
+import os
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional
 
-from app.db.redis import r
-from app.db.mongo import collection
+from app.db.mongo import db
+from app.db.leaderboard import UserLeaderboard
+from app.db.window_totals import WindowTotals
+from app.db.redis import r, AGGREGATION_WINDOWS
+from app.db.rollups import RollupWriter
+from app.db.sketches import MinuteSketches
+from app.queue.codec import decode_event, to_timestamp_us
+from app.queue.reliable_delivery import Message, StreamConsumer
 
 logger = logging.getLogger(__name__)
 
+# Итоги по минутам/часам/суткам в MongoDB (app.db.rollups)
+ROLLUPS_ENABLED = os.getenv("ROLLUPS_ENABLED", "true").lower() == "true"
+# Итоги и top-N по пользователям в sorted set'ах Redis (app.db.leaderboard)
+LEADERBOARD_ENABLED = os.getenv("LEADERBOARD_ENABLED", "true").lower() == "true"
+# HyperLogLog пользователей и DDSketch сумм по минутам (app.db.sketches)
+SKETCHES_ENABLED = os.getenv("SKETCHES_ENABLED", "true").lower() == "true"
+
+
 class MetricsConsumer:
     def __init__(self):
-        self.metrics = defaultdict(lambda: {"total_amount": 0.0, "count": 0})
-        self.last_aggregation = datetime.now()
-    
-    async def process_event(self, event_data: Dict[str, Any]):
-        """Обрабатывает одно событие и обновляет метрики"""
-        try:
-            event_type = event_data.get("event_type", "unknown")
-            amount = float(event_data.get("amount", 0))
-            
-            # Обновляем метрики
-            self.metrics[event_type]["total_amount"] += amount
-            self.metrics[event_type]["count"] += 1
-            
-            logger.info(f"Processed event: {event_type} - {amount}")
-            
-        except Exception as e:
-            logger.error(f"Error processing event: {e}")
-    
-    async def aggregate_metrics(self):
-        """Агрегирует метрики за последнюю минуту"""
-        try:
-            cutoff_time = datetime.now() - timedelta(minutes=1)
-            
-            # Получаем события из MongoDB за последнюю минуту
-            pipeline = [
-                {"$match": {"timestamp": {"$gte": cutoff_time}}},
-                {"$group": {
-                    "_id": "$event_type",
-                    "total_amount": {"$sum": "$amount"},
-                    "count": {"$sum": 1}
-                }}
-            ]
-            
-            cursor = collection.aggregate(pipeline)
-            results = await cursor.to_list(length=None)
-            
-            # Формируем агрегированные метрики
-            aggregated = {}
-            for result in results:
-                event_type = result["_id"]
-                aggregated[event_type] = {
-                    "total_amount": result["total_amount"],
-                    "count": result["count"],
-                    "timestamp": datetime.now().isoformat()
-                }
-            
-            # Сохраняем в Redis для GraphQL
-            await r.set("aggregated_metrics", json.dumps(aggregated))
-            
-            logger.info(f"Aggregated metrics: {aggregated}")
-            
-        except Exception as e:
-            logger.error(f"Error aggregating metrics: {e}")
-    
+        # Итоги окон копятся в хэшах корзин Redis (app.db.window_totals):
+        # каждая реплика прибавляет свою часть stream'а, окна суммируются при чтении
+        self.totals = WindowTotals(r, AGGREGATION_WINDOWS)
+        self.publish_interval = float(os.getenv("AGGREGATION_INTERVAL", "5"))
+        self.consumer = StreamConsumer(
+            r, "events", "metrics",
+            batch_handler=self.handle_metrics_batch,
+            batch_size=int(os.getenv("CONSUMER_BATCH_SIZE", "100")),
+            max_deliveries=int(os.getenv("CONSUMER_MAX_DELIVERIES", "3")),
+            start_id="0"
+        )
+        # Отдельная группа: rollup'ы пишутся в MongoDB своими пачками
+        self.rollup_consumer = StreamConsumer(
+            r, "events", "rollups",
+            batch_handler=self.handle_rollup_batch,
+            batch_size=int(os.getenv("ROLLUP_BATCH_SIZE", "500")),
+            max_deliveries=int(os.getenv("CONSUMER_MAX_DELIVERIES", "3")),
+            start_id="0"
+        ) if ROLLUPS_ENABLED else None
+        self.leaderboard = UserLeaderboard(r, AGGREGATION_WINDOWS)
+        # Новая группа начинает с "$": окна заполняются с момента запуска
+        self.leaderboard_consumer = StreamConsumer(
+            r, "events", "leaderboard",
+            batch_handler=self.handle_leaderboard_batch,
+            batch_size=int(os.getenv("LEADERBOARD_BATCH_SIZE", "500")),
+            max_deliveries=int(os.getenv("CONSUMER_MAX_DELIVERIES", "3")),
+        ) if LEADERBOARD_ENABLED else None
+        self.sketches = MinuteSketches(r, AGGREGATION_WINDOWS)
+        self.sketch_consumer = StreamConsumer(
+            r, "events", "sketches",
+            batch_handler=self.handle_sketch_batch,
+            batch_size=int(os.getenv("SKETCH_BATCH_SIZE", "500")),
+            max_deliveries=int(os.getenv("CONSUMER_MAX_DELIVERIES", "3")),
+        ) if SKETCHES_ENABLED else None
+
+    @staticmethod
+    def _event_time(event_data: Dict[str, Any]) -> Optional[float]:
+        ts = event_data.get("timestamp")
+        # Наивное время события - UTC, а не локальное время процесса
+        return to_timestamp_us(ts) / 1_000_000 if ts else None
+
+    async def handle_metrics_batch(self, messages: List[Message]):
+        """Пачка stream'а -> один pipeline HINCRBY по корзинам окон"""
+        events = []
+        for _, fields in messages:
+            event = decode_event(fields)
+            events.append((
+                event.get("event_type") or "unknown",
+                event.get("amount", 0.0),
+                self._event_time(event)
+            ))
+        await self.totals.add(events)
+
+    async def handle_rollup_batch(self, messages: List[Message]):
+        """Пачка stream'а -> один bulk_write $inc на коллекцию rollup'ов.
+
+        Буфер живёт одну пачку: при ошибке пачка остаётся в PEL, а при
+        повторной доставке уже учтённые сообщения пропускаются по журналу
+        rollup_applied.
+        """
+        writer = RollupWriter(db)
+        for message_id, fields in messages:
+            event = decode_event(fields)
+            writer.add(
+                event.get("event_type") or "unknown",
+                event.get("amount", 0.0),
+                event.get("timestamp") or datetime.now(timezone.utc).replace(tzinfo=None),
+                message_id
+            )
+        await writer.flush()
+
+    def _user_events(self, messages: List[Message]) -> List[tuple]:
+        """(user_id, event_type, amount, время события) для пачки stream'а"""
+        events = []
+        for _, fields in messages:
+            event = decode_event(fields)
+            events.append((
+                event.get("user_id") or "unknown",
+                event.get("event_type") or "unknown",
+                event.get("amount", 0.0),
+                self._event_time(event)
+            ))
+        return events
+
+    async def handle_leaderboard_batch(self, messages: List[Message]):
+        """Пачка stream'а -> один pipeline ZINCRBY по пользователям"""
+        await self.leaderboard.add(self._user_events(messages))
+
+    async def handle_sketch_batch(self, messages: List[Message]):
+        """Пачка stream'а -> один pipeline PFADD/HINCRBY по минутам"""
+        await self.sketches.add(self._user_events(messages))
+
+    async def leaderboard_loop(self):
+        """Вычитает из окон лидеров минуты, вышедшие за их границу"""
+        while True:
+            try:
+                await self.leaderboard.retire()
+            except Exception as e:
+                logger.error(f"Error retiring leaderboard buckets: {e}")
+            await asyncio.sleep(self.publish_interval)
+
     async def run(self):
         """Основной цикл consumer'а"""
-        last_id = "0"
-        
-        while True:
+        tasks = [self.consumer.run()]
+        if self.rollup_consumer is not None:
             try:
-                # Читаем события из Redis Stream
-                messages = await r.xread({"events": last_id}, count=10, block=1000)
-                
-                for stream, stream_messages in messages:
-                    for message_id, fields in stream_messages:
-                        last_id = message_id
-                        await self.process_event(fields)
-                
-                # Агрегируем метрики каждую минуту
-                if datetime.now() - self.last_aggregation >= timedelta(minutes=1):
-                    await self.aggregate_metrics()
-                    self.last_aggregation = datetime.now()
-                
+                await RollupWriter(db).ensure_indexes()
             except Exception as e:
-                logger.error(f"Consumer error: {e}")
-                await asyncio.sleep(1)
+                logger.error(f"Rollup index bootstrap failed: {e}")
+            tasks.append(self.rollup_consumer.run())
+        if self.leaderboard_consumer is not None:
+            tasks.extend([self.leaderboard_consumer.run(), self.leaderboard_loop()])
+        if self.sketch_consumer is not None:
+            tasks.append(self.sketch_consumer.run())
+        await asyncio.gather(*tasks)
+
 
 async def main():
     logging.basicConfig(
         level=logging.INFO,
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
-    
+
     consumer = MetricsConsumer()
     logger.info("Starting metrics consumer...")
     await consumer.run()
 
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    asyncio.run(main())
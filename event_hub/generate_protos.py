@@ -5,6 +5,20 @@
 import subprocess
 import sys
 import os
+import re
+
+def fix_grpc_imports(output_dir: str):
+    """Делает импорты *_pb2 в *_pb2_grpc.py относительными (пакет protos)"""
+    for file in os.listdir(output_dir):
+        if not file.endswith('_pb2_grpc.py'):
+            continue
+        path = os.path.join(output_dir, file)
+        with open(path) as f:
+            content = f.read()
+        fixed = re.sub(r'^import (\w+_pb2) as', r'from . import \1 as', content, flags=re.MULTILINE)
+        if fixed != content:
+            with open(path, 'w') as f:
+                f.write(fixed)
 
 def generate_protos():
     """Генерирует Python файлы из .proto файлов"""
@@ -47,6 +61,8 @@ def generate_protos():
                 
         except Exception as e:
             print(f"Error processing {proto_file}: {e}")
+    
+    fix_grpc_imports(output_dir)
 
 if __name__ == "__main__":
     generate_protos() 
\ No newline at end of file
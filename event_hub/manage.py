@@ -1 +1,124 @@
- 
\ No newline at end of file
+#!/usr/bin/env python3
+"""
+Утилита управления Event Hub: просмотр и восстановление DLQ
+"""
+
+import argparse
+import asyncio
+import json
+import re
+from datetime import datetime, timedelta
+from typing import Optional
+
+from app.db.indexes import EVENT_INDEXES, ensure_indexes, index_report
+from app.db.mongo import collection, events, PARTITIONED
+from app.db.redis import r, EVENTS_STREAM
+from app.queue.codec import decode_event
+from app.queue.reliable_delivery import REPLAY_GROUP_FIELD, dlq_stream_name
+
+DLQ_FIELDS_PREFIX = "dlq_"
+
+
+def parse_since(value: str) -> timedelta:
+    """Разбирает интервал вида 30s, 15m, 2h, 1d"""
+    match = re.fullmatch(r"(\d+)([smhd])", value)
+    if not match:
+        raise argparse.ArgumentTypeError(f"Некорректный интервал: {value}")
+    units = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days"}
+    return timedelta(**{units[match.group(2)]: int(match.group(1))})
+
+
+def min_stream_id(since: timedelta) -> str:
+    """ID записи stream'а, соответствующий моменту now - since"""
+    return f"{int((datetime.now() - since).timestamp() * 1000)}-0"
+
+
+async def list_dlq(stream: str, count: int):
+    """Выводит сообщения из DLQ"""
+    dlq = dlq_stream_name(stream)
+    entries = await r.xrange(dlq, count=count)
+    print(f"{dlq}: {await r.xlen(dlq)} сообщений")
+    for message_id, fields in entries:
+        event = decode_event({k: v for k, v in fields.items() if not k.startswith(DLQ_FIELDS_PREFIX)})
+        print(f"{message_id} [{fields.get('dlq_group')}] {fields.get('dlq_error')}: "
+              f"{event['event_type']} by {event['user_id']} - {event['amount']}")
+
+
+async def replay_dlq(stream: str, since: timedelta, group: Optional[str] = None, batch_size: int = 500):
+    """Возвращает сообщения из DLQ в основной stream.
+
+    Каждая запись адресуется группе, в которой она упала (replay_group):
+    остальные группы её пропускают, поэтому итоги не удваиваются.
+    С group возвращаются только сообщения этой группы.
+    """
+    dlq = dlq_stream_name(stream)
+    start = min_stream_id(since)
+    replayed = 0
+
+    while True:
+        entries = await r.xrange(dlq, min=start, count=batch_size)
+        if not entries:
+            break
+
+        selected = [
+            (message_id, fields) for message_id, fields in entries
+            if group is None or fields.get("dlq_group") == group
+        ]
+        if selected:
+            async with r.pipeline(transaction=False) as pipe:
+                for message_id, fields in selected:
+                    original = {k: v for k, v in fields.items() if not k.startswith(DLQ_FIELDS_PREFIX)}
+                    if fields.get("dlq_group"):
+                        original[REPLAY_GROUP_FIELD] = fields["dlq_group"]
+                    pipe.xadd(stream, original)
+                pipe.xdel(dlq, *[message_id for message_id, _ in selected])
+                await pipe.execute()
+
+        replayed += len(selected)
+        start = f"({entries[-1][0]}"
+
+    print(f"Восстановлено {replayed} сообщений из {dlq} в {stream}")
+
+
+async def show_indexes(create: bool):
+    """Создаёт недостающие индексы и выводит отчёт по их использованию"""
+    if PARTITIONED:
+        targets = [events.db[name] for name in await events.existing_partitions()]
+        indexes = events.indexes
+    else:
+        targets = [collection]
+        indexes = EVENT_INDEXES
+    for target in targets:
+        if create:
+            created = await ensure_indexes(target, indexes)
+            print(f"{target.name}: созданы индексы: {created or 'нет'}")
+        report = await index_report(target, indexes)
+        print(json.dumps({target.name: report}, indent=2, default=str))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Управление Event Hub')
+    parser.add_argument('--stream', default=EVENTS_STREAM, help='Имя Redis Stream')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    list_parser = subparsers.add_parser('list-dlq', help='Просмотр сообщений в DLQ')
+    list_parser.add_argument('--count', type=int, default=50, help='Максимум сообщений')
+
+    replay_parser = subparsers.add_parser('replay-dlq', help='Восстановление сообщений из DLQ')
+    replay_parser.add_argument('--since', type=parse_since, default='1h', help='Интервал, например 2h')
+    replay_parser.add_argument('--group', help='Только сообщения, упавшие в этой группе')
+
+    indexes_parser = subparsers.add_parser('indexes', help='Отчёт по индексам коллекции событий')
+    indexes_parser.add_argument('--create', action='store_true', help='Создать недостающие индексы')
+
+    args = parser.parse_args()
+
+    if args.command == 'list-dlq':
+        asyncio.run(list_dlq(args.stream, args.count))
+    elif args.command == 'replay-dlq':
+        asyncio.run(replay_dlq(args.stream, args.since, args.group))
+    elif args.command == 'indexes':
+        asyncio.run(show_indexes(args.create))
+
+if __name__ == '__main__':
+    main()
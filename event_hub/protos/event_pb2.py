@@ -2,7 +2,7 @@
 # Generated by the protocol buffer compiler.  DO NOT EDIT!
 # NO CHECKED-IN PROTOBUF GENCODE
 # source: event.proto
-# Protobuf Python Version: 6.31.0
+# Protobuf Python Version: 7.35.1
 """Generated protocol buffer code."""
 from google.protobuf import descriptor as _descriptor
 from google.protobuf import descriptor_pool as _descriptor_pool
@@ -11,9 +11,9 @@ from google.protobuf import symbol_database as _symbol_database
 from google.protobuf.internal import builder as _builder
 _runtime_version.ValidateProtobufRuntimeVersion(
     _runtime_version.Domain.PUBLIC,
-    6,
-    31,
-    0,
+    7,
+    35,
+    1,
     '',
     'event.proto'
 )
@@ -22,21 +22,28 @@ _runtime_version.ValidateProtobufRuntimeVersion(
 _sym_db = _symbol_database.Default()
 
 
+from google.protobuf import timestamp_pb2 as google_dot_protobuf_dot_timestamp__pb2
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0b\x65vent.proto\x12\x05\x65vent\"V\n\x0c\x45ventRequest\x12\x0f\n\x07user_id\x18\x01 \x01(\t\x12\x12\n\nevent_type\x18\x02 \x01(\t\x12\x0e\n\x06\x61mount\x18\x03 \x01(\x01\x12\x11\n\ttimestamp\x18\x04 \x01(\t\"B\n\rEventResponse\x12\x10\n\x08\x65vent_id\x18\x01 \x01(\t\x12\x0e\n\x06status\x18\x02 \x01(\t\x12\x0f\n\x07message\x18\x03 \x01(\t\"\x1e\n\rStreamRequest\x12\r\n\x05limit\x18\x01 \x01(\x05\x32\x84\x01\n\x0c\x45ventService\x12\x36\n\tSendEvent\x12\x13.event.EventRequest\x1a\x14.event.EventResponse\x12<\n\x0cStreamEvents\x12\x14.event.StreamRequest\x1a\x14.event.EventResponse0\x01\x62\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x0b\x65vent.proto\x12\x05\x65vent\x1a\x1fgoogle/protobuf/timestamp.proto\"\x9f\x01\n\x0c\x45ventRequest\x12\x0f\n\x07user_id\x18\x01 \x01(\t\x12\x12\n\nevent_type\x18\x02 \x01(\t\x12\x0e\n\x06\x61mount\x18\x03 \x01(\x01\x12\x11\n\ttimestamp\x18\x04 \x01(\t\x12.\n\nevent_time\x18\x05 \x01(\x0b\x32\x1a.google.protobuf.Timestamp\x12\x17\n\x0fidempotency_key\x18\x06 \x01(\t\"B\n\rEventResponse\x12\x10\n\x08\x65vent_id\x18\x01 \x01(\t\x12\x0e\n\x06status\x18\x02 \x01(\t\x12\x0f\n\x07message\x18\x03 \x01(\t\"\xb8\x01\n\rStreamRequest\x12\r\n\x05limit\x18\x01 \x01(\x05\x12\x13\n\x0b\x65vent_types\x18\x02 \x03(\t\x12\x0f\n\x07user_id\x18\x03 \x01(\t\x12\x17\n\nmin_amount\x18\x04 \x01(\x01H\x00\x88\x01\x01\x12\x17\n\nmax_amount\x18\x05 \x01(\x01H\x01\x88\x01\x01\x12\x0e\n\x06\x63ursor\x18\x06 \x01(\t\x12\x12\n\nmax_events\x18\x07 \x01(\x05\x42\r\n\x0b_min_amountB\r\n\x0b_max_amount\"L\n\x08\x45ventAck\x12\r\n\x05index\x18\x01 \x01(\x03\x12\x10\n\x08\x65vent_id\x18\x02 \x01(\t\x12\x0e\n\x06status\x18\x03 \x01(\t\x12\x0f\n\x07message\x18\x04 \x01(\t\"M\n\x08\x42\x61tchAck\x12\x1d\n\x04\x61\x63ks\x18\x01 \x03(\x0b\x32\x0f.event.EventAck\x12\x10\n\x08\x61\x63\x63\x65pted\x18\x02 \x01(\x05\x12\x10\n\x08rejected\x18\x03 \x01(\x05\"j\n\x0bStreamEvent\x12\x10\n\x08\x65vent_id\x18\x01 \x01(\t\x12\x0f\n\x07user_id\x18\x02 \x01(\t\x12\x12\n\nevent_type\x18\x03 \x01(\t\x12\x0e\n\x06\x61mount\x18\x04 \x01(\x01\x12\x14\n\x0ctimestamp_us\x18\x05 \x01(\x03\x32\xbc\x01\n\x0c\x45ventService\x12\x36\n\tSendEvent\x12\x13.event.EventRequest\x1a\x14.event.EventResponse\x12<\n\x0cStreamEvents\x12\x14.event.StreamRequest\x1a\x14.event.EventResponse0\x01\x12\x36\n\nSendEvents\x12\x13.event.EventRequest\x1a\x0f.event.BatchAck(\x01\x30\x01\x62\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'event_pb2', _globals)
 if not _descriptor._USE_C_DESCRIPTORS:
   DESCRIPTOR._loaded_options = None
-  _globals['_EVENTREQUEST']._serialized_start=22
-  _globals['_EVENTREQUEST']._serialized_end=108
-  _globals['_EVENTRESPONSE']._serialized_start=110
-  _globals['_EVENTRESPONSE']._serialized_end=176
-  _globals['_STREAMREQUEST']._serialized_start=178
-  _globals['_STREAMREQUEST']._serialized_end=208
-  _globals['_EVENTSERVICE']._serialized_start=211
-  _globals['_EVENTSERVICE']._serialized_end=343
+  _globals['_EVENTREQUEST']._serialized_start=56
+  _globals['_EVENTREQUEST']._serialized_end=215
+  _globals['_EVENTRESPONSE']._serialized_start=217
+  _globals['_EVENTRESPONSE']._serialized_end=283
+  _globals['_STREAMREQUEST']._serialized_start=286
+  _globals['_STREAMREQUEST']._serialized_end=470
+  _globals['_EVENTACK']._serialized_start=472
+  _globals['_EVENTACK']._serialized_end=548
+  _globals['_BATCHACK']._serialized_start=550
+  _globals['_BATCHACK']._serialized_end=627
+  _globals['_STREAMEVENT']._serialized_start=629
+  _globals['_STREAMEVENT']._serialized_end=735
+  _globals['_EVENTSERVICE']._serialized_start=738
+  _globals['_EVENTSERVICE']._serialized_end=926
 # @@protoc_insertion_point(module_scope)
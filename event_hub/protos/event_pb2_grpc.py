@@ -3,9 +3,9 @@
 import grpc
 import warnings
 
-import event_pb2 as event__pb2
+from . import event_pb2 as event__pb2
 
-GRPC_GENERATED_VERSION = '1.73.1'
+GRPC_GENERATED_VERSION = '1.84.0'
 GRPC_VERSION = grpc.__version__
 _version_not_supported = False
 
@@ -18,14 +18,14 @@ except ImportError:
 if _version_not_supported:
     raise RuntimeError(
         f'The grpc package installed is at version {GRPC_VERSION},'
-        + f' but the generated code in event_pb2_grpc.py depends on'
+        + ' but the generated code in event_pb2_grpc.py depends on'
         + f' grpcio>={GRPC_GENERATED_VERSION}.'
         + f' Please upgrade your grpc module to grpcio>={GRPC_GENERATED_VERSION}'
         + f' or downgrade your generated code using grpcio-tools<={GRPC_VERSION}.'
     )
 
 
-class EventServiceStub(object):
+class EventServiceStub:
     """Missing associated documentation comment in .proto file."""
 
     def __init__(self, channel):
@@ -44,9 +44,14 @@ class EventServiceStub(object):
                 request_serializer=event__pb2.StreamRequest.SerializeToString,
                 response_deserializer=event__pb2.EventResponse.FromString,
                 _registered_method=True)
+        self.SendEvents = channel.stream_stream(
+                '/event.EventService/SendEvents',
+                request_serializer=event__pb2.EventRequest.SerializeToString,
+                response_deserializer=event__pb2.BatchAck.FromString,
+                _registered_method=True)
 
 
-class EventServiceServicer(object):
+class EventServiceServicer:
     """Missing associated documentation comment in .proto file."""
 
     def SendEvent(self, request, context):
@@ -61,6 +66,13 @@ class EventServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def SendEvents(self, request_iterator, context):
+        """Потоковый приём: сервер сохраняет события пачками и подтверждает каждую пачку
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_EventServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -74,6 +86,11 @@ def add_EventServiceServicer_to_server(servicer, server):
                     request_deserializer=event__pb2.StreamRequest.FromString,
                     response_serializer=event__pb2.EventResponse.SerializeToString,
             ),
+            'SendEvents': grpc.stream_stream_rpc_method_handler(
+                    servicer.SendEvents,
+                    request_deserializer=event__pb2.EventRequest.FromString,
+                    response_serializer=event__pb2.BatchAck.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'event.EventService', rpc_method_handlers)
@@ -82,7 +99,7 @@ def add_EventServiceServicer_to_server(servicer, server):
 
 
  # This class is part of an EXPERIMENTAL API.
-class EventService(object):
+class EventService:
     """Missing associated documentation comment in .proto file."""
 
     @staticmethod
@@ -138,3 +155,30 @@ class EventService(object):
             timeout,
             metadata,
             _registered_method=True)
+
+    @staticmethod
+    def SendEvents(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_stream(
+            request_iterator,
+            target,
+            '/event.EventService/SendEvents',
+            event__pb2.EventRequest.SerializeToString,
+            event__pb2.BatchAck.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Production-запуск Event Hub на нескольких ядрах
+
+FastAPI - N процессов uvicorn на одном слушающем сокете, который открывает
+супервизор и передаёт им через --fd; gRPC - N независимых процессов на
+одном порту через SO_REUSEPORT. Все воркеры - прямые потомки супервизора:
+он перезапускает каждый по отдельности и знает pid, который нужно пометить
+мёртвым в PROMETHEUS_MULTIPROC_DIR. Каждый процесс создаёт собственные
+пулы MongoDB/Redis, метрики всех процессов отдаются через /metrics.
+"""
+import argparse
+import logging
+import glob
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Sequence
+
+from prometheus_client import multiprocess
+
+logger = logging.getLogger("run_prod")
+
+
+class Worker:
+    """Дочерний процесс с командой для перезапуска"""
+
+    def __init__(self, name: str, cmd: List[str], env: Dict[str, str], pass_fds: Sequence[int] = ()):
+        self.name = name
+        self.cmd = cmd
+        self.env = env
+        # Дескрипторы, которые наследует процесс (общий HTTP-сокет)
+        self.pass_fds = tuple(pass_fds)
+        self.process: Optional[subprocess.Popen] = None
+        self.restarts = 0
+        # time.monotonic() перезапуска упавшего процесса; None - процесс запущен
+        self.restart_at: Optional[float] = None
+
+    def start(self):
+        self.process = subprocess.Popen(self.cmd, env=self.env, pass_fds=self.pass_fds)
+        logger.info(f"Started {self.name} (pid {self.process.pid})")
+
+
+class ProdRunner:
+    def __init__(self, args):
+        self.args = args
+        self.workers: List[Worker] = []
+        self.stopping = False
+        self.http_socket: Optional[socket.socket] = None
+        self.metrics_dir = args.metrics_dir or tempfile.mkdtemp(prefix="event_hub_metrics_")
+
+    def prepare_metrics_dir(self):
+        """Очищает каталог multiprocess-метрик от прошлых запусков"""
+        os.makedirs(self.metrics_dir, exist_ok=True)
+        for path in glob.glob(os.path.join(self.metrics_dir, "*.db")):
+            os.remove(path)
+
+    def base_env(self) -> Dict[str, str]:
+        env = dict(os.environ)
+        env["PROMETHEUS_MULTIPROC_DIR"] = self.metrics_dir
+        return env
+
+    def bind_http_socket(self) -> socket.socket:
+        """Слушающий сокет HTTP, общий для всех процессов uvicorn"""
+        family = socket.AF_INET6 if ":" in self.args.host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.args.host, self.args.port))
+        sock.listen(2048)
+        sock.set_inheritable(True)
+        return sock
+
+    def build_workers(self):
+        env = self.base_env()
+
+        if self.args.http_workers:
+            # Вместо uvicorn --workers: его дочерние процессы не видны
+            # супервизору, и их pid не помечались бы мёртвыми в метриках
+            self.http_socket = self.bind_http_socket()
+            fd = self.http_socket.fileno()
+            for i in range(self.args.http_workers):
+                self.workers.append(Worker(f"http-{i}", [
+                    sys.executable, "-m", "uvicorn", "app.main:app",
+                    "--fd", str(fd),
+                    "--timeout-graceful-shutdown", str(int(self.args.grace)),
+                ], env, pass_fds=(fd,)))
+
+        grpc_env = dict(env)
+        grpc_env["GRPC_LISTEN_ADDR"] = f"[::]:{self.args.grpc_port}"
+        grpc_env["GRPC_SO_REUSEPORT"] = "true"
+        grpc_env["GRPC_SHUTDOWN_GRACE_SECONDS"] = str(self.args.grace)
+        for i in range(self.args.grpc_workers):
+            self.workers.append(Worker(f"grpc-{i}", [sys.executable, "-m", "app.grpc.server"], grpc_env))
+
+    def signal_handler(self, signum, frame):
+        """Обработчик сигналов для согласованного завершения"""
+        if not self.stopping:
+            logger.info(f"Received signal {signum}, stopping workers...")
+        self.stopping = True
+
+    def stop_all(self):
+        """SIGTERM всем воркерам, по истечении grace - SIGKILL"""
+        for worker in self.workers:
+            if worker.process and worker.process.poll() is None:
+                worker.process.terminate()
+
+        deadline = time.monotonic() + self.args.grace + 5
+        for worker in self.workers:
+            if not worker.process:
+                continue
+            try:
+                worker.process.wait(timeout=max(0.1, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                logger.warning(f"{worker.name} did not stop in time, killing")
+                worker.process.kill()
+            multiprocess.mark_process_dead(worker.process.pid)
+
+    def supervise(self):
+        """Перезапускает упавшие воркеры, пока не пришёл сигнал остановки.
+
+        Backoff у каждого воркера свой: перезапуск планируется на момент
+        restart_at, и ожидание одного не задерживает надзор за остальными.
+        """
+        while not self.stopping:
+            now = time.monotonic()
+            for worker in self.workers:
+                if self.stopping:
+                    break
+                if worker.restart_at is not None:
+                    if now >= worker.restart_at:
+                        worker.restart_at = None
+                        worker.start()
+                    continue
+                code = worker.process.poll()
+                if code is None:
+                    continue
+                multiprocess.mark_process_dead(worker.process.pid)
+                worker.restarts += 1
+                delay = min(30, 2 ** min(worker.restarts, 5))
+                logger.error(f"{worker.name} exited with code {code}, restart #{worker.restarts} in {delay}s")
+                worker.restart_at = now + delay
+            time.sleep(1)
+
+    def run(self):
+        signal.signal(signal.SIGINT, self.signal_handler)
+        signal.signal(signal.SIGTERM, self.signal_handler)
+
+        self.prepare_metrics_dir()
+        self.build_workers()
+        logger.info(f"Starting {self.args.http_workers} HTTP and {self.args.grpc_workers} gRPC workers")
+        try:
+            for worker in self.workers:
+                worker.start()
+            self.supervise()
+        finally:
+            self.stop_all()
+            if self.http_socket is not None:
+                self.http_socket.close()
+            logger.info("All workers stopped")
+
+
+def main():
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description='Production-запуск Event Hub')
+    parser.add_argument('--host', default='0.0.0.0', help='Адрес HTTP')
+    parser.add_argument('--port', type=int, default=8000, help='Порт HTTP')
+    parser.add_argument('--grpc-port', type=int, default=50051, help='Порт gRPC')
+    parser.add_argument('--http-workers', type=int, default=int(os.getenv("HTTP_WORKERS", cpus)),
+                        help='Число процессов FastAPI')
+    parser.add_argument('--grpc-workers', type=int, default=int(os.getenv("GRPC_WORKERS", cpus)),
+                        help='Число процессов gRPC')
+    parser.add_argument('--grace', type=float, default=float(os.getenv("SHUTDOWN_GRACE_SECONDS", "10")),
+                        help='Время на завершение текущих запросов, с')
+    parser.add_argument('--metrics-dir', default=os.getenv("PROMETHEUS_MULTIPROC_DIR"),
+                        help='Каталог multiprocess-метрик Prometheus')
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    ProdRunner(args).run()
+
+
+if __name__ == "__main__":
+    main()
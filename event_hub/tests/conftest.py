@@ -0,0 +1,787 @@
+"""
+Общие заглушки хранилищ для тестов: Redis, коллекции MongoDB и часы
+"""
+
+import asyncio
+import copy
+import fnmatch
+import itertools
+import re
+from typing import Any, Dict, List, Optional
+
+import pytest
+import pytest_asyncio
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from pymongo.results import InsertOneResult
+from redis.exceptions import ResponseError, WatchError
+
+
+class FakeClock:
+    """Управляемые часы: clock.now задаёт текущее время"""
+
+    def __init__(self, now: float = 0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+# Redis
+
+
+def _stream_id(message_id: str):
+    ms, _, seq = message_id.partition("-")
+    return int(ms), int(seq or 0)
+
+
+def _range_bound(bound: str, low: bool):
+    """Граница XRANGE: -, +, ID или (ID (исключающая)"""
+    if bound in ("-", "+"):
+        return (-1, -1) if bound == "-" else (float("inf"), 0), False
+    exclusive = bound.startswith("(")
+    return _stream_id(bound.lstrip("(")), exclusive
+
+
+def _score(value) -> float:
+    if value in ("-inf", "+inf", "inf"):
+        return float(value.replace("+", ""))
+    text = str(value)
+    if text.startswith("("):
+        return float(text[1:])
+    return float(value)
+
+
+class FakePipeline:
+    """Pipeline: команды копятся и выполняются одним round trip.
+
+    После watch() команды выполняются сразу, до multi(); execute()
+    бросает WatchError, если наблюдаемые ключи изменились.
+    """
+
+    def __init__(self, redis: "FakeRedis"):
+        self.redis = redis
+        self.calls: List[tuple] = []
+        self.watched: Optional[Dict[str, Any]] = None
+        self.immediate = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def watch(self, *keys):
+        self.redis.round_trips += 1
+        self.watched = {key: copy.deepcopy(self.redis.data.get(key)) for key in keys}
+        self.immediate = True
+
+    def multi(self):
+        self.immediate = False
+
+    def __getattr__(self, name):
+        if self.immediate:
+            return getattr(self.redis, name)
+
+        def call(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+            return self
+        return call
+
+    async def execute(self):
+        watched, self.watched, self.immediate = self.watched, None, False
+        if watched and any(self.redis.data.get(key) != value for key, value in watched.items()):
+            self.calls = []
+            raise WatchError("Watched variable changed.")
+        self.redis.round_trips += 1
+        self.redis.executed.append([name for name, _, _ in self.calls])
+        results = []
+        for name, args, kwargs in self.calls:
+            results.append(await getattr(self.redis, name)(*args, _counted=True, **kwargs))
+        self.calls = []
+        return results
+
+
+class FakeRedis:
+    """Redis в памяти: строки, хэши, множества, sorted set'ы, HyperLogLog
+    (точным множеством) и stream'ы с consumer group'ами.
+
+    round_trips считает обращения к серверу (pipeline - одно), ttl хранит
+    последние EXPIRE/EX; истечение ключей не моделируется.
+    """
+
+    def __init__(self, clock: Optional[FakeClock] = None):
+        self.data: Dict[str, Any] = {}
+        self.ttl: Dict[str, float] = {}
+        self.round_trips = 0
+        self.executed: List[List[str]] = []
+        # Часы для idle time сообщений consumer group'ы, секунды
+        self.clock = clock or FakeClock(1_000.0)
+        self.groups: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._ids = itertools.count(1)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def __getattribute__(self, name):
+        attr = object.__getattribute__(self, name)
+        if name.startswith("_") or not asyncio.iscoroutinefunction(attr):
+            return attr
+
+        async def command(*args, _counted=False, **kwargs):
+            if not _counted:
+                self.round_trips += 1
+            return await attr(*args, **kwargs)
+        return command
+
+    # Ключи и строки
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def mget(self, keys, *more):
+        keys = list(keys) if isinstance(keys, (list, tuple)) else [keys, *more]
+        return [self.data.get(key) for key in keys]
+
+    async def set(self, key, value, nx=False, ex=None, get=False):
+        previous = self.data.get(key)
+        if not (nx and key in self.data):
+            self.data[key] = str(value)
+            if ex is not None:
+                self.ttl[key] = ex
+        if get:
+            return previous
+        return None if nx and previous is not None else True
+
+    async def delete(self, *keys):
+        removed = 0
+        for key in keys:
+            removed += self.data.pop(key, None) is not None
+            self.ttl.pop(key, None)
+        return removed
+
+    async def exists(self, *keys):
+        return sum(key in self.data for key in keys)
+
+    async def expire(self, key, seconds):
+        if key not in self.data:
+            return False
+        self.ttl[key] = seconds
+        return True
+
+    async def keys(self, pattern="*"):
+        return [key for key in self.data if fnmatch.fnmatch(key, pattern)]
+
+    # Хэши
+
+    async def hset(self, key, field=None, value=None, mapping=None):
+        fields = self.data.setdefault(key, {})
+        updates = dict(mapping or {})
+        if field is not None:
+            updates[field] = value
+        for name, item in updates.items():
+            fields[name] = str(item)
+        return len(updates)
+
+    async def hget(self, key, field):
+        return self.data.get(key, {}).get(field)
+
+    async def hmget(self, key, *fields):
+        if len(fields) == 1 and isinstance(fields[0], (list, tuple)):
+            fields = fields[0]
+        return [self.data.get(key, {}).get(field) for field in fields]
+
+    async def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    async def hincrby(self, key, field, amount=1):
+        fields = self.data.setdefault(key, {})
+        fields[field] = str(int(fields.get(field, 0)) + int(amount))
+        return int(fields[field])
+
+    async def hincrbyfloat(self, key, field, amount=1.0):
+        fields = self.data.setdefault(key, {})
+        fields[field] = repr(float(fields.get(field, 0)) + float(amount))
+        return float(fields[field])
+
+    # Множества и HyperLogLog
+
+    async def sadd(self, key, *members):
+        values = self.data.setdefault(key, set())
+        added = len(set(members) - values)
+        values.update(members)
+        return added
+
+    async def smembers(self, key):
+        return set(self.data.get(key, set()))
+
+    async def pfadd(self, key, *members):
+        return await self.sadd(key, *members, _counted=True)
+
+    async def pfcount(self, *keys):
+        return len(set().union(*(self.data.get(key, set()) for key in keys)))
+
+    # Sorted set'ы
+
+    def _zset(self, key) -> Dict[str, float]:
+        return self.data.setdefault(key, {})
+
+    def _ranked(self, key, reverse: bool, start: int = 0, end: int = -1):
+        ranked = sorted(self.data.get(key, {}).items(), key=lambda item: (item[1], item[0]), reverse=reverse)
+        # Как в Redis: end включительно, отрицательные индексы - с конца
+        return ranked[start:end + 1 or None]
+
+    async def zadd(self, key, mapping):
+        zset = self._zset(key)
+        added = len(set(mapping) - set(zset))
+        zset.update({member: float(score) for member, score in mapping.items()})
+        return added
+
+    async def zincrby(self, key, amount, member):
+        zset = self._zset(key)
+        zset[member] = zset.get(member, 0.0) + float(amount)
+        return zset[member]
+
+    async def zrem(self, key, *members):
+        zset = self.data.get(key, {})
+        return sum(zset.pop(member, None) is not None for member in members)
+
+    async def zunionstore(self, dest, keys, aggregate=None):
+        weights = keys if isinstance(keys, dict) else {key: 1 for key in keys}
+        result: Dict[str, float] = {}
+        for key, weight in weights.items():
+            for member, score in self.data.get(key, {}).items():
+                result[member] = result.get(member, 0.0) + score * weight
+        self.data.pop(dest, None)
+        self.ttl.pop(dest, None)
+        if result:
+            self.data[dest] = result
+        return len(result)
+
+    async def zinterstore(self, dest, keys, aggregate=None):
+        weights = keys if isinstance(keys, dict) else {key: 1 for key in keys}
+        sets = [self.data.get(key, {}) for key in weights]
+        members = set(sets[0]).intersection(*sets[1:]) if sets else set()
+        result = {
+            member: sum(zset[member] * weight for zset, weight in zip(sets, weights.values()))
+            for member in members
+        }
+        self.data.pop(dest, None)
+        self.ttl.pop(dest, None)
+        if result:
+            self.data[dest] = result
+        return len(result)
+
+    async def zremrangebyscore(self, key, low, high):
+        zset = self.data.get(key, {})
+        low, high = _score(low), _score(high)
+        doomed = [member for member, score in zset.items() if low <= score <= high]
+        for member in doomed:
+            del zset[member]
+        return len(doomed)
+
+    async def zrange(self, key, start, end, withscores=False):
+        ranked = self._ranked(key, False, start, end)
+        return ranked if withscores else [member for member, _ in ranked]
+
+    async def zrevrange(self, key, start, end, withscores=False):
+        ranked = self._ranked(key, True, start, end)
+        return ranked if withscores else [member for member, _ in ranked]
+
+    async def zscore(self, key, member):
+        return self.data.get(key, {}).get(member)
+
+    async def zmscore(self, key, members):
+        return [self.data.get(key, {}).get(member) for member in members]
+
+    async def zrevrank(self, key, member):
+        ranked = [m for m, _ in self._ranked(key, reverse=True)]
+        return ranked.index(member) if member in ranked else None
+
+    async def zcard(self, key):
+        return len(self.data.get(key, {}))
+
+    # Stream'ы
+
+    def _stream(self, stream) -> List[tuple]:
+        return self.data.setdefault(stream, [])
+
+    def _next_id(self, stream) -> str:
+        entries = self.data.get(stream) or []
+        ms = next(self._ids)
+        if entries:
+            ms = max(ms, _stream_id(entries[-1][0])[0] + 1)
+        return f"{ms}-0"
+
+    async def xadd(self, stream, fields, id="*", maxlen=None, approximate=True, minid=None):
+        entries = self._stream(stream)
+        message_id = self._next_id(stream) if id == "*" else id
+        entries.append((message_id, dict(fields)))
+        if maxlen:
+            del entries[:max(0, len(entries) - maxlen)]
+        return message_id
+
+    async def xlen(self, stream):
+        return len(self.data.get(stream, []))
+
+    async def memory_usage(self, key):
+        # Память не моделируется
+        return None
+
+    def _between(self, stream, low: str, high: str):
+        (lo, lo_exclusive), (hi, hi_exclusive) = _range_bound(low, True), _range_bound(high, False)
+        result = []
+        for message_id, fields in self.data.get(stream, []):
+            key = _stream_id(message_id)
+            if key < lo or (lo_exclusive and key == lo):
+                continue
+            if key > hi or (hi_exclusive and key == hi):
+                continue
+            result.append((message_id, dict(fields)))
+        return result
+
+    async def xrange(self, stream, min="-", max="+", count=None):
+        return self._between(stream, min, max)[:count]
+
+    async def xrevrange(self, stream, max="+", min="-", count=None):
+        return list(reversed(self._between(stream, min, max)))[:count]
+
+    async def xdel(self, stream, *ids):
+        entries = self.data.get(stream, [])
+        before = len(entries)
+        entries[:] = [entry for entry in entries if entry[0] not in ids]
+        return before - len(entries)
+
+    async def xtrim(self, stream, maxlen=None, minid=None, approximate=True):
+        entries = self.data.get(stream, [])
+        before = len(entries)
+        if minid is not None:
+            entries[:] = [e for e in entries if _stream_id(e[0]) >= _stream_id(minid)]
+        if maxlen is not None:
+            del entries[:max(0, len(entries) - maxlen)]
+        return before - len(entries)
+
+    async def xread(self, streams, count=None, block=None):
+        (stream, last_id), = streams.items()
+        if last_id == "$":
+            last_id = self.data[stream][-1][0] if self.data.get(stream) else "0-0"
+        entries = self._between(stream, f"({last_id}", "+")[:count]
+        if not entries:
+            # XREAD BLOCK: уступаем циклу событий вместо ожидания
+            await asyncio.sleep(0.001)
+        return [(stream, entries)] if entries else []
+
+    async def xgroup_create(self, stream, group, id="$", mkstream=False):
+        groups = self.groups.setdefault(stream, {})
+        if group in groups:
+            raise ResponseError("BUSYGROUP Consumer Group name already exists")
+        if mkstream:
+            self._stream(stream)
+        if id == "$":
+            id = self.data[stream][-1][0] if self.data.get(stream) else "0-0"
+        groups[group] = {"last_delivered": id, "pending": {}}
+        return True
+
+    def _group(self, stream, group):
+        try:
+            return self.groups[stream][group]
+        except KeyError:
+            raise ResponseError(f"NOGROUP No such key '{stream}' or consumer group '{group}'")
+
+    def _deliver(self, state, message_id, consumer):
+        entry = state["pending"].setdefault(message_id, {"times_delivered": 0})
+        entry["consumer"] = consumer
+        entry["times_delivered"] += 1
+        entry["delivered_at"] = self.clock()
+
+    async def xreadgroup(self, group, consumer, streams, count=None, block=None, noack=False):
+        (stream, last_id), = streams.items()
+        state = self._group(stream, group)
+        if last_id != ">":
+            raise NotImplementedError("Поддерживается только чтение новых сообщений")
+        entries = self._between(stream, f"({state['last_delivered']}", "+")[:count]
+        if not entries:
+            await asyncio.sleep(0.001)
+            return []
+        for message_id, _ in entries:
+            self._deliver(state, message_id, consumer)
+        state["last_delivered"] = entries[-1][0]
+        return [(stream, entries)]
+
+    async def xack(self, stream, group, *ids):
+        pending = self._group(stream, group)["pending"]
+        return sum(pending.pop(message_id, None) is not None for message_id in ids)
+
+    async def xpending_range(self, stream, group, min, max, count, consumername=None):
+        pending = self._group(stream, group)["pending"]
+        lo, hi = _stream_id(min) if min != "-" else (-1, -1), _stream_id(max) if max != "+" else (float("inf"), 0)
+        result = []
+        for message_id in sorted(pending, key=_stream_id):
+            if lo <= _stream_id(message_id) <= hi:
+                info = pending[message_id]
+                result.append({
+                    "message_id": message_id,
+                    "consumer": info["consumer"],
+                    "time_since_delivered": int((self.clock() - info["delivered_at"]) * 1000),
+                    "times_delivered": info["times_delivered"],
+                })
+        return result[:count]
+
+    async def xpending(self, stream, group):
+        pending = self._group(stream, group)["pending"]
+        ids = sorted(pending, key=_stream_id)
+        return {
+            "pending": len(ids),
+            "min": ids[0] if ids else None,
+            "max": ids[-1] if ids else None,
+        }
+
+    async def xautoclaim(self, stream, group, consumer, min_idle_time, start_id="0-0", count=100):
+        state = self._group(stream, group)
+        entries = {message_id: fields for message_id, fields in self.data.get(stream, [])}
+        claimed, deleted = [], []
+        for message_id in sorted(state["pending"], key=_stream_id):
+            if _stream_id(message_id) < _stream_id(start_id) or len(claimed) + len(deleted) >= count:
+                continue
+            info = state["pending"][message_id]
+            if (self.clock() - info["delivered_at"]) * 1000 < min_idle_time:
+                continue
+            if message_id not in entries:
+                del state["pending"][message_id]
+                deleted.append(message_id)
+                continue
+            self._deliver(state, message_id, consumer)
+            claimed.append((message_id, dict(entries[message_id])))
+        return ["0-0", claimed, deleted]
+
+    async def xinfo_groups(self, stream):
+        entries = self.data.get(stream, [])
+        result = []
+        for name, state in self.groups.get(stream, {}).items():
+            lag = len(self._between(stream, f"({state['last_delivered']}", "+"))
+            result.append({
+                "name": name,
+                "last-delivered-id": state["last_delivered"],
+                "pending": len(state["pending"]),
+                "lag": lag,
+                "entries-read": len(entries) - lag,
+            })
+        return result
+
+
+# MongoDB
+
+
+def _get(doc, path):
+    for part in path.split("."):
+        if not isinstance(doc, dict) or part not in doc:
+            return None
+        doc = doc[part]
+    return doc
+
+
+def _matches_value(value, condition) -> bool:
+    if isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition):
+        for op, operand in condition.items():
+            if op == "$eq" and value != operand:
+                return False
+            if op == "$ne" and value == operand:
+                return False
+            if op == "$in" and value not in operand:
+                return False
+            if op == "$gt" and not (value is not None and value > operand):
+                return False
+            if op == "$gte" and not (value is not None and value >= operand):
+                return False
+            if op == "$lt" and not (value is not None and value < operand):
+                return False
+            if op == "$lte" and not (value is not None and value <= operand):
+                return False
+            if op == "$type" and operand == "string" and not isinstance(value, str):
+                return False
+            if op == "$regex" and not (isinstance(value, str) and re.search(operand, value)):
+                return False
+        return True
+    return value == condition
+
+
+def matches(doc: Dict[str, Any], query: Dict[str, Any]) -> bool:
+    """Подмножество языка запросов MongoDB, которое использует сервис"""
+    for key, condition in (query or {}).items():
+        if key == "$and":
+            if not all(matches(doc, sub) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(doc, sub) for sub in condition):
+                return False
+        elif not _matches_value(_get(doc, key), condition):
+            return False
+    return True
+
+
+def _project(doc, projection):
+    if not projection:
+        return dict(doc)
+    included = {key for key, flag in projection.items() if flag}
+    if included:
+        result = {key: doc[key] for key in included if key in doc}
+        if projection.get("_id", 1) and "_id" in doc:
+            result["_id"] = doc["_id"]
+        return result
+    return {key: value for key, value in doc.items() if key not in projection}
+
+
+class FakeCursor:
+    def __init__(self, collection: "FakeCollection", docs: List[Dict[str, Any]]):
+        self.collection = collection
+        self.docs = docs
+        self.sort_keys: List[tuple] = []
+        self.limit_value: Optional[int] = None
+
+    def sort(self, key, direction=None):
+        keys = [(key, direction or 1)] if isinstance(key, str) else list(key)
+        self.sort_keys = keys
+        for field, order in reversed(keys):
+            self.docs.sort(key=lambda doc: _get(doc, field), reverse=order < 0)
+        return self
+
+    def limit(self, value: int):
+        self.limit_value = value or None
+        return self
+
+    async def to_list(self, length=None):
+        limit = min(filter(None, (self.limit_value, length)), default=None)
+        return self.docs[:limit]
+
+    def __aiter__(self):
+        async def iterate():
+            for doc in await self.to_list():
+                yield doc
+        return iterate()
+
+
+class FakeCollection:
+    """Коллекция Motor в памяти.
+
+    batches - размеры insert_many, writes - пачки bulk_write, queries -
+    число find; fail - исключение для следующих записей; документ с
+    idempotency_key из duplicate_keys отклоняется как дубликат.
+    """
+
+    def __init__(self, name: str = "events", db: Optional["FakeDb"] = None):
+        self.name = name
+        self.database = db
+        self.docs: List[Dict[str, Any]] = []
+        self.batches: List[int] = []
+        self.writes: List[list] = []
+        self.queries = 0
+        self.fail: Optional[Exception] = None
+        self.duplicate_keys = set()
+        self.indexes: Dict[str, Dict[str, Any]] = {"_id_": {"key": [("_id", 1)]}}
+
+    def _check(self):
+        if self.fail is not None:
+            raise self.fail
+
+    def _is_duplicate(self, doc) -> bool:
+        if any(other.get("_id") == doc["_id"] for other in self.docs):
+            return True
+        key = doc.get("idempotency_key")
+        return key is not None and (key in self.duplicate_keys or any(
+            other.get("idempotency_key") == key for other in self.docs
+        ))
+
+    async def insert_one(self, doc):
+        self._check()
+        doc.setdefault("_id", ObjectId())
+        if self._is_duplicate(doc):
+            raise DuplicateKeyError("E11000 duplicate key error", 11000)
+        self.docs.append(doc)
+        return InsertOneResult(doc["_id"], acknowledged=True)
+
+    async def insert_many(self, docs, ordered=True, session=None):
+        self._check()
+        self.batches.append(len(docs))
+        errors = []
+        for i, doc in enumerate(docs):
+            doc.setdefault("_id", ObjectId())
+            if self._is_duplicate(doc):
+                errors.append({"index": i, "code": 11000, "errmsg": "E11000 duplicate key error"})
+                if ordered:
+                    break
+            else:
+                self.docs.append(doc)
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(docs) - len(errors)})
+
+    def find(self, query=None, projection=None, session=None):
+        self.queries += 1
+        found = [_project(doc, projection) for doc in self.docs if matches(doc, query)]
+        return FakeCursor(self, found)
+
+    async def find_one(self, query=None, projection=None):
+        self.queries += 1
+        for doc in self.docs:
+            if matches(doc, query):
+                return _project(doc, projection)
+        return None
+
+    async def update_many(self, query, update):
+        self._check()
+        modified = 0
+        for doc in self.docs:
+            if matches(doc, query):
+                doc.update(update.get("$set", {}))
+                modified += 1
+        return modified
+
+    async def update_one(self, query, update, upsert=False):
+        self._check()
+        for doc in self.docs:
+            if matches(doc, query):
+                doc.update(update.get("$set", {}))
+                return
+        if upsert:
+            self.docs.append({**query, **update.get("$set", {})})
+
+    async def bulk_write(self, ops, ordered=True, session=None):
+        self._check()
+        self.writes.append(ops)
+        for op in ops:
+            if isinstance(op, UpdateOne):
+                self._apply_update(op._filter, op._doc, op._upsert)
+
+    def _apply_update(self, query, update, upsert):
+        """$inc/$set одного документа, с upsert"""
+        doc = next((doc for doc in self.docs if matches(doc, query)), None)
+        if doc is None:
+            if not upsert:
+                return
+            doc = {"_id": ObjectId(), **query}
+            self.docs.append(doc)
+        for field, value in update.get("$inc", {}).items():
+            doc[field] = doc.get(field, 0) + value
+        doc.update(update.get("$set", {}))
+
+    async def count_documents(self, query):
+        return sum(matches(doc, query) for doc in self.docs)
+
+    async def index_information(self):
+        return {name: dict(spec) for name, spec in self.indexes.items()}
+
+    async def create_indexes(self, models):
+        names = []
+        for model in models:
+            document = model.document
+            self.indexes[document["name"]] = {"key": list(document["key"].items())}
+            names.append(document["name"])
+        return names
+
+    async def create_index(self, keys, name=None, **kwargs):
+        keys = [(keys, 1)] if isinstance(keys, str) else list(keys)
+        name = name or "_".join(f"{field}_{order}" for field, order in keys)
+        self.indexes[name] = {"key": keys}
+        return name
+
+
+class FakeSession:
+    """Сессия Motor: транзакция откатывает документы всех коллекций при ошибке"""
+
+    def __init__(self, db: "FakeDb"):
+        self.db = db
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def with_transaction(self, callback):
+        if not self.db.transactions:
+            raise OperationFailure(
+                "Transaction numbers are only allowed on a replica set member or mongos", code=20
+            )
+        snapshot = {name: copy.deepcopy(c.docs) for name, c in self.db.collections.items()}
+        try:
+            return await callback(self)
+        except BaseException:
+            for name, collection in list(self.db.collections.items()):
+                collection.docs = snapshot.get(name, [])
+            raise
+
+
+class FakeClient:
+    def __init__(self, db: "FakeDb"):
+        self.db = db
+
+    async def start_session(self):
+        return FakeSession(self.db)
+
+
+class FakeDb:
+    """База Motor: коллекции создаются при первом обращении.
+
+    transactions - поддерживает ли "сервер" транзакции (replica set)
+    """
+
+    def __init__(self, transactions: bool = False):
+        self.collections: Dict[str, FakeCollection] = {}
+        self.transactions = transactions
+        self.client = FakeClient(self)
+
+    def __getitem__(self, name) -> FakeCollection:
+        if name not in self.collections:
+            self.collections[name] = FakeCollection(name, self)
+        return self.collections[name]
+
+    async def list_collection_names(self):
+        return list(self.collections)
+
+    async def drop_collection(self, name):
+        self.collections.pop(name, None)
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def fake_redis(clock):
+    return FakeRedis(clock)
+
+
+@pytest.fixture
+def fake_db():
+    return FakeDb()
+
+
+@pytest.fixture
+def fake_collection(fake_db):
+    return fake_db["events"]
+
+
+@pytest_asyncio.fixture
+async def api(monkeypatch, fake_redis, fake_collection):
+    """HTTP-клиент приложения поверх заглушек MongoDB и Redis"""
+    import httpx
+
+    from app.db import mongo
+    from app.db import redis as redis_module
+    from app.db.dedup import IdempotencyCache
+    from app.graphql import schema as graphql_schema
+    from app.main import app
+
+    monkeypatch.setattr(redis_module, "r", fake_redis)
+    monkeypatch.setattr(graphql_schema, "r", fake_redis)
+    monkeypatch.setattr(mongo, "collection", fake_collection)
+    monkeypatch.setattr(mongo, "events", fake_collection)
+    monkeypatch.setattr(mongo, "idempotency", IdempotencyCache(fake_redis))
+    monkeypatch.setattr(mongo, "COALESCE_ENABLED", False)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
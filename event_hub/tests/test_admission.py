@@ -0,0 +1,86 @@
+import asyncio
+import pytest
+
+from app.admission import AdmissionController, Overloaded, TokenBuckets
+
+
+@pytest.mark.asyncio
+async def test_excess_requests_rejected_fast():
+    """Сверх лимита и очереди запросы сразу получают Overloaded"""
+    controller = AdmissionController(
+        max_in_flight=2, min_in_flight=1, max_queue=1, queue_timeout=0.05,
+        latency_source=lambda: (0.0, 0.0)
+    )
+    release = asyncio.Event()
+    outcomes = []
+
+    async def request():
+        try:
+            async with controller.admit():
+                await release.wait()
+            outcomes.append("ok")
+        except Overloaded as e:
+            outcomes.append(e.reason)
+
+    tasks = [asyncio.create_task(request()) for _ in range(4)]
+    await asyncio.sleep(0.01)
+    assert outcomes == ["queue_full"]
+
+    # Ожидающий в очереди не дождался слота
+    await asyncio.sleep(0.08)
+    assert outcomes == ["queue_full", "queue_timeout"]
+
+    release.set()
+    await asyncio.gather(*tasks)
+    assert outcomes.count("ok") == 2
+    assert controller.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_limit_follows_mongo_latency(clock):
+    """Рост задержки MongoDB снижает лимит, норма - возвращает его"""
+    totals = [0.0, 0.0]
+    controller = AdmissionController(
+        max_in_flight=100, min_in_flight=10, latency_target=0.05,
+        latency_source=lambda: tuple(totals), clock=clock
+    )
+
+    # 100 операций по 200 мс: лимит падает в 4 раза
+    totals[:] = [20.0, 100.0]
+    clock.now = 1.0
+    async with controller.admit():
+        pass
+    assert controller.limit == 25
+
+    # Задержка в норме: аддитивный рост
+    totals[:] = [21.0, 200.0]
+    clock.now = 2.0
+    async with controller.admit():
+        pass
+    assert controller.limit == 27
+
+
+def test_tenant_bucket_retry_after(clock):
+    buckets = TokenBuckets(rate=10, burst=5, clock=clock)
+
+    assert buckets.take("acme", 5) == 0
+    assert buckets.take("acme", 1) == pytest.approx(0.1)
+    # Другой арендатор не затронут
+    assert buckets.take("globex", 1) == 0
+
+    clock.now = 0.5
+    assert buckets.take("acme", 5) == 0
+
+
+@pytest.mark.asyncio
+async def test_tenant_over_rate_rejected():
+    controller = AdmissionController(
+        tenant_buckets=TokenBuckets(rate=1, burst=1), latency_source=lambda: (0.0, 0.0)
+    )
+    async with controller.admit("acme"):
+        pass
+    with pytest.raises(Overloaded) as exc:
+        async with controller.admit("acme"):
+            pass
+    assert exc.value.reason == "tenant_rate"
+    assert exc.value.retry_after_header == "1"
@@ -1,81 +1,152 @@
 import pytest
-import asyncio
-from httpx import AsyncClient
 from datetime import datetime
-from app.main import app
+
+import orjson
+
+from app.queue.codec import decode_event
+
+
+def event_data(user_id="test_user", amount=100.50, **overrides):
+    data = {
+        "user_id": user_id,
+        "event_type": "purchase",
+        "amount": amount,
+        "timestamp": datetime.now().isoformat()
+    }
+    data.update(overrides)
+    return data
+
+
+async def published(fake_redis):
+    return [decode_event(fields) for _, fields in await fake_redis.xrange("events")]
+
 
 @pytest.mark.asyncio
-async def test_create_event():
+async def test_create_event(api, fake_collection, fake_redis):
     """Тест создания события через REST API"""
-    async with AsyncClient(app=app, base_url="http://test") as ac:
-        event_data = {
-            "user_id": "test_user",
-            "event_type": "purchase",
-            "amount": 100.50,
-            "timestamp": datetime.now().isoformat()
-        }
-        
-        response = await ac.post("/events", json=event_data)
-        
-        assert response.status_code == 200
-        data = response.json()
-        assert "id" in data
-        assert data["status"] == "success"
+    response = await api.post("/events", json=event_data())
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["status"] == "success"
+    assert data["id"] == str(fake_collection.docs[0]["_id"])
+    assert [event["event_id"] for event in await published(fake_redis)] == [data["id"]]
+
 
 @pytest.mark.asyncio
-async def test_create_event_invalid_data():
+async def test_create_event_invalid_data(api, fake_collection):
     """Тест создания события с некорректными данными"""
-    async with AsyncClient(app=app, base_url="http://test") as ac:
-        event_data = {
-            "user_id": "test_user",
-            # Отсутствует обязательное поле event_type
-            "amount": 100.50
-        }
-        
-        response = await ac.post("/events", json=event_data)
-        
-        assert response.status_code == 422  # Validation error
+    event = event_data()
+    # Отсутствует обязательное поле event_type
+    del event["event_type"]
+
+    response = await api.post("/events", json=event)
+
+    assert response.status_code == 422  # Validation error
+    assert fake_collection.docs == []
+
 
 @pytest.mark.asyncio
-async def test_graphql_query():
+async def test_graphql_query(api):
     """Тест GraphQL запроса"""
-    async with AsyncClient(app=app, base_url="http://test") as ac:
-        query = """
-        query {
-            lastEvents(limit: 5) {
-                id
-                userId
-                eventType
-                amount
-                timestamp
-            }
+    await api.post("/events", json=event_data(amount=7.0))
+    query = """
+    query {
+        lastEvents(limit: 5) {
+            id
+            userId
+            eventType
+            amount
+            timestamp
         }
-        """
-        
-        response = await ac.post("/graphql", json={"query": query})
-        
-        assert response.status_code == 200
-        data = response.json()
-        assert "data" in data
-        assert "lastEvents" in data["data"]
+    }
+    """
+
+    response = await api.post("/graphql", json={"query": query})
+
+    assert response.status_code == 200
+    (event,) = response.json()["data"]["lastEvents"]
+    assert (event["userId"], event["eventType"], event["amount"]) == ("test_user", "purchase", 7.0)
+
 
 @pytest.mark.asyncio
-async def test_aggregated_metrics():
+async def test_aggregated_metrics(api):
     """Тест агрегированных метрик"""
-    async with AsyncClient(app=app, base_url="http://test") as ac:
-        query = """
-        query {
-            aggregatedMetrics(minutes: 1) {
-                totalAmount
-                eventCount
-                timeWindow
-            }
+    query = """
+    query {
+        aggregatedMetrics(minutes: 1) {
+            totalAmount
+            eventCount
+            timeWindow
         }
-        """
-        
-        response = await ac.post("/graphql", json={"query": query})
-        
-        assert response.status_code == 200
-        data = response.json()
-        assert "data" in data
-        assert "aggregatedMetrics" in data["data"] 
\ No newline at end of file
+    }
+    """
+
+    response = await api.post("/graphql", json={"query": query})
+
+    assert response.status_code == 200
+    assert response.json()["data"]["aggregatedMetrics"] == {
+        "totalAmount": 0.0, "eventCount": 0, "timeWindow": "last_1_minutes"
+    }
+
+
+def invalid_event():
+    event = event_data(amount=5.0)
+    # Отсутствует обязательное поле event_type
+    del event["event_type"]
+    return event
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("content_type", ["application/json", "application/x-ndjson"])
+async def test_create_events_batch(api, fake_collection, fake_redis, content_type):
+    """Тест пакетного создания событий с частичной ошибкой: JSON-массив и NDJSON"""
+    batch = [event_data(amount=10.0), invalid_event(), event_data(user_id="other", amount=2.5)]
+    if content_type == "application/json":
+        body = orjson.dumps(batch)
+    else:
+        body = b"\n".join(orjson.dumps(item) for item in batch) + b"\n"
+
+    response = await api.post("/events/batch", content=body, headers={"content-type": content_type})
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["status"] == "partial"
+    assert (data["accepted"], data["rejected"], data["published"]) == (2, 1, True)
+    assert [result["status"] for result in data["results"]] == ["success", "error", "success"]
+    ids = [data["results"][0]["id"], data["results"][2]["id"]]
+
+    # Валидные события сохранены одним insert_many и опубликованы одним pipeline XADD
+    assert fake_collection.batches == [2]
+    assert ["xadd", "xadd"] in fake_redis.executed
+    assert [(event["event_id"], event["amount"]) for event in await published(fake_redis)] == [
+        (ids[0], 10.0), (ids[1], 2.5)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_create_events_batch_ndjson_bad_line(api, fake_collection):
+    """Битая строка NDJSON отклоняет только себя, как невалидный элемент массива"""
+    body = b"\n".join([
+        orjson.dumps(event_data(amount=1.0)), b'{"user_id": "u", "amount":', orjson.dumps(event_data(amount=3.0))
+    ]) + b"\n"
+
+    response = await api.post("/events/batch", content=body, headers={"content-type": "application/x-ndjson"})
+
+    assert response.status_code == 200
+    data = response.json()
+    assert (data["status"], data["accepted"], data["rejected"]) == ("partial", 2, 1)
+    bad = data["results"][1]
+    assert (bad["index"], bad["status"], bad["error"][0]["type"]) == (1, "error", "json_invalid")
+    assert [doc["amount"] for doc in fake_collection.docs] == [1.0, 3.0]
+
+
+@pytest.mark.asyncio
+async def test_create_events_batch_rejects_bad_body(api):
+    response = await api.post("/events/batch", content=b'{"user_id": "u"}',
+                              headers={"content-type": "application/json"})
+    assert response.status_code == 400
+
+    response = await api.post("/events/batch", content=b"",
+                              headers={"content-type": "application/x-ndjson"})
+    assert response.status_code == 400
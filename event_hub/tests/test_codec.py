@@ -0,0 +1,71 @@
+import os
+import subprocess
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from app.queue import codec
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def _event():
+    return {
+        "user_id": "user_1",
+        "event_type": "purchase",
+        "amount": 12.5,
+        "timestamp": datetime(2024, 5, 1, 12, 30, 15, 123456),
+    }
+
+
+def test_binary_roundtrip_through_surrogateescape():
+    """Бинарная запись переживает чтение клиентом с decode_responses"""
+    fields = codec.encode_event("abc", _event())
+    payload = fields[codec.PAYLOAD_FIELD]
+    assert isinstance(payload, bytes)
+
+    # Так значение возвращает redis-клиент с encoding_errors="surrogateescape"
+    as_read = {codec.PAYLOAD_FIELD: payload.decode("utf-8", "surrogateescape")}
+
+    assert codec.decode_event(as_read) == {"event_id": "abc", **_event()}
+
+
+def test_legacy_string_fields():
+    """Записи прежнего формата по-прежнему читаются"""
+    fields = {
+        "event_id": "abc",
+        "user_id": "user_1",
+        "event_type": "purchase",
+        "amount": "12.5",
+        "timestamp": "2024-05-01T12:30:15.123456",
+    }
+
+    assert codec.decode_event(fields) == {"event_id": "abc", **_event()}
+
+
+def test_timestamp_us_is_exact_integer():
+    ts = datetime(2026, 1, 1, 22, 30, 0, 999999)
+    assert codec.to_timestamp_us(ts) == 1_767_306_600_999_999
+    assert codec.from_timestamp_us(codec.to_timestamp_us(ts)) == ts
+
+
+def test_aware_timestamp_converted_to_utc():
+    ts = datetime(2026, 1, 2, 1, 30, tzinfo=timezone(timedelta(hours=3)))
+    assert codec.to_timestamp_us(ts) == codec.to_timestamp_us(datetime(2026, 1, 1, 22, 30))
+
+
+def test_naive_timestamps_are_utc_under_non_utc_tz():
+    """Декодирование не зависит от TZ процесса: наивное время - UTC, как в BSON"""
+    script = (
+        "from datetime import datetime\n"
+        "from app.queue import codec\n"
+        "ts = datetime(2026, 1, 1, 22, 30)\n"
+        "fields = codec.encode_event('abc', {'user_id': 'u', 'event_type': 'purchase',"
+        " 'amount': 1.0, 'timestamp': ts})\n"
+        "assert codec.to_timestamp_us(ts) == 1_767_306_600_000_000\n"
+        "assert codec.decode_event(fields)['timestamp'] == ts, codec.decode_event(fields)\n"
+    )
+    env = {**os.environ, "TZ": "Europe/Moscow"}
+    result = subprocess.run([sys.executable, "-c", script], env=env, cwd=ROOT,
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,50 @@
+import pytest
+from types import SimpleNamespace
+from pymongo.monitoring import ConnectionCheckOutFailedReason
+
+from app.db import connections
+from app.db.mongo import PoolMetricsListener
+from app.metrics.prometheus_metrics import db_pool_connections, db_pool_wait_timeouts_total
+
+
+def test_mongo_pool_listener_tracks_usage():
+    """Загрузка пула MongoDB считается по событиям драйвера"""
+    listener = PoolMetricsListener()
+    event = SimpleNamespace(reason=None)
+
+    for _ in range(3):
+        listener.connection_created(event)
+    listener.connection_checked_out(event)
+    listener.connection_checked_out(event)
+    listener.connection_checked_in(event)
+
+    assert (listener.open, listener.in_use) == (3, 1)
+    assert db_pool_connections.labels(pool="mongo", state="in_use")._value.get() == 1
+    assert db_pool_connections.labels(pool="mongo", state="idle")._value.get() == 2
+
+    timeouts = db_pool_wait_timeouts_total.labels(pool="mongo")._value.get()
+    listener.connection_check_out_failed(SimpleNamespace(reason=ConnectionCheckOutFailedReason.TIMEOUT))
+    assert db_pool_wait_timeouts_total.labels(pool="mongo")._value.get() == timeouts + 1
+
+
+@pytest.mark.asyncio
+async def test_health_reports_unreachable_dependency(monkeypatch):
+    """Недоступное хранилище переводит статус в degraded"""
+    async def failing_ping():
+        raise ConnectionError("connection refused")
+
+    async def ok_command(name):
+        return {"ok": 1}
+
+    monkeypatch.setattr(connections.r, "ping", failing_ping)
+    monkeypatch.setattr(connections, "client", SimpleNamespace(admin=SimpleNamespace(command=ok_command)))
+
+    report = await connections.check_health()
+
+    assert report["status"] == "degraded"
+    assert report["mongo"]["status"] == "ok"
+    assert report["redis"] == {
+        "status": "error",
+        "error": "connection refused",
+        "pool": connections.redis_pool_stats(),
+    }
@@ -0,0 +1,68 @@
+import pytest
+from bson import ObjectId
+
+from app.db.dedup import DuplicateEvent, IdempotencyCache, idempotency_redis_key
+
+
+@pytest.mark.asyncio
+async def test_retry_returns_original_id(fake_redis):
+    """Повтор ключа отдаёт id первой записи; пачка - один round trip"""
+    redis = fake_redis
+    cache = IdempotencyCache(redis)
+
+    first = [{"idempotency_key": "a"}, {"idempotency_key": "b"}, {"amount": 1}]
+    assert await cache.claim(first) == {}
+    assert redis.round_trips == 1
+    assert "_id" not in first[2]
+
+    retry = [{"idempotency_key": "a"}]
+    duplicates = await cache.claim(retry)
+    assert isinstance(duplicates[0], DuplicateEvent)
+    assert duplicates[0].inserted_id == first[0]["_id"]
+    # Попадание в LRU не обращается к Redis
+    assert redis.round_trips == 1
+
+
+@pytest.mark.asyncio
+async def test_key_claimed_by_other_process(fake_redis):
+    """Ключ, занятый другим процессом, находится через Redis"""
+    redis = fake_redis
+    original = ObjectId()
+    redis.data[idempotency_redis_key("k")] = str(original)
+
+    docs = [{"idempotency_key": "k"}, {"idempotency_key": "n"}, {"idempotency_key": "n"}]
+    duplicates = await IdempotencyCache(redis).claim(docs)
+
+    assert duplicates[0].inserted_id == original
+    assert duplicates[2].inserted_id == docs[1]["_id"]
+    assert set(duplicates) == {0, 2}
+
+
+@pytest.mark.asyncio
+async def test_release_allows_retry_after_failed_write(fake_redis):
+    cache = IdempotencyCache(fake_redis)
+    docs = [{"idempotency_key": "x"}]
+    await cache.claim(docs)
+
+    await cache.release(docs)
+
+    assert await cache.claim([{"idempotency_key": "x"}]) == {}
+
+
+@pytest.mark.asyncio
+async def test_replayed_request_reports_duplicate(api, fake_collection, fake_redis):
+    """Повтор того же тела с тем же ключом не создаёт второе событие"""
+    payload = {
+        "user_id": "u1",
+        "event_type": "purchase",
+        "amount": 10.0,
+        "timestamp": "2024-05-10T12:00:00",
+        "idempotency_key": "retry-1",
+    }
+    first = (await api.post("/events", json=payload)).json()
+    replay = (await api.post("/events", json=payload)).json()
+
+    assert "duplicate" not in first
+    assert replay == {"status": "success", "id": first["id"], "duplicate": True}
+    assert len(fake_collection.docs) == 1
+    assert await fake_redis.xlen("events") == 1
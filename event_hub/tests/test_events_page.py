@@ -0,0 +1,102 @@
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+from graphql import GraphQLError
+
+from app.db import mongo
+from app.graphql import schema as graphql_schema
+from app.graphql.schema import decode_cursor, encode_cursor
+
+T0 = datetime(2024, 1, 1, 12, 0, 0)
+
+PAGE_QUERY = """
+query Page($limit: Int!, $after: String) {
+  eventsPage(limit: $limit, after: $after) {
+    events { id amount cursor }
+    nextCursor
+    hasMore
+  }
+}
+"""
+
+
+@pytest.fixture
+def events(monkeypatch, fake_collection):
+    monkeypatch.setattr(mongo, "PARTITIONED", False)
+    monkeypatch.setattr(mongo, "collection", fake_collection)
+    # Пять событий с одним timestamp и два старше: порядок задаёт _id
+    for i in range(7):
+        timestamp = T0 if i >= 2 else T0 - timedelta(seconds=10 - i)
+        fake_collection.docs.append({
+            "_id": ObjectId(), "user_id": f"u{i}", "event_type": "purchase",
+            "amount": float(i), "timestamp": timestamp
+        })
+    return fake_collection
+
+
+async def execute(query, **variables):
+    return await graphql_schema.schema.execute(query, variable_values=variables)
+
+
+def test_cursor_round_trip():
+    event_id = ObjectId()
+    assert decode_cursor(encode_cursor(T0, event_id)) == (T0, event_id)
+
+
+@pytest.mark.parametrize("cursor", ["not-base64!", "bm8tc2VwYXJhdG9y", encode_cursor(T0, "not-an-id")])
+def test_bad_cursor_rejected(cursor):
+    with pytest.raises(GraphQLError) as exc:
+        decode_cursor(cursor)
+    assert exc.value.extensions == {"code": "BAD_USER_INPUT"}
+
+
+@pytest.mark.asyncio
+async def test_pages_split_equal_timestamps_without_gaps(events):
+    seen, after = [], None
+    while True:
+        result = await execute(PAGE_QUERY, limit=2, after=after)
+        assert result.errors is None
+        page = result.data["eventsPage"]
+        seen.extend(event["amount"] for event in page["events"])
+        if not page["hasMore"]:
+            assert page["nextCursor"] is None
+            break
+        after = page["nextCursor"]
+        assert after == page["events"][-1]["cursor"]
+
+    # Равные timestamp упорядочены по _id, ни одно событие не потеряно и не повторено
+    assert seen == [6.0, 5.0, 4.0, 3.0, 2.0, 1.0, 0.0]
+
+
+@pytest.mark.asyncio
+async def test_bad_cursor_is_graphql_error(events):
+    result = await execute(PAGE_QUERY, limit=2, after="garbage")
+    assert result.errors[0].message == "Invalid cursor"
+    assert result.errors[0].extensions == {"code": "BAD_USER_INPUT"}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("limit", [0, graphql_schema.MAX_PAGE_SIZE + 1])
+async def test_limit_out_of_range_is_error_not_clamped(events, limit):
+    result = await execute(PAGE_QUERY, limit=limit)
+    assert result.data is None
+    assert result.errors[0].extensions == {"code": "BAD_USER_INPUT"}
+    assert events.queries == 0
+
+
+@pytest.mark.asyncio
+async def test_projection_follows_requested_fields(events, monkeypatch):
+    projections = []
+
+    async def spy(limit, **kwargs):
+        projections.append(sorted(kwargs["projection"]))
+        return await mongo.get_events_page(limit, **kwargs)
+
+    monkeypatch.setattr(graphql_schema, "get_events_page", spy)
+    result = await execute("{ lastEvents(limit: 1) { amount } }")
+    assert result.errors is None
+    assert result.data["lastEvents"] == [{"amount": 6.0}]
+
+    await execute("{ eventsPage(limit: 1) { events { userId ... on Event { eventType } } hasMore } }")
+    assert projections == [["amount"], ["event_type", "user_id"]]
@@ -0,0 +1,86 @@
+import grpc
+import pytest
+import pytest_asyncio
+
+from app.auth import jwt_auth
+from app.auth.jwt_auth import GRPCAuthInterceptor, JWTAuthError, TokenCache, current_grpc_principal
+from app.grpc.server import METHOD_ROLES, EventServicer
+from protos import event_pb2, event_pb2_grpc
+
+TOKENS = {
+    "writer-token": {"sub": "acme", "role": "writer"},
+    "reader-token": {"sub": "acme", "role": "reader"},
+}
+
+
+class PrincipalServicer(EventServicer):
+    """Возвращает принципал, который видит обработчик"""
+
+    async def SendEvent(self, request, context):
+        return event_pb2.EventResponse(status="success", message=current_grpc_principal()["sub"])
+
+    async def StreamEvents(self, request, context):
+        for i in range(request.limit):
+            yield event_pb2.EventResponse(event_id=str(i), message=current_grpc_principal()["role"])
+
+
+@pytest.fixture
+def decoded(monkeypatch):
+    calls = []
+
+    def fake_decode(token):
+        calls.append(token)
+        if token not in TOKENS:
+            raise JWTAuthError("Недействительный токен")
+        return dict(TOKENS[token])
+
+    monkeypatch.setattr(jwt_auth, "_decode", fake_decode)
+    monkeypatch.setattr(jwt_auth, "token_cache", TokenCache(max_size=10, max_ttl=300))
+    return calls
+
+
+@pytest_asyncio.fixture
+async def stub():
+    server = grpc.aio.server(interceptors=[GRPCAuthInterceptor(METHOD_ROLES)])
+    event_pb2_grpc.add_EventServiceServicer_to_server(PrincipalServicer(), server)
+    port = server.add_insecure_port("127.0.0.1:0")
+    await server.start()
+    async with grpc.aio.insecure_channel(f"127.0.0.1:{port}") as channel:
+        yield event_pb2_grpc.EventServiceStub(channel)
+    await server.stop(0)
+
+
+def auth(token):
+    return (("authorization", f"Bearer {token}"),)
+
+
+@pytest.mark.asyncio
+async def test_unary_call_gets_principal(stub, decoded):
+    for _ in range(3):
+        response = await stub.SendEvent(event_pb2.EventRequest(), metadata=auth("writer-token"))
+        assert response.message == "acme"
+    # Подпись проверена один раз, дальше - кэш
+    assert decoded == ["writer-token"]
+
+
+@pytest.mark.asyncio
+async def test_stream_authorized_once(stub, decoded):
+    responses = [r async for r in stub.StreamEvents(event_pb2.StreamRequest(limit=5), metadata=auth("reader-token"))]
+    assert [r.message for r in responses] == ["reader"] * 5
+    assert decoded == ["reader-token"]
+
+
+@pytest.mark.asyncio
+async def test_rejects_missing_and_wrong_role(stub, decoded):
+    with pytest.raises(grpc.aio.AioRpcError) as exc:
+        await stub.SendEvent(event_pb2.EventRequest())
+    assert exc.value.code() == grpc.StatusCode.UNAUTHENTICATED
+
+    with pytest.raises(grpc.aio.AioRpcError) as exc:
+        await stub.SendEvent(event_pb2.EventRequest(), metadata=auth("reader-token"))
+    assert exc.value.code() == grpc.StatusCode.PERMISSION_DENIED
+
+    with pytest.raises(grpc.aio.AioRpcError) as exc:
+        async for _ in stub.StreamEvents(event_pb2.StreamRequest(limit=1), metadata=auth("bogus")):
+            pass
+    assert exc.value.code() == grpc.StatusCode.UNAUTHENTICATED
@@ -0,0 +1,62 @@
+import grpc
+import pytest
+import pytest_asyncio
+
+from client import grpc_client
+from client.grpc_client import EventClient
+from protos import event_pb2, event_pb2_grpc
+
+
+class FlakyServicer(event_pb2_grpc.EventServiceServicer):
+    """Первые failures вызовов SendEvent отвечают UNAVAILABLE"""
+
+    def __init__(self, failures=1):
+        self.failures = failures
+        self.keys = []
+
+    async def SendEvent(self, request, context):
+        self.keys.append(request.idempotency_key)
+        if len(self.keys) <= self.failures:
+            await context.abort(grpc.StatusCode.UNAVAILABLE, "restarting")
+        return event_pb2.EventResponse(event_id="saved", status="success")
+
+
+@pytest_asyncio.fixture
+async def server(monkeypatch):
+    monkeypatch.setattr(grpc_client, "RETRY_BACKOFF", 0)
+    servicer = FlakyServicer()
+    server = grpc.aio.server()
+    event_pb2_grpc.add_EventServiceServicer_to_server(servicer, server)
+    port = server.add_insecure_port("127.0.0.1:0")
+    await server.start()
+    servicer.port = port
+    yield servicer
+    await server.stop(0)
+
+
+@pytest_asyncio.fixture
+async def client(server):
+    client = EventClient("127.0.0.1", server.port)
+    await client.connect()
+    yield client
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_retry_reuses_idempotency_key(server, client):
+    assert await client.send_event("u1", "purchase", 10.0) == "saved"
+    # Повтор после UNAVAILABLE отправил то же событие с тем же ключом
+    assert len(server.keys) == 2
+    assert server.keys[0] and server.keys[0] == server.keys[1]
+
+    await client.send_event("u1", "purchase", 10.0)
+    assert server.keys[2] != server.keys[0]
+
+
+@pytest.mark.asyncio
+async def test_gives_up_after_retries(server, client):
+    server.failures = 10
+    with pytest.raises(grpc.aio.AioRpcError) as exc:
+        await client.send_event("u1", "purchase", 10.0, retries=2)
+    assert exc.value.code() == grpc.StatusCode.UNAVAILABLE
+    assert len(set(server.keys)) == 1 and len(server.keys) == 3
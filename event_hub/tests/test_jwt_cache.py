@@ -0,0 +1,54 @@
+import time
+
+import pytest
+
+from app.auth import jwt_auth
+from app.auth.jwt_auth import JWTAuthError, TokenCache
+
+
+@pytest.fixture
+def decoded(monkeypatch):
+    """Подсчёт проверок подписи вместо RSA"""
+    calls = []
+
+    def fake_decode(token):
+        calls.append(token)
+        if token == "bad":
+            raise JWTAuthError("Недействительный токен")
+        return {"sub": token, "exp": time.time() + 60}
+
+    monkeypatch.setattr(jwt_auth, "_decode", fake_decode)
+    monkeypatch.setattr(jwt_auth, "token_cache", TokenCache(max_size=2, max_ttl=300))
+    return calls
+
+
+def test_repeated_token_verified_once(decoded):
+    assert jwt_auth.verify_token("a")["sub"] == "a"
+    assert jwt_auth.verify_token("a")["sub"] == "a"
+    assert decoded == ["a"]
+
+
+def test_invalid_token_not_cached(decoded):
+    for _ in range(2):
+        with pytest.raises(JWTAuthError):
+            jwt_auth.verify_token("bad")
+    assert decoded == ["bad", "bad"]
+
+
+def test_cache_bounded_and_expires():
+    cache = TokenCache(max_size=2, max_ttl=300)
+    cache.put(b"1", {"sub": "1"})
+    cache.put(b"2", {"sub": "2"})
+    cache.put(b"3", {"sub": "3"})
+    assert cache.get(b"1", 0) is None
+    assert cache.get(b"3", 0) == {"sub": "3"}
+
+    cache.put(b"old", {"sub": "old", "exp": time.time() - 1})
+    assert cache.get(b"old", 0) is None
+
+
+def test_key_rotation_clears_cache():
+    cache = TokenCache(max_size=10, max_ttl=300)
+    cache.put(b"t", {"sub": "t"})
+    assert cache.get(b"t", 1) is None
+    assert cache.get(b"t", 1) is None
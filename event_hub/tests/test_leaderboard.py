@@ -0,0 +1,156 @@
+import pytest
+
+from app.db.leaderboard import (
+    LEADERBOARD_RETIRE_LOCK_KEY,
+    UserLeaderboard,
+    leaderboard_key,
+    top_users,
+    user_stats,
+)
+from app.graphql import schema as graphql_schema
+
+NOW = 1_700_000_000.0
+
+
+@pytest.fixture
+def board(fake_redis, clock):
+    clock.now = NOW
+    return UserLeaderboard(fake_redis, windows=(1, 5), clock=clock)
+
+
+@pytest.mark.asyncio
+async def test_top_users_ranked_by_amount(board):
+    await board.add([
+        ("alice", "purchase", 30.0, NOW),
+        ("bob", "purchase", 50.0, NOW),
+        ("alice", "purchase", 40.0, NOW),
+        ("carol", "view", 0.0, NOW),
+    ])
+
+    leaders = await top_users(board.redis, 5, "purchase", 10)
+    assert [(u["user_id"], u["total_amount"], u["event_count"], u["rank"]) for u in leaders] == [
+        ("alice", 70.0, 2, 1),
+        ("bob", 50.0, 1, 2),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_minute_leaves_short_window_but_stays_in_long(board, clock):
+    await board.add([("alice", "purchase", 10.0, NOW)])
+    clock.now = NOW + 60
+    await board.add([("bob", "purchase", 5.0, NOW + 60)])
+    await board.retire()
+
+    # В 1-минутном окне осталась только минута bob'а
+    assert await board.redis.zrevrange(
+        leaderboard_key(1, "purchase", "amount"), 0, -1, withscores=True
+    ) == [("bob", 5.0)]
+    stats = {s["minutes"]: s for s in await user_stats(board.redis, "alice", windows=(1, 5))}
+    assert stats[1]["total_amount"] == 0.0 and stats[1]["rank"] is None
+    assert stats[5] == {"minutes": 5, "total_amount": 10.0, "event_count": 1, "rank": 1}
+
+
+@pytest.mark.asyncio
+async def test_events_for_retired_minute_not_added_to_window(board, clock):
+    await board.load_state()
+    clock.now = NOW + 180
+    await board.retire()
+
+    # Запоздавшее событие старше 1-минутного окна попадает только в 5-минутное
+    await board.add([("alice", "purchase", 10.0, NOW)])
+    assert await board.redis.zscore(leaderboard_key(1, "purchase", "amount"), "alice") is None
+    assert await board.redis.zscore(leaderboard_key(5, "purchase", "amount"), "alice") == 10.0
+
+
+@pytest.mark.asyncio
+async def test_replicas_retire_each_minute_once(board, clock):
+    other = UserLeaderboard(board.redis, windows=(1, 5), clock=clock)
+    await board.add([("alice", "purchase", 10.0, NOW - 60)])
+    await board.add([("alice", "purchase", 7.0, NOW)])
+    await other.load_state()
+
+    clock.now = NOW + 60
+    assert await board.retire() > 0
+    # Кэш позиций второй реплики устарел, но она перечитывает их из Redis
+    assert await other.retire() == 0
+    assert await board.redis.zscore(leaderboard_key(5, "purchase", "amount"), "alice") == 17.0
+    assert await board.redis.zscore(leaderboard_key(1, "purchase", "amount"), "alice") is None
+
+
+@pytest.mark.asyncio
+async def test_retire_skipped_while_other_replica_holds_lock(board, clock):
+    await board.add([("alice", "purchase", 10.0, NOW)])
+    await board.redis.set(LEADERBOARD_RETIRE_LOCK_KEY, "other", nx=True, ex=30)
+    clock.now = NOW + 120
+    assert await board.retire() == 0
+    assert await board.redis.zscore(leaderboard_key(1, "purchase", "amount"), "alice") == 10.0
+
+
+@pytest.mark.asyncio
+async def test_negative_and_zero_totals_kept_while_user_has_events(board, clock):
+    clock.now = NOW - 60
+    await board.add([("alice", "refund", -25.0, NOW - 60), ("bob", "refund", 5.0, NOW - 60)])
+    clock.now = NOW
+    await board.add([("bob", "refund", -5.0, NOW)])
+    await board.retire()
+
+    # Минута NOW-60 вышла из 1-минутного окна: alice выпала, bob остался с нулём
+    assert await board.redis.zrevrange(
+        leaderboard_key(1, "refund", "amount"), 0, -1, withscores=True
+    ) == [("bob", -5.0)]
+    assert await board.redis.zrevrange(
+        leaderboard_key(5, "refund", "amount"), 0, -1, withscores=True
+    ) == [("bob", 0.0), ("alice", -25.0)]
+
+
+@pytest.mark.asyncio
+async def test_stale_replica_does_not_add_to_retired_window(board, clock):
+    other = UserLeaderboard(board.redis, windows=(1, 5), clock=clock)
+    await board.add([("alice", "purchase", 10.0, NOW)])
+    await other.add([("bob", "purchase", 1.0, NOW)])
+
+    clock.now = NOW + 60
+    assert await board.retire() > 0
+    # Кэш other всё ещё считает минуту NOW активной в 1-минутном окне
+    await other.add([("carol", "purchase", 5.0, NOW)])
+
+    one_minute = leaderboard_key(1, "purchase", "amount")
+    assert await board.redis.zrevrange(one_minute, 0, -1, withscores=True) == []
+    assert await board.redis.zscore(leaderboard_key(5, "purchase", "amount"), "carol") == 5.0
+
+
+@pytest.mark.asyncio
+async def test_add_retried_when_minute_retired_before_exec(board, clock, monkeypatch):
+    other = UserLeaderboard(board.redis, windows=(1, 5), clock=clock)
+    await board.add([("alice", "purchase", 10.0, NOW)])
+    clock.now = NOW + 60
+
+    redis = board.redis
+    mget = redis.mget
+    reads = []
+
+    async def retire_after_first_read(keys, *more):
+        values = await mget(keys, *more)
+        reads.append(values)
+        if len(reads) == 2:
+            # Первое чтение позиций в add() other: до EXEC вычитание
+            # выполняет другая реплика
+            await board.retire()
+        return values
+
+    monkeypatch.setattr(redis, "mget", retire_after_first_read)
+    await other.add([("carol", "purchase", 5.0, NOW)])
+
+    assert await redis.zrevrange(leaderboard_key(1, "purchase", "amount"), 0, -1, withscores=True) == []
+    assert await redis.zscore(leaderboard_key(5, "purchase", "amount"), "carol") == 5.0
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("n", [0, graphql_schema.MAX_TOP_USERS + 1])
+async def test_top_users_n_out_of_range_is_error_not_clamped(fake_redis, monkeypatch, n):
+    monkeypatch.setattr(graphql_schema, "r", fake_redis)
+    result = await graphql_schema.schema.execute(
+        "query($n: Int!) { topUsers(window: 5, n: $n) { userId } }", variable_values={"n": n}
+    )
+    assert result.data is None
+    assert result.errors[0].extensions == {"code": "BAD_USER_INPUT"}
@@ -0,0 +1,129 @@
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+from pymongo.errors import OperationFailure
+
+from app.db import redis as redis_module
+from app.queue.codec import decode_event
+from app.queue.outbox import OutboxRelay, RELAY_STATE_ID
+
+
+class StopRelay(BaseException):
+    """Останавливает relay: run() перехватывает только Exception"""
+
+
+class FakeChangeStream:
+    """Change stream вставок: каждая выдача вставляет документ в коллекцию.
+
+    None означает, что новых изменений пока нет; когда изменения кончились,
+    следующий try_next останавливает relay.
+    """
+
+    def __init__(self, collection, changes):
+        self.collection = collection
+        self.changes = list(changes)
+        self.resume_token = None
+        self.delivered = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def try_next(self):
+        if not self.changes:
+            raise StopRelay()
+        change = self.changes.pop(0)
+        if change is None:
+            return None
+        self.collection.docs.append(change)
+        self.delivered += 1
+        self.resume_token = {"_data": str(self.delivered)}
+        return {"operationType": "insert", "fullDocument": change}
+
+
+def event(i):
+    return {
+        "_id": ObjectId(), "user_id": f"u{i}", "event_type": "purchase", "amount": float(i),
+        "timestamp": datetime(2024, 1, 1, 12, 0, i), "published": False
+    }
+
+
+@pytest.fixture
+def relay(monkeypatch, fake_redis, fake_db):
+    monkeypatch.setattr(redis_module, "r", fake_redis)
+    return OutboxRelay(fake_db["events"], fake_db["outbox_state"], batch_size=2, max_delay=10)
+
+
+async def stream_amounts(redis):
+    return [decode_event(fields)["amount"] for _, fields in await redis.xrange("events")]
+
+
+@pytest.mark.asyncio
+async def test_drain_pending_publishes_in_batches_and_marks(relay, fake_redis):
+    relay.collection.docs.extend(event(i) for i in range(5))
+    relay.collection.docs.append({**event(9), "published": True})
+
+    assert await relay.drain_pending() == 5
+    # Пачки по batch_size: один pipeline XADD на пачку
+    assert [len(commands) for commands in fake_redis.executed] == [2, 2, 1]
+    assert await stream_amounts(fake_redis) == [0.0, 1.0, 2.0, 3.0, 4.0]
+    assert all(doc["published"] for doc in relay.collection.docs)
+    assert await relay.drain_pending() == 0
+
+
+@pytest.mark.asyncio
+async def test_change_stream_batches_and_saves_resume_token(relay, fake_redis, monkeypatch):
+    await relay.state_collection.update_one(
+        {"_id": RELAY_STATE_ID}, {"$set": {"resume_token": {"_data": "0"}}}, upsert=True
+    )
+    # Вставка до открытия stream'а подхватывается catch-up'ом
+    relay.collection.docs.append(event(0))
+    stream = FakeChangeStream(relay.collection, [event(1), event(2), event(3), None])
+    watched = {}
+
+    def watch(pipeline, resume_after=None, max_await_time_ms=None):
+        watched["resume_after"] = resume_after
+        return stream
+
+    monkeypatch.setattr(relay.collection, "watch", watch, raising=False)
+    with pytest.raises(StopRelay):
+        await relay.tail_change_stream()
+
+    # Продолжение с сохранённого токена
+    assert watched["resume_after"] == {"_data": "0"}
+    assert await stream_amounts(fake_redis) == [0.0, 1.0, 2.0, 3.0]
+    # Пачка режется по batch_size, остаток уходит, когда изменений нет
+    assert [len(commands) for commands in fake_redis.executed] == [1, 2, 1]
+    assert all(doc["published"] for doc in relay.collection.docs)
+
+    state = await relay.state_collection.find_one({"_id": RELAY_STATE_ID})
+    assert state["resume_token"] == {"_data": "3"}
+
+
+@pytest.mark.asyncio
+async def test_lost_resume_token_reset_and_stream_reopened(relay, fake_redis, monkeypatch):
+    await relay.state_collection.update_one(
+        {"_id": RELAY_STATE_ID}, {"$set": {"resume_token": {"_data": "expired"}}}, upsert=True
+    )
+    # Записано, пока relay стоял: в oplog этого уже нет
+    relay.collection.docs.append(event(0))
+    watched = []
+
+    def watch(pipeline, resume_after=None, max_await_time_ms=None):
+        watched.append(resume_after)
+        if resume_after is not None:
+            raise OperationFailure("resume point may no longer be in the oplog", code=286)
+        return FakeChangeStream(relay.collection, [event(1), None])
+
+    monkeypatch.setattr(relay.collection, "watch", watch, raising=False)
+    with pytest.raises(StopRelay):
+        await relay.run()
+
+    assert watched == [{"_data": "expired"}, None]
+    assert await stream_amounts(fake_redis) == [0.0, 1.0]
+    assert all(doc["published"] for doc in relay.collection.docs)
+    state = await relay.state_collection.find_one({"_id": RELAY_STATE_ID})
+    assert state["resume_token"] == {"_data": "1"}
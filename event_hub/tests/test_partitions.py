@@ -0,0 +1,112 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+from app.db.partitions import PartitionedEvents
+
+NOW = datetime(2024, 5, 10, 12, 0)
+
+
+@pytest.fixture
+def partitioned(fake_db):
+    return PartitionedEvents(fake_db, "events", retention_days=3, indexes=[], clock=lambda: NOW)
+
+
+def test_partition_names_bounded_by_range_and_retention(partitioned):
+    names = partitioned.partition_names(since=NOW - timedelta(days=1), until=NOW)
+    assert names == ["events_20240510", "events_20240509"]
+
+    # Без границ: от завтрашнего дня до конца retention
+    names = partitioned.partition_names()
+    assert names[0] == "events_20240511"
+    assert names[-1] == "events_20240507"
+    assert len(names) == 5
+
+
+@pytest.mark.asyncio
+async def test_insert_many_routes_by_day_and_remaps_errors(partitioned):
+    docs = [
+        {"timestamp": NOW, "idempotency_key": "a"},
+        {"timestamp": NOW - timedelta(days=1), "idempotency_key": "b"},
+        {"timestamp": NOW - timedelta(days=1), "idempotency_key": "dup"},
+        {"timestamp": NOW, "idempotency_key": "c"},
+    ]
+    partitioned.db["events_20240509"].duplicate_keys = {"dup"}
+
+    with pytest.raises(BulkWriteError) as exc:
+        await partitioned.insert_many(docs)
+
+    # Индекс ошибки - позиция в исходном списке, а не в партиции
+    assert [err["index"] for err in exc.value.details["writeErrors"]] == [2]
+    assert [doc["idempotency_key"] for doc in partitioned.db["events_20240510"].docs] == ["a", "c"]
+    assert [doc["idempotency_key"] for doc in partitioned.db["events_20240509"].docs] == ["b"]
+
+
+def test_partition_name_uses_utc_day(partitioned):
+    moscow = timezone(timedelta(hours=3))
+    # 01:30 по Москве 10 мая - это ещё 9 мая по UTC
+    assert partitioned.partition_name(datetime(2024, 5, 10, 1, 30, tzinfo=moscow)) == "events_20240509"
+    assert partitioned.partition_name(datetime(2024, 5, 10, 1, 30)) == "events_20240510"
+
+
+@pytest.mark.asyncio
+async def test_failed_partition_reported_per_document(partitioned):
+    docs = [
+        {"timestamp": NOW, "idempotency_key": "a"},
+        {"timestamp": NOW - timedelta(days=1), "idempotency_key": "b"},
+        {"timestamp": NOW, "idempotency_key": "c"},
+    ]
+    partitioned.db["events_20240509"].fail = ConnectionError("partition unavailable")
+
+    with pytest.raises(BulkWriteError) as exc:
+        await partitioned.insert_many(docs)
+
+    # Записанное в другую партицию не считается ошибкой
+    assert [err["index"] for err in exc.value.details["writeErrors"]] == [1]
+    assert exc.value.details["nInserted"] == 2
+    assert [doc["idempotency_key"] for doc in partitioned.db["events_20240510"].docs] == ["a", "c"]
+
+    partitioned.db["events_20240510"].fail = ConnectionError("mongo down")
+    with pytest.raises(ConnectionError):
+        await partitioned.insert_many(docs)
+
+
+@pytest.mark.asyncio
+async def test_find_sorted_stops_when_limit_reached(partitioned):
+    today = partitioned.db[partitioned.partition_name(NOW)]
+    yesterday = partitioned.db[partitioned.partition_name(NOW - timedelta(days=1))]
+    today.docs = [{"_id": i, "timestamp": NOW - timedelta(minutes=i)} for i in range(3)]
+    yesterday.docs = [{"_id": 10, "timestamp": NOW - timedelta(days=1)}]
+
+    docs = await partitioned.find_sorted({}, None, limit=2, since=NOW - timedelta(days=1), until=NOW)
+
+    assert [doc["_id"] for doc in docs] == [0, 1]
+    assert yesterday.queries == 0
+
+
+@pytest.mark.asyncio
+async def test_find_one_queries_partitions_concurrently(partitioned, monkeypatch):
+    # Событие задним числом: его партиция не совпадает с временем создания _id
+    await partitioned.insert_many([{"timestamp": NOW - timedelta(days=2), "idempotency_key": "k"}])
+    in_flight, peak = 0, 0
+
+    for name in partitioned.partition_names():
+        collection = partitioned.db[name]
+        original = collection.find_one
+
+        async def find_one(query, projection=None, original=original):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return await original(query, projection)
+
+        monkeypatch.setattr(collection, "find_one", find_one)
+
+    doc = await partitioned.find_one({"idempotency_key": "k"}, {"_id": 1})
+    assert doc is not None
+    assert peak == len(partitioned.partition_names())
+    assert await partitioned.find_one({"idempotency_key": "missing"}) is None
@@ -0,0 +1,105 @@
+from datetime import datetime
+
+import pytest
+
+from app.db.redis import ALL_EVENT_TYPES
+from app.db.rollups import RollupWriter, bucket_start
+
+TS = datetime(2024, 5, 10, 12, 34, 56, 789)
+
+
+def increments(ops):
+    return {
+        (op._filter["event_type"], op._filter["bucket_start"]): op._doc["$inc"]
+        for op in ops
+    }
+
+
+def test_bucket_start():
+    assert bucket_start(TS, "minute") == datetime(2024, 5, 10, 12, 34)
+    assert bucket_start(TS, "hour") == datetime(2024, 5, 10, 12)
+    assert bucket_start(TS, "day") == datetime(2024, 5, 10)
+
+
+@pytest.mark.asyncio
+async def test_flush_sums_batch_into_one_upsert_per_bucket(fake_db):
+    db = fake_db
+    writer = RollupWriter(db)
+    writer.add("purchase", 10.0, TS)
+    writer.add("purchase", 5.0, TS.replace(minute=1))
+    writer.add("view", 0.0, TS)
+
+    await writer.flush()
+
+    # Одна пачка операций на коллекцию
+    hourly = db["rollup_hour"].writes
+    assert len(hourly) == 1
+    assert increments(hourly[0]) == {
+        ("purchase", datetime(2024, 5, 10, 12)): {"total_amount": 15.0, "event_count": 2},
+        ("view", datetime(2024, 5, 10, 12)): {"total_amount": 0.0, "event_count": 1},
+        (ALL_EVENT_TYPES, datetime(2024, 5, 10, 12)): {"total_amount": 15.0, "event_count": 3},
+    }
+    assert len(db["rollup_minute"].writes[0]) == 5
+    assert len(writer) == 0
+
+
+def totals(db, granularity):
+    return {
+        (doc["event_type"], doc["bucket_start"]): (doc["total_amount"], doc["event_count"])
+        for doc in db[f"rollup_{granularity}"].docs
+    }
+
+
+@pytest.fixture(autouse=True)
+def reset_transactions(monkeypatch):
+    # Признак недоступности транзакций общий для процесса
+    monkeypatch.setattr(RollupWriter, "transactions", True)
+
+
+async def deliver(db, messages):
+    """Одна доставка пачки: новый RollupWriter, как в handle_rollup_batch"""
+    writer = RollupWriter(db)
+    for message_id, amount in messages:
+        writer.add("purchase", amount, TS, message_id)
+    await writer.flush()
+
+
+@pytest.mark.asyncio
+async def test_redelivery_after_partial_failure_not_double_counted(fake_db):
+    # Без replica set: minute записан, hour упал, пачка осталась в PEL
+    fake_db["rollup_hour"].fail = RuntimeError("write failed")
+    with pytest.raises(RuntimeError):
+        await deliver(fake_db, [("1-0", 10.0), ("2-0", 5.0)])
+    assert RollupWriter.transactions is False
+    fake_db["rollup_hour"].fail = None
+
+    # Повторная доставка вместе с новым сообщением
+    await deliver(fake_db, [("1-0", 10.0), ("2-0", 5.0), ("3-0", 1.0)])
+
+    minute = datetime(2024, 5, 10, 12, 34)
+    assert totals(fake_db, "minute")[("purchase", minute)] == (16.0, 3)
+    assert totals(fake_db, "hour")[("purchase", datetime(2024, 5, 10, 12))] == (16.0, 3)
+    assert totals(fake_db, "day")[(ALL_EVENT_TYPES, datetime(2024, 5, 10))] == (16.0, 3)
+
+    # Повтор уже учтённой пачки ничего не меняет
+    await deliver(fake_db, [("3-0", 1.0)])
+    assert totals(fake_db, "minute")[("purchase", minute)] == (16.0, 3)
+
+
+@pytest.mark.asyncio
+async def test_transaction_rolls_back_partial_flush(fake_db):
+    db = fake_db
+    db.transactions = True
+    db["rollup_day"].fail = RuntimeError("write failed")
+    with pytest.raises(RuntimeError):
+        await deliver(db, [("1-0", 10.0)])
+    # Ни одна гранулярность и ни одна запись журнала не остались
+    assert totals(db, "minute") == {} and totals(db, "hour") == {}
+    assert db["rollup_applied"].docs == []
+
+    db["rollup_day"].fail = None
+    await deliver(db, [("1-0", 10.0)])
+    await deliver(db, [("1-0", 10.0)])
+    assert RollupWriter.transactions is True
+    for granularity in ("minute", "hour", "day"):
+        assert sorted(totals(db, granularity).values()) == [(10.0, 1), (10.0, 1)]
@@ -0,0 +1,83 @@
+import sys
+from argparse import Namespace
+
+import pytest
+
+import run_prod
+from run_prod import ProdRunner, Worker
+
+
+@pytest.fixture
+def runner(tmp_path):
+    args = Namespace(host="127.0.0.1", port=0, grpc_port=50051, http_workers=2, grpc_workers=1,
+                     grace=1.0, metrics_dir=str(tmp_path))
+    runner = ProdRunner(args)
+    yield runner
+    if runner.http_socket is not None:
+        runner.http_socket.close()
+
+
+def test_http_workers_are_separate_processes_on_shared_socket(runner):
+    runner.build_workers()
+
+    http = [w for w in runner.workers if w.name.startswith("http")]
+    fd = runner.http_socket.fileno()
+    assert [w.name for w in http] == ["http-0", "http-1"]
+    for worker in http:
+        assert "--workers" not in worker.cmd
+        assert worker.cmd[worker.cmd.index("--fd") + 1] == str(fd)
+        assert worker.pass_fds == (fd,)
+    assert runner.http_socket.get_inheritable()
+
+
+def fake_clock(runner, monkeypatch, stop_when):
+    """time.sleep продвигает time.monotonic; супервизор останавливается по stop_when()"""
+    now = [0.0]
+
+    def sleep(seconds):
+        now[0] += seconds
+        runner.stopping = stop_when()
+
+    monkeypatch.setattr(run_prod.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(run_prod.time, "sleep", sleep)
+    return now
+
+
+def exited_worker(name):
+    worker = Worker(name, [sys.executable, "-c", "pass"], {})
+    worker.start()
+    worker.process.wait()
+    return worker
+
+
+def test_exited_worker_marked_dead_and_restarted(runner, monkeypatch):
+    dead = []
+    monkeypatch.setattr(run_prod.multiprocess, "mark_process_dead", dead.append)
+    worker = exited_worker("http-0")
+    runner.workers = [worker]
+    first_pid = worker.process.pid
+    fake_clock(runner, monkeypatch, lambda: worker.process.pid != first_pid)
+
+    runner.supervise()
+    worker.process.wait()
+
+    assert dead == [first_pid]
+    assert worker.restarts == 1 and worker.restart_at is None
+
+
+def test_restart_backoff_is_per_worker(runner, monkeypatch):
+    monkeypatch.setattr(run_prod.multiprocess, "mark_process_dead", lambda pid: None)
+    workers = [exited_worker("http-0"), exited_worker("grpc-0")]
+    # Первый воркер падал много раз и ждёт максимальный backoff
+    workers[0].restarts = 10
+    runner.workers = workers
+    pids = [worker.process.pid for worker in workers]
+    now = fake_clock(runner, monkeypatch, lambda: workers[1].process.pid != pids[1])
+
+    runner.supervise()
+    for worker in workers:
+        worker.process.wait()
+
+    # Второй перезапущен через свои 2 с, не дожидаясь 30 с первого
+    assert now[0] <= 3
+    assert workers[0].process.pid == pids[0] and workers[0].restart_at == 30
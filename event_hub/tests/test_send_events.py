@@ -0,0 +1,197 @@
+import asyncio
+
+import grpc
+import pytest
+import pytest_asyncio
+
+from app.grpc import server as grpc_server
+from app.grpc.server import EventServicer
+from client.grpc_client import EventClient
+from protos import event_pb2, event_pb2_grpc
+
+
+class FakeIngest:
+    """ingest_events: запоминает пачки, событие с amount < 0 отклоняется"""
+
+    def __init__(self):
+        self.batches = []
+
+    async def __call__(self, docs):
+        self.batches.append(len(docs))
+        saved = {
+            i: ValueError("negative amount") if doc["amount"] < 0 else f"id-{doc['user_id']}"
+            for i, doc in enumerate(docs)
+        }
+        return saved, True
+
+
+class FakeContext:
+    def invocation_metadata(self):
+        return ()
+
+
+def request(user_id, amount=1.0):
+    return event_pb2.EventRequest(user_id=user_id, event_type="purchase", amount=amount)
+
+
+async def requests(items, pause_after=None, pause=0.0, error=None):
+    for i, item in enumerate(items):
+        if i == pause_after:
+            await asyncio.sleep(pause)
+        yield item
+    if error is not None:
+        raise error
+
+
+@pytest.fixture
+def ingest(monkeypatch):
+    fake = FakeIngest()
+    monkeypatch.setattr(grpc_server, "ingest_events", fake)
+    monkeypatch.setattr(grpc_server, "SEND_EVENTS_BATCH_SIZE", 3)
+    monkeypatch.setattr(grpc_server, "SEND_EVENTS_MAX_DELAY", 0.05)
+    return fake
+
+
+async def collect(stream):
+    return [ack async for ack in stream]
+
+
+@pytest.mark.asyncio
+async def test_batches_cut_by_size(ingest):
+    items = [request(f"u{i}") for i in range(7)]
+    acks = await collect(EventServicer().SendEvents(requests(items), FakeContext()))
+
+    assert ingest.batches == [3, 3, 1]
+    assert [[a.index for a in ack.acks] for ack in acks] == [[0, 1, 2], [3, 4, 5], [6]]
+    assert [a.event_id for ack in acks for a in ack.acks] == [f"id-u{i}" for i in range(7)]
+
+
+@pytest.mark.asyncio
+async def test_batch_cut_by_timeout(ingest):
+    items = [request(f"u{i}") for i in range(3)]
+    stream = requests(items, pause_after=2, pause=0.2)
+    acks = await collect(EventServicer().SendEvents(stream, FakeContext()))
+
+    # Пауза клиента дольше SEND_EVENTS_MAX_DELAY: первые два уходят без третьего
+    assert ingest.batches == [2, 1]
+    assert [ack.accepted for ack in acks] == [2, 1]
+
+
+@pytest.mark.asyncio
+async def test_ack_reports_each_event(ingest):
+    items = [request("u0"), request("u1", amount=-1.0), request("u2")]
+    (ack,) = await collect(EventServicer().SendEvents(requests(items), FakeContext()))
+
+    assert (ack.accepted, ack.rejected) == (2, 1)
+    assert [a.status for a in ack.acks] == ["success", "error", "success"]
+    assert ack.acks[1].message == "negative amount"
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_rejected_and_stream_continues(ingest, monkeypatch):
+    calls = []
+
+    async def flaky(docs):
+        calls.append(len(docs))
+        if len(calls) == 1:
+            raise RuntimeError("mongo down")
+        return await FakeIngest()(docs)
+
+    monkeypatch.setattr(grpc_server, "ingest_events", flaky)
+    items = [request(f"u{i}") for i in range(4)]
+    acks = await collect(EventServicer().SendEvents(requests(items), FakeContext()))
+
+    assert [(ack.accepted, ack.rejected) for ack in acks] == [(0, 3), (1, 0)]
+    assert acks[0].acks[0].message == "mongo down"
+
+
+@pytest.mark.asyncio
+async def test_read_error_raised_after_accepted_batches(ingest):
+    items = [request(f"u{i}") for i in range(4)]
+    stream = EventServicer().SendEvents(requests(items, error=ConnectionError("client reset")), FakeContext())
+
+    acks = []
+    with pytest.raises(ConnectionError):
+        async for ack in stream:
+            acks.append(ack)
+    assert [a.index for ack in acks for a in ack.acks] == [0, 1, 2, 3]
+
+
+@pytest.mark.asyncio
+async def test_closing_stream_with_full_queue_does_not_hang(ingest):
+    # Читатель упирается в заполненную очередь, пока пачка ещё не подтверждена
+    items = [request(f"u{i}") for i in range(100)]
+    stream = EventServicer().SendEvents(requests(items), FakeContext())
+
+    await stream.__anext__()
+    await asyncio.sleep(0.01)
+    await asyncio.wait_for(stream.aclose(), 1)
+
+    # Отменённый читатель дождан, а не оставлен висеть
+    readers = [t for t in asyncio.all_tasks() if "read_requests" in repr(t.get_coro())]
+    assert readers == []
+
+
+@pytest_asyncio.fixture
+async def client(ingest):
+    server = grpc.aio.server()
+    event_pb2_grpc.add_EventServiceServicer_to_server(EventServicer(), server)
+    port = server.add_insecure_port("127.0.0.1:0")
+    await server.start()
+    client = EventClient("127.0.0.1", port)
+    await client.connect()
+    yield client
+    await client.close()
+    await server.stop(0)
+
+
+@pytest.mark.asyncio
+async def test_client_send_events_returns_ids_in_order(client, ingest):
+    events = [(f"u{i}", "purchase", -1.0 if i == 4 else 1.0) for i in range(5)]
+    event_ids = await client.send_events(events)
+
+    assert event_ids == ["id-u0", "id-u1", "id-u2", "id-u3", ""]
+    assert sum(ingest.batches) == 5
+
+
+@pytest.mark.asyncio
+async def test_client_send_events_from_async_iterator(client, ingest):
+    async def produce():
+        for i in range(4):
+            yield f"u{i}", "purchase", 1.0
+            await asyncio.sleep(0)
+
+    assert await client.send_events(produce()) == [f"id-u{i}" for i in range(4)]
+
+
+class FakeHub:
+    """events_hub: history и живые сообщения без Redis"""
+
+    def __init__(self, count):
+        self.count = count
+        self.batch_sizes = []
+
+    def subscribe(self, event_filter):
+        hub = self
+
+        class Subscription:
+            async def messages(self, cursor=None, batch_size=None):
+                hub.batch_sizes.append(batch_size)
+                for i in range(hub.count):
+                    yield f"{i}-0", {"event_id": str(i), "event_type": "purchase", "amount": 1.0}
+
+        return Subscription()
+
+
+@pytest.mark.asyncio
+async def test_stream_limit_is_read_size_not_total(monkeypatch):
+    hub = FakeHub(10)
+    monkeypatch.setattr(grpc_server, "events_hub", hub)
+
+    responses = [r async for r in EventServicer().StreamEvents(event_pb2.StreamRequest(limit=3), FakeContext())]
+    assert len(responses) == 10 and hub.batch_sizes == [3]
+
+    request = event_pb2.StreamRequest(max_events=4)
+    responses = [r async for r in EventServicer().StreamEvents(request, FakeContext())]
+    assert [r.event_id for r in responses] == ["0", "1", "2", "3"]
+    assert hub.batch_sizes[-1] is None
@@ -0,0 +1,118 @@
+import random
+
+import pytest
+
+from app.db.sketches import DDSketch, MinuteSketches, window_sketch_stats
+from app.graphql import schema as graphql_schema
+
+NOW = 1_700_000_000.0
+
+
+def test_ddsketch_relative_error_and_merge():
+    rng = random.Random(7)
+    values = [rng.lognormvariate(3, 1.5) for _ in range(20000)]
+    whole = DDSketch(0.01)
+    left, right = DDSketch(0.01), DDSketch(0.01)
+    for i, value in enumerate(values):
+        whole.add(value)
+        (left if i % 2 else right).add(value)
+
+    # Слияние - сложение счётчиков корзин
+    left.merge_fields({str(k): v for k, v in right.bins.items()})
+    assert left.bins == whole.bins
+
+    ordered = sorted(values)
+    for q in (0.5, 0.95, 0.99):
+        exact = ordered[int(q * (len(ordered) - 1))]
+        assert abs(whole.quantile(q) - exact) / exact <= 0.011
+
+
+def test_ddsketch_bounded_buckets():
+    sketch = DDSketch(0.01, max_buckets=64)
+    for i in range(1, 100000, 7):
+        sketch.add(float(i))
+    assert len(sketch.bins) <= 64
+    assert sketch.count == len(range(1, 100000, 7))
+
+
+@pytest.mark.asyncio
+async def test_window_merges_minute_sketches(fake_redis):
+    redis = fake_redis
+    sketches = MinuteSketches(redis, windows=(1, 5), clock=lambda: NOW)
+    await sketches.add([
+        ("alice", "purchase", 10.0, NOW - 120),
+        ("bob", "purchase", 20.0, NOW - 60),
+        ("alice", "purchase", 30.0, NOW),
+        ("carol", "view", 0.0, NOW),
+    ])
+
+    stats = await window_sketch_stats(redis, 5, "purchase", now=NOW)
+    assert stats["distinct_users"] == 2
+    assert stats["p50"] == pytest.approx(20.0, rel=0.01)
+
+    # В последней минуте: alice (30) и carol (0) по всем типам
+    last_minute = await window_sketch_stats(redis, 1, None, now=NOW)
+    assert last_minute["distinct_users"] == 2
+    assert last_minute["p50"] == 0.0
+    assert (await window_sketch_stats(redis, 1, "purchase", now=NOW))["p99"] == pytest.approx(30.0, rel=0.01)
+
+
+@pytest.mark.asyncio
+async def test_aggregated_metric_reads_sketches_only_when_requested(monkeypatch, fake_redis):
+    calls = []
+
+    async def fake_stats(redis, minutes, event_type):
+        calls.append((minutes, event_type))
+        return {"distinct_users": 3, "p50": 1.0, "p95": 2.0, "p99": 3.0}
+
+    monkeypatch.setattr(graphql_schema, "r", fake_redis)
+    monkeypatch.setattr(graphql_schema, "window_sketch_stats", fake_stats)
+
+    result = await graphql_schema.schema.execute("{ aggregatedMetrics(minutes: 5) { eventCount } }")
+    assert result.errors is None and calls == []
+
+    result = await graphql_schema.schema.execute(
+        '{ aggregatedMetrics(minutes: 5, eventType: "purchase") { distinctUsers p99Amount } }'
+    )
+    assert result.errors is None
+    assert result.data["aggregatedMetrics"] == {"distinctUsers": 3, "p99Amount": 3.0}
+    assert calls == [(5, "purchase")]
+
+
+def test_ddsketch_negative_values_mirrored():
+    sketch = DDSketch(0.01)
+    # Возвраты: 40% значений отрицательные
+    values = [-100.0] * 20 + [-5.0] * 20 + [0.0] * 10 + [10.0] * 50
+    for value in values:
+        sketch.add(value)
+
+    assert sketch.key(-5.0) == "n" + sketch.key(5.0)
+    assert sketch.quantile(0.0) == pytest.approx(-100.0, rel=0.01)
+    assert sketch.quantile(0.3) == pytest.approx(-5.0, rel=0.01)
+    assert sketch.quantile(0.45) == 0.0
+    assert sketch.quantile(0.6) == pytest.approx(10.0, rel=0.01)
+
+
+@pytest.mark.asyncio
+async def test_window_percentiles_with_refunds(fake_redis):
+    sketches = MinuteSketches(fake_redis, windows=(1, 5), clock=lambda: NOW)
+    await sketches.add([(f"u{i}", "refund", -float(i + 1), NOW) for i in range(99)] + [("u", "refund", 50.0, NOW)])
+
+    stats = await window_sketch_stats(fake_redis, 1, "refund", now=NOW)
+    assert stats["p50"] == pytest.approx(-50.0, rel=0.01)
+    assert stats["p99"] == pytest.approx(-1.0, rel=0.01)
+
+
+@pytest.mark.asyncio
+async def test_sketch_failure_logged_and_totals_returned(monkeypatch, fake_redis, caplog):
+    async def broken(redis, minutes, event_type):
+        raise ConnectionError("redis down")
+
+    monkeypatch.setattr(graphql_schema, "r", fake_redis)
+    monkeypatch.setattr(graphql_schema, "window_sketch_stats", broken)
+
+    with caplog.at_level("ERROR", logger="app.graphql.schema"):
+        result = await graphql_schema.schema.execute("{ aggregatedMetrics(minutes: 5) { eventCount p99Amount } }")
+    assert result.errors is None
+    assert result.data["aggregatedMetrics"] == {"eventCount": 0, "p99Amount": None}
+    assert "Error getting sketch metrics: redis down" in caplog.text
@@ -0,0 +1,134 @@
+import asyncio
+import pytest
+from app.queue.fanout import StreamHub, EventFilter, DISCONNECT, SlowConsumerError, parse_stream_id
+
+
+class FakeStreamRedis:
+    """Минимальный Redis Stream в памяти с подсчётом XREAD"""
+
+    def __init__(self):
+        self.entries = []
+        self.xread_calls = 0
+        self._seq = 0
+
+    def add(self, fields):
+        self._seq += 1
+        self.entries.append((f"{self._seq}-0", fields))
+
+    def _after(self, last_id):
+        return [e for e in self.entries if parse_stream_id(e[0]) > parse_stream_id(last_id)]
+
+    async def xrevrange(self, stream, count=None):
+        return list(reversed(self.entries))[:count]
+
+    async def xrange(self, stream, min="-", count=None):
+        return self._after(min.lstrip("("))[:count]
+
+    async def xread(self, streams, count=None, block=None):
+        self.xread_calls += 1
+        (stream, last_id), = streams.items()
+        await asyncio.sleep(0.001)
+        entries = self._after(last_id)[:count]
+        return [(stream, entries)] if entries else []
+
+
+async def take(agen, n):
+    return [await agen.__anext__() for _ in range(n)]
+
+
+@pytest.mark.asyncio
+async def test_hub_fans_out_with_single_reader():
+    """Все подписчики получают новые события от одного читателя"""
+    redis = FakeStreamRedis()
+    redis.add({"n": "old"})
+    hub = StreamHub(redis, "events", block_ms=1, decoder=dict)
+
+    streams = [hub.subscribe().messages() for _ in range(5)]
+    await asyncio.sleep(0.01)
+    calls_before = redis.xread_calls
+    redis.add({"n": "new"})
+
+    results = await asyncio.gather(*(take(s, 1) for s in streams))
+    assert all(r[0][1] == {"n": "new"} for r in results)
+    # Число XREAD не зависит от числа подписчиков
+    assert redis.xread_calls - calls_before < 5 * 3
+
+
+@pytest.mark.asyncio
+async def test_subscriber_resumes_from_cursor():
+    """С cursor подписчик сначала получает пропущенную историю"""
+    redis = FakeStreamRedis()
+    for i in range(3):
+        redis.add({"n": str(i)})
+    hub = StreamHub(redis, "events", block_ms=1, decoder=dict)
+
+    messages = hub.subscribe().messages(cursor="1-0")
+    received = await take(messages, 2)
+    assert [m[0] for m in received] == ["2-0", "3-0"]
+
+
+@pytest.mark.asyncio
+async def test_dlq_replays_not_delivered_to_subscribers():
+    """Повтор из DLQ адресован группе consumer'ов, подписчики его не видят"""
+    redis = FakeStreamRedis()
+    redis.add({"n": "0"})
+    redis.add({"n": "0", "replay_group": "rollups"})
+    redis.add({"n": "1"})
+    hub = StreamHub(redis, "events", block_ms=1, decoder=dict)
+
+    messages = hub.subscribe().messages(cursor="0-0")
+    received = await take(messages, 2)
+    assert [m[0] for m in received] == ["1-0", "3-0"]
+
+
+@pytest.mark.parametrize("policy", ["drop", DISCONNECT])
+@pytest.mark.asyncio
+async def test_backfill_longer_than_queue_keeps_live_messages(policy):
+    """Переполнение очереди во время догона не теряет и не отключает"""
+    redis = FakeStreamRedis()
+    for i in range(10):
+        redis.add({"n": str(i)})
+    hub = StreamHub(redis, "events", batch_size=4, block_ms=1, decoder=dict)
+    subscriber = hub.subscribe(queue_size=2, policy=policy)
+    messages = subscriber.messages(cursor="1-0")
+    await asyncio.sleep(0.01)
+
+    received = await take(messages, 3)
+    # Пока подписчик догоняет историю, приходят живые сообщения сверх очереди
+    for i in range(10, 15):
+        redis.add({"n": str(i)})
+    await asyncio.sleep(0.02)
+    received += await take(messages, 11)
+
+    assert [m[0] for m in received] == [f"{i}-0" for i in range(2, 16)]
+    assert subscriber.dropped == 0 and not subscriber.closed
+
+
+@pytest.mark.asyncio
+async def test_slow_subscriber_is_disconnected():
+    """Переполнение очереди отключает подписчика при политике disconnect"""
+    redis = FakeStreamRedis()
+    hub = StreamHub(redis, "events", block_ms=1, decoder=dict)
+    subscriber = hub.subscribe(queue_size=1, policy=DISCONNECT)
+
+    hub.dispatch([("1-0", {}), ("2-0", {})])
+
+    with pytest.raises(SlowConsumerError):
+        await take(subscriber.messages(), 1)
+
+
+@pytest.mark.asyncio
+async def test_dispatch_applies_filters():
+    """Подписчик получает только события, прошедшие его фильтр"""
+    hub = StreamHub(FakeStreamRedis(), "events", decoder=dict)
+    purchases = hub.subscribe(EventFilter(event_types=["purchase"], min_amount=50))
+    user = hub.subscribe(EventFilter(user_id="u1"))
+
+    hub.dispatch([
+        ("1-0", {"event_type": "purchase", "user_id": "u1", "amount": 100.0}),
+        ("2-0", {"event_type": "purchase", "user_id": "u2", "amount": 10.0}),
+        ("3-0", {"event_type": "return", "user_id": "u1", "amount": 70.0}),
+    ])
+
+    assert [purchases.queue.get_nowait()[0] for _ in range(purchases.queue.qsize())] == ["1-0"]
+    assert [user.queue.get_nowait()[0] for _ in range(user.queue.qsize())] == ["1-0", "3-0"]
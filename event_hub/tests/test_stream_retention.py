@@ -0,0 +1,67 @@
+import pytest
+
+from app.queue.retention import StreamTrimmer
+
+NOW = 1_700_000_000.0
+NOW_MS = int(NOW * 1000)
+
+
+class FakeRedis:
+    def __init__(self, groups, pending_min=None):
+        self.groups = groups
+        self.pending_min = pending_min or {}
+
+    async def xinfo_groups(self, stream):
+        return self.groups
+
+    async def xpending(self, stream, group):
+        return {"pending": self.groups and 1, "min": self.pending_min[group]}
+
+
+def group(name, last_delivered, pending=0):
+    return {"name": name, "last-delivered-id": last_delivered, "pending": pending}
+
+
+@pytest.mark.asyncio
+async def test_boundary_is_retention_window_without_groups():
+    trimmer = StreamTrimmer(FakeRedis([]), "events", retention=60)
+    assert await trimmer.safe_min_id(NOW) == (NOW_MS - 60_000, 0)
+
+
+@pytest.mark.asyncio
+async def test_slowest_group_unacked_entries_kept():
+    """Граница не заходит за неподтверждённые записи самой отстающей группы"""
+    old = NOW_MS - 600_000
+    redis = FakeRedis(
+        [
+            group("metrics", f"{NOW_MS - 1000}-0"),
+            group("printer", f"{old + 500}-3", pending=2),
+        ],
+        pending_min={"printer": f"{old}-7"},
+    )
+    trimmer = StreamTrimmer(redis, "events", retention=60)
+    assert await trimmer.safe_min_id(NOW) == (old, 7)
+
+
+@pytest.mark.asyncio
+async def test_fully_acked_group_boundary_after_last_delivered():
+    old = NOW_MS - 600_000
+    trimmer = StreamTrimmer(FakeRedis([group("metrics", f"{old}-4")]), "events", retention=60)
+    assert await trimmer.safe_min_id(NOW) == (old, 5)
+
+
+@pytest.mark.asyncio
+async def test_lagging_group_alerts_instead_of_trimming(fake_redis, caplog):
+    await fake_redis.xgroup_create("events", "metrics", id="0", mkstream=True)
+    for i in range(5):
+        await fake_redis.xadd("events", {"amount": str(i)})
+    await fake_redis.xreadgroup("metrics", "c1", {"events": ">"}, count=1)
+
+    trimmer = StreamTrimmer(fake_redis, "events", retention=0, length_alert=3)
+    with caplog.at_level("WARNING", logger="app.queue.retention"):
+        assert await trimmer.trim_once() == 0
+
+    # Неподтверждённая запись и всё после неё на месте, а отстающая группа названа
+    assert await fake_redis.xlen("events") == 5
+    assert trimmer.slowest_group == "metrics"
+    assert "group metrics" in caplog.text
@@ -0,0 +1,66 @@
+import pytest
+
+from app.db.window_totals import WindowTotals, window_totals
+from app.graphql import schema as graphql_schema
+
+NOW = 1_700_000_000.0
+
+
+@pytest.mark.asyncio
+async def test_replicas_add_to_shared_buckets(fake_redis):
+    # Две реплики consumer'а получают разные части stream'а
+    first = WindowTotals(fake_redis, windows=(1, 5), clock=lambda: NOW)
+    second = WindowTotals(fake_redis, windows=(1, 5), clock=lambda: NOW)
+    await first.add([("purchase", 10.0, NOW - 120), ("view", 0.0, NOW)])
+    await second.add([("purchase", 5.0, NOW), ("purchase", 2.5, NOW + 30)])
+
+    assert await window_totals(fake_redis, 5, "purchase", now=NOW) == (17.5, 3)
+    assert await window_totals(fake_redis, 1, "purchase", now=NOW) == (7.5, 2)
+    assert await window_totals(fake_redis, 5, None, now=NOW) == (17.5, 4)
+
+
+@pytest.mark.asyncio
+async def test_events_older_than_horizon_skipped_in_one_round_trip(fake_redis):
+    totals = WindowTotals(fake_redis, windows=(1, 5), clock=lambda: NOW)
+    await totals.add([("purchase", 1.0, NOW - 600)])
+    assert fake_redis.round_trips == 0
+
+    await totals.add([("purchase", 1.0, NOW - i) for i in range(50)])
+    assert fake_redis.round_trips == 1
+    assert await window_totals(fake_redis, 5, "purchase", now=NOW) == (50.0, 50)
+
+
+@pytest.mark.asyncio
+async def test_window_slides_across_minute_boundary(fake_redis):
+    minute = NOW - NOW % 60
+    totals = WindowTotals(fake_redis, windows=(1, 5), clock=lambda: minute + 2)
+    # Конец прошлой минуты и первые секунды текущей
+    await totals.add([("purchase", 4.0, minute - 30), ("purchase", 1.0, minute + 1)])
+
+    # В hh:mm:02 окно в минуту - это последние 60 с, а не 2 с текущей минуты
+    assert await window_totals(fake_redis, 1, "purchase", now=minute + 2) == (5.0, 2)
+    # В hh:mm:40 окно начинается после hh:(mm-1):30, и событие из него вышло
+    assert await window_totals(fake_redis, 1, "purchase", now=minute + 40) == (1.0, 1)
+
+
+@pytest.mark.asyncio
+async def test_boundary_bucket_prorated(fake_redis):
+    totals = WindowTotals(fake_redis, windows=(1,), clock=lambda: NOW, bucket_seconds=10)
+    await totals.add([("purchase", 10.0, NOW - 55) for _ in range(4)])
+
+    # Граница окна NOW-55 делит корзину [NOW-60, NOW-50) пополам
+    assert await window_totals(fake_redis, 1, "purchase", now=NOW + 5, bucket_seconds=10) == (20.0, 2)
+    assert await window_totals(fake_redis, 1, "purchase", now=NOW, bucket_seconds=10) == (40.0, 4)
+
+
+@pytest.mark.asyncio
+async def test_aggregated_metrics_sums_window_buckets(monkeypatch, fake_redis):
+    totals = WindowTotals(fake_redis)
+    await totals.add([("purchase", 4.0, None), ("purchase", 6.0, None)])
+    monkeypatch.setattr(graphql_schema, "r", fake_redis)
+
+    result = await graphql_schema.schema.execute(
+        '{ aggregatedMetrics(minutes: 15, eventType: "purchase") { totalAmount eventCount } }'
+    )
+    assert result.errors is None
+    assert result.data["aggregatedMetrics"] == {"totalAmount": 10.0, "eventCount": 2}
@@ -0,0 +1,30 @@
+import asyncio
+import pytest
+from app.db.coalescer import WriteCoalescer
+
+
+@pytest.mark.asyncio
+async def test_coalescer_merges_concurrent_writes(fake_collection):
+    """Конкурентные записи склеиваются в один insert_many"""
+    collection = fake_collection
+    coalescer = WriteCoalescer(collection, max_batch=100, max_delay=0.01)
+
+    docs = [{"n": i} for i in range(50)]
+    ids = await asyncio.gather(*(coalescer.submit(d) for d in docs))
+
+    assert collection.batches == [50]
+    assert ids == [d["_id"] for d in docs]
+    await coalescer.close()
+
+
+@pytest.mark.asyncio
+async def test_coalescer_respects_max_batch(fake_collection):
+    """Пачка не превышает max_batch документов"""
+    collection = fake_collection
+    coalescer = WriteCoalescer(collection, max_batch=10, max_delay=0.01)
+
+    await asyncio.gather(*(coalescer.submit({"n": i}) for i in range(35)))
+
+    assert max(collection.batches) <= 10
+    assert sum(collection.batches) == 35
+    await coalescer.close()